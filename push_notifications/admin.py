@@ -3,7 +3,9 @@ from django.contrib.auth import get_user_model
 from django.db import connection
 from django.utils.translation import ugettext_lazy as _
 
-from .models import APNSDevice, GCMDevice, get_expired_tokens
+from .bulk import matching
+from .models import (APNSDevice, GCMDevice, ScheduledNotification, Segment,
+                     Topic, get_expired_tokens)
 
 User = get_user_model()
 
@@ -33,7 +35,7 @@ class DeviceAdmin(admin.ModelAdmin):
 
 	def send_bulk_message(self, request, queryset):
 		r = queryset.send_message("Test bulk notification")
-		self.message_user(request, _("All messages were sent: %s" % (r)))
+		self.message_user(request, _("Messages were sent: %s") % (r))
 	send_bulk_message.short_description = _("Send test message in bulk")
 
 	def enable(self, request, queryset):
@@ -52,10 +54,10 @@ class DeviceAdmin(admin.ModelAdmin):
 		# could very easily leave an expired device as active.  Maybe
 		#  this is just a bad API.
 		expired = get_expired_tokens()
-		devices = queryset.filter(registration_id__in=expired)
-		for d in devices:
-			d.active = False
-			d.save()
+		for devices in matching(queryset, "registration_id", expired):
+			for d in devices:
+				d.active = False
+				d.save()
 
 
 class GCMDeviceAdmin(DeviceAdmin):
@@ -73,5 +75,31 @@ class GCMDeviceAdmin(DeviceAdmin):
 	list_display = ("__unicode__", "device_id_hex", "user", "active", "date_created")
 
 
+class SegmentAdmin(admin.ModelAdmin):
+	list_display = ("name", "service", "filters", "dirty", "date_refreshed")
+	actions = ("refresh", )
+
+	def refresh(self, request, queryset):
+		for segment in queryset:
+			segment.refresh()
+	refresh.short_description = _("Refresh selected segments")
+
+
+class TopicAdmin(admin.ModelAdmin):
+	list_display = ("name", "date_created")
+	search_fields = ("name", )
+	# subscriptions go through Topic.subscribe() to reach GCM
+	exclude = ("apns_devices", "gcm_devices")
+
+
+class ScheduledNotificationAdmin(admin.ModelAdmin):
+	list_display = ("__unicode__", "service", "due_at", "date_sent", "devices", "failures")
+	list_filter = ("service", )
+	date_hierarchy = "due_at"
+
+
 admin.site.register(APNSDevice, DeviceAdmin)
 admin.site.register(GCMDevice, GCMDeviceAdmin)
+admin.site.register(Segment, SegmentAdmin)
+admin.site.register(Topic, TopicAdmin)
+admin.site.register(ScheduledNotification, ScheduledNotificationAdmin)
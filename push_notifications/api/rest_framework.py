@@ -1,11 +1,17 @@
 from __future__ import absolute_import
 
-from rest_framework import permissions
-from rest_framework.serializers import ModelSerializer, ValidationError
+from django.db import transaction
+from django.shortcuts import get_object_or_404
+from rest_framework import permissions, status
+from rest_framework.decorators import detail_route, list_route
+from rest_framework.response import Response
+from rest_framework.serializers import CharField, ModelSerializer, Serializer, ValidationError
 from rest_framework.viewsets import ModelViewSet
 from rest_framework.fields import IntegerField
 
-from push_notifications.models import APNSDevice, GCMDevice
+from push_notifications.bulk import bulk_update, matching
+from push_notifications.models import (APNSDevice, GCMDevice, Topic, mark_segments_dirty,
+                                       topic_name_validator)
 from push_notifications.fields import hex_re
 
 
@@ -35,6 +41,8 @@ class APNSDeviceSerializer(ModelSerializer):
 
 	class Meta(DeviceSerializerMixin.Meta):
 		model = APNSDevice
+		# re-registering an existing device updates it, see DeviceViewSetMixin
+		extra_kwargs = {"registration_id": {"validators": []}}
 
 	def validate_registration_id(self, value):
 		# iOS device tokens are 256-bit hexadecimal (64 characters)
@@ -56,6 +64,10 @@ class GCMDeviceSerializer(ModelSerializer):
 		model = GCMDevice
 
 
+class TopicSubscriptionSerializer(Serializer):
+	topic = CharField(max_length=255, validators=[topic_name_validator])
+
+
 # Permissions
 class IsOwner(permissions.BasePermission):
 	def has_object_permission(self, request, view, obj):
@@ -64,13 +76,142 @@ class IsOwner(permissions.BasePermission):
 
 
 # Mixins
+FOREIGN_DEVICE_ERROR = "This device is already registered by another user."
+
+
 class DeviceViewSetMixin(object):
 	lookup_field = "registration_id"
 
+	def get_foreign_registration_ids(self, registration_ids):
+		"""
+		Returns those of the registration ids which belong to devices outside of
+		get_queryset(), such as the devices of other users for the authorized
+		viewsets. These cannot be registered again through this viewset.
+		"""
+		queryset = self.get_queryset()
+		foreign = set()
+		for devices in matching(queryset.model.objects.all(), "registration_id", registration_ids):
+			foreign.update(
+				devices.exclude(pk__in=queryset.values("pk")).values_list("registration_id", flat=True)
+			)
+		return foreign
+
+	def create(self, request, *args, **kwargs):
+		# registering a known device again updates it, which is not a creation
+		response = super(DeviceViewSetMixin, self).create(request, *args, **kwargs)
+		if self.updated:
+			response.status_code = status.HTTP_200_OK
+		return response
+
 	def perform_create(self, serializer):
+		# registering a device twice updates it rather than creating a duplicate,
+		# and reactivates it unless told otherwise
+		attrs = dict(serializer.validated_data)
+		if "active" not in self.request.data:
+			# DRF reads a boolean missing from form data as False
+			attrs["active"] = True
+		if self.get_foreign_registration_ids([attrs["registration_id"]]):
+			raise ValidationError({"registration_id": [FOREIGN_DEVICE_ERROR]})
 		if self.request.user.is_authenticated():
-			serializer.save(user=self.request.user)
-		return super(DeviceViewSetMixin, self).perform_create(serializer)
+			attrs["user"] = self.request.user
+		model = self.get_queryset().model
+		self.updated = model.objects.filter(registration_id=attrs["registration_id"]).exists()
+		serializer.instance = model.objects.upsert(**attrs)
+
+	@list_route(methods=["post"])
+	def bulk(self, request):
+		"""
+		Registers a list of devices at once.
+		Devices whose registration_id is already registered are updated together
+		(and reactivated), and new ones are inserted together. The response holds
+		the status of every item: "created", "updated", "unchanged", "duplicate"
+		(already in the request) or "invalid" (along with the validation errors,
+		which include registration ids of devices outside get_queryset()).
+		"""
+		if not isinstance(request.data, list):
+			raise ValidationError("Expected a list of devices.")
+
+		registration_ids = [
+			item["registration_id"] for item in request.data
+			if isinstance(item, dict) and item.get("registration_id")
+		]
+		model = self.get_queryset().model
+		foreign = self.get_foreign_registration_ids(registration_ids)
+		existing = {}
+		for devices in matching(self.get_queryset(), "registration_id", registration_ids):
+			existing.update((device.registration_id, device) for device in devices)
+
+		results = []
+		seen = set()
+		created = []
+		updated = []
+		updated_fields = set()
+		with transaction.atomic():
+			for item in request.data:
+				registration_id = item.get("registration_id") if isinstance(item, dict) else None
+				if registration_id in seen:
+					results.append({"registration_id": registration_id, "status": "duplicate"})
+					continue
+				if registration_id in foreign:
+					results.append({
+						"registration_id": registration_id, "status": "invalid",
+						"errors": {"registration_id": [FOREIGN_DEVICE_ERROR]}
+					})
+					continue
+				instance = existing.get(registration_id)
+				serializer = self.get_serializer(instance, data=item)
+				if not serializer.is_valid():
+					results.append({"registration_id": registration_id, "status": "invalid", "errors": serializer.errors})
+					continue
+				seen.add(registration_id)
+
+				attrs = dict(serializer.validated_data)
+				if "active" not in item:
+					attrs["active"] = True
+				if instance is None:
+					if request.user.is_authenticated():
+						attrs["user"] = request.user
+					created.append(model(**attrs))
+					status = "created"
+				else:
+					changed = [field for field, value in attrs.items() if getattr(instance, field) != value]
+					for field in changed:
+						setattr(instance, field, attrs[field])
+					if request.user.is_authenticated() and instance.user_id != request.user.pk:
+						instance.user = request.user
+						changed.append("user")
+					if changed:
+						updated.append(instance)
+						updated_fields.update(changed)
+					status = "updated" if changed else "unchanged"
+				results.append({"registration_id": registration_id, "status": status})
+
+			bulk_update(self.get_queryset(), updated, sorted(updated_fields))
+			model.objects.bulk_create(created)
+			if updated or created:
+				mark_segments_dirty(model)
+
+		return Response(results)
+
+	@detail_route(methods=["post"])
+	def subscribe(self, request, registration_id=None):
+		""" Subscribes the device to a topic, creating the topic if needed """
+		device = self.get_object()
+		serializer = TopicSubscriptionSerializer(data=request.data)
+		serializer.is_valid(raise_exception=True)
+		topic, created = Topic.objects.get_or_create(name=serializer.validated_data["topic"])
+		topic.subscribe([device])
+		return Response({"topic": topic.name, "subscribed": True})
+
+	@detail_route(methods=["post"])
+	def unsubscribe(self, request, registration_id=None):
+		""" Unsubscribes the device from a topic """
+		device = self.get_object()
+		serializer = TopicSubscriptionSerializer(data=request.data)
+		serializer.is_valid(raise_exception=True)
+		topic = get_object_or_404(Topic, name=serializer.validated_data["topic"])
+		topic.unsubscribe([device])
+		return Response({"topic": topic.name, "subscribed": False})
 
 
 class AuthorizedMixin(object):
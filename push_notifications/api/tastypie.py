@@ -1,17 +1,47 @@
+from __future__ import absolute_import
+
 from tastypie.authorization import Authorization
 from tastypie.authentication import BasicAuthentication
+from tastypie.exceptions import ImmediateHttpResponse
 from tastypie.resources import ModelResource
 from push_notifications.models import APNSDevice, GCMDevice
 
 
-class APNSDeviceResource(ModelResource):
+class DeviceResource(ModelResource):
+	def obj_create(self, bundle, **kwargs):
+		"""
+		Registering a device twice updates it rather than creating a duplicate.
+		"""
+		bundle.obj = self._meta.object_class()
+		for key, value in kwargs.items():
+			setattr(bundle.obj, key, value)
+		bundle = self.full_hydrate(bundle)
+
+		self.is_valid(bundle)
+		if bundle.errors:
+			raise ImmediateHttpResponse(response=self.error_response(bundle.request, bundle.errors))
+		self.authorized_create_detail(self.get_object_list(bundle.request), bundle)
+
+		defaults = dict(
+			(field.attname, getattr(bundle.obj, field.attname))
+			for field in bundle.obj._meta.concrete_fields
+			if not field.primary_key and (field.name in bundle.data or field.name in kwargs)
+		)
+		registration_id = defaults.pop("registration_id", bundle.obj.registration_id)
+		# registering an invalidated device again reactivates it
+		defaults.setdefault("active", True)
+		bundle.obj = self._meta.object_class.objects.upsert(registration_id, **defaults)
+		return bundle
+
+
+class APNSDeviceResource(DeviceResource):
 	class Meta:
 		authorization = Authorization()
 		queryset = APNSDevice.objects.all()
 		resource_name = "device/apns"
 
 
-class GCMDeviceResource(ModelResource):
+class GCMDeviceResource(DeviceResource):
 	class Meta:
 		authorization = Authorization()
 		queryset = GCMDevice.objects.all()
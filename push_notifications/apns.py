@@ -6,18 +6,32 @@ https://developer.apple.com/library/ios/documentation/NetworkingInternet/Concept
 
 import codecs
 import json
+import os
 import socket
 import struct
+import threading
 import time
 from binascii import unhexlify, Error as BinasciiError
+from collections import deque
 from contextlib import closing
 
 import ssl
 from django.core.exceptions import ImproperlyConfigured
 
 from . import NotificationError
+from .dedupe import RecipientFilter
+from .deliverylog import get_delivery_log
+from .invalidation import invalidate_device, invalidate_registrations
+from .ratelimit import get_rate_limiter
+from .results import SendResult
 from .settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
 
+try:
+	from queue import Queue
+except ImportError:
+	# Python 2 support
+	from Queue import Queue
+
 
 class APNSError(NotificationError):
 	pass
@@ -38,6 +52,60 @@ class APNSDataOverflow(APNSError):
 	pass
 
 
+# SSLContexts by (certificate, CA certificates), with the certificate's mtime
+_ssl_contexts = {}
+# the last TLS session (and its context) of each address, to resume it when reconnecting
+_ssl_sessions = {}
+_ssl_lock = threading.Lock()
+
+
+def _new_ssl_context(ca_certs):
+	if hasattr(ssl, "create_default_context"):
+		# TLS with the highest version both sides support
+		context = ssl.create_default_context(cafile=ca_certs)
+		if not ca_certs:
+			context.check_hostname = False
+			context.verify_mode = ssl.CERT_NONE
+		return context
+	# Python 3.3
+	context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+	context.options |= ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3
+	if ca_certs:
+		context.verify_mode = ssl.CERT_REQUIRED
+		context.load_verify_locations(ca_certs)
+	return context
+
+
+def _apns_ssl_context(certfile, ca_certs=None):
+	"""
+	Returns the SSLContext of a certificate. It is built once and rebuilt
+	when the certificate file is modified. The server is verified against
+	`ca_certs`, when set. Returns None on Python 2.7 before 2.7.9, which has
+	no SSLContext.
+	"""
+	try:
+		mtime = os.stat(certfile).st_mtime
+	except OSError as e:
+		raise ImproperlyConfigured("The APNS certificate file at %r is not readable: %s" % (certfile, e))
+	if not hasattr(ssl, "SSLContext"):
+		return None
+
+	key = (certfile, ca_certs)
+	with _ssl_lock:
+		cached = _ssl_contexts.get(key)
+		if cached is not None and cached[0] == mtime:
+			return cached[1]
+
+		context = _new_ssl_context(ca_certs)
+		try:
+			context.load_cert_chain(certfile)
+		except (IOError, ssl.SSLError) as e:
+			raise ImproperlyConfigured("The APNS certificate file at %r is not readable: %s" % (certfile, e))
+
+		_ssl_contexts[key] = (mtime, context)
+		return context
+
+
 def _apns_create_socket(address_tuple, certificate=None):
 	certfile = SETTINGS.get("APNS_CERTIFICATE") if certificate is None else certificate
 
@@ -46,17 +114,30 @@ def _apns_create_socket(address_tuple, certificate=None):
 			'You need to set PUSH_NOTIFICATIONS_SETTINGS["APNS_CERTIFICATE"] to send messages through APNS.'
 		)
 
-	try:
-		with open(certfile, "r") as f:
-			f.read()
-	except Exception as e:
-		raise ImproperlyConfigured("The APNS certificate file at %r is not readable: %s" % (certfile, e))
-
 	ca_certs = SETTINGS.get("APNS_CA_CERTIFICATES")
-
-	sock = socket.socket()
-	sock = ssl.wrap_socket(sock, ssl_version=ssl.PROTOCOL_TLSv1, certfile=certfile, ca_certs=ca_certs)
+	context = _apns_ssl_context(certfile, ca_certs)
+	if context is None:
+		# Python 2.7 before 2.7.9: the certificate is read on every connection
+		sock = ssl.wrap_socket(
+			socket.socket(), ssl_version=ssl.PROTOCOL_TLSv1, certfile=certfile, ca_certs=ca_certs,
+			cert_reqs=ssl.CERT_REQUIRED if ca_certs else ssl.CERT_NONE
+		)
+		sock.connect(address_tuple)
+		return sock
+
+	kwargs = {}
+	if hasattr(ssl, "SSLSession"):
+		# resuming the previous session skips most of the handshake (Python 3.6+)
+		with _ssl_lock:
+			previous = _ssl_sessions.get(address_tuple)
+		if previous is not None and previous[0] is context:
+			kwargs["session"] = previous[1]
+
+	sock = context.wrap_socket(socket.socket(), server_hostname=address_tuple[0], **kwargs)
 	sock.connect(address_tuple)
+	if hasattr(ssl, "SSLSession"):
+		with _ssl_lock:
+			_ssl_sessions[address_tuple] = (context, sock.session)
 
 	return sock
 
@@ -76,10 +157,14 @@ def _apns_create_socket_to_feedback(certificate=None):
 
 
 def _apns_pack_frame(token_hex, payload, identifier, expiration, priority):
-	try:
-		token = unhexlify(token_hex)
-	except (TypeError, BinasciiError):
-		raise InvalidRegistration()
+	# raw tokens are passed as a bytearray, see apns_send_bulk_message()
+	if isinstance(token_hex, bytearray):
+		token = bytes(token_hex)
+	else:
+		try:
+			token = unhexlify(token_hex)
+		except (TypeError, BinasciiError):
+			raise InvalidRegistration()
 	# |COMMAND|FRAME-LEN|{token}|{payload}|{id:4}|{expiration:4}|{priority:1}
 	frame_len = 3 * 5 + len(token) + len(payload) + 4 + 4 + 1  # 5 items, each 3 bytes prefix, then each item length
 	frame_fmt = "!BIBH%ssBH%ssBHIBHIBHB" % (len(token), len(payload))
@@ -229,62 +314,241 @@ def apns_send_message(device, alert, certificate=None, **kwargs):
 			**kwargs
 		)
 	except InvalidRegistration:
-		if not hasattr(device, 'invalidate'):
-			cls = device.__class__
-			cls.objects.filter(registration_id=device.registration_id).update(active=False)
-		else:
-			device.invalidate()
+		invalidate_device(device)
+
+
+# names of the error statuses of the APNS binary protocol
+APNS_ERRORS = {
+	1: "ProcessingError",
+	2: "MissingDeviceToken",
+	3: "MissingTopic",
+	4: "MissingPayload",
+	5: "InvalidTokenSize",
+	6: "InvalidTopicSize",
+	7: "InvalidPayloadSize",
+	8: "InvalidToken",
+	10: "Shutdown",
+	255: "Unknown",
+}
+
+# reconnections in a row, without any progress, before giving up on a stripe
+APNS_MAX_RECONNECTIONS = 3
+# devices kept by a stripe to send again when APNS reports an error
+APNS_RESEND_WINDOW = 10000
+# devices waiting to be sent by each stripe
+APNS_STRIPE_QUEUE_SIZE = 1000
+
+_DONE = object()
+
+
+def _apns_send_stripe(devices, alert, certificate=None, limiter=None, invalid=None, **kwargs):
+	"""
+	Sends a notification to an iterable of devices on its own connection,
+	the identifier of each device being its position. When APNS reports an
+	error, or drops the connection, the devices after the last one APNS
+	accepted are sent again on a new connection; only the last
+	APNS_RESEND_WINDOW devices sent are kept for that. The devices found
+	invalid are appended to the `invalid` list.
+	Returns a SendResult, in the order of the devices.
+	"""
+	devices = iter(devices)
+	pks = []
+	statuses = []
+	errors = {}
+	# (position, device) to send again, then those sent on the connection
+	pending = deque()
+	window = deque(maxlen=APNS_RESEND_WINDOW)
+	reconnections = 0
+
+	def next_device():
+		if pending:
+			return pending.popleft()
+		for device in devices:
+			pks.append(device.pk)
+			statuses.append(SendResult.SENT)
+			return len(pks) - 1, device
+		return None
 
+	def set_invalid(position, device):
+		statuses[position] = SendResult.INVALID
+		errors[position] = "InvalidRegistration"
+		if invalid is not None:
+			invalid.append(device)
+
+	item = next_device()
+	while item is not None:
+		start = item[0]
+		failed = None
+		window.clear()
+		with closing(_apns_create_socket_to_push(certificate=certificate)) as sock:
+			try:
+				while item is not None:
+					position, device = item
+					window.append(item)
+					if limiter:
+						limiter.acquire()
+					# splice the binary token of the device when it has one
+					binary_token = getattr(device, "binary_token", None)
+					try:
+						_apns_send(
+							bytearray(binary_token) if binary_token else device.registration_id,
+							alert,
+							identifier=position,
+							socket=sock,
+							certificate=certificate,
+							**kwargs
+						)
+					except InvalidRegistration:
+						set_invalid(position, device)
+					item = next_device()
+			except (socket.error, ssl.SSLError):
+				# APNS closes the connection after an error, read it below
+				failed = item
 
-def apns_send_bulk_message(devices, alert, certificate=None, **kwargs):
+			try:
+				_apns_check_errors(sock)
+			except APNSServerError as e:
+				sent = dict(window)
+				if e.identifier not in sent:
+					raise
+				if e.status == 8:
+					set_invalid(e.identifier, sent[e.identifier])
+				elif e.status != 10:
+					# on shutdown, the identifier is the last notification sent
+					statuses[e.identifier] = SendResult.ERROR
+					errors[e.identifier] = APNS_ERRORS.get(e.status, "Unknown")
+				# the window is in the order of the positions, before the pending ones
+				pending.extendleft(reversed([pair for pair in window if pair[0] > e.identifier]))
+				reconnections = 0
+				item = next_device()
+				continue
+			except (socket.error, ssl.SSLError):
+				pass
+
+		if failed is not None:
+			# the connection was lost without an error: the notifications that
+			# were in flight may be lost, resend from the one that failed
+			reconnections = reconnections + 1 if failed[0] == start else 1
+			if reconnections > APNS_MAX_RECONNECTIONS:
+				raise APNSError("The connection to APNS was lost %i times in a row." % (reconnections))
+			pending.appendleft(failed)
+			item = next_device()
+
+	ret = SendResult()
+	for position, pk in enumerate(pks):
+		ret.add(pk, statuses[position], error=errors.get(position))
+	return ret
+
+
+def apns_send_bulk_message(devices, alert, certificate=None, connections=None, **kwargs):
 	"""
 	Sends an APNS notification to one or more devices.
-	The devices argument needs to be a list.
+	The devices argument needs to be an iterable of devices or Recipients.
 
 	Note that if set alert should always be a string. If it is not set,
 	it won't be included in the notification. You will need to pass None
 	to this for silent notifications.
+
+	Devices sharing a registration_id are only sent the notification once.
+	The devices are striped over `connections` (APNS_CONNECTIONS by default)
+	connections, sending in parallel threads fed through bounded queues.
+	Returns a SendResult. Devices are marked as sent once written to the
+	socket, APNS only reports errors. When a stripe fails, the results of the
+	others are still invalidated and logged before its exception is raised.
 	"""
-	invalid_devices = []
-	with closing(_apns_create_socket_to_push(certificate=certificate)) as socket:
-		for identifier, device in enumerate(devices):
-			try:
-				_apns_send(
-					device.registration_id,
-					alert,
-					identifier=identifier,
-					socket=socket,
-					certificate=certificate,
-					**kwargs
-				)
-			except InvalidRegistration:
-				invalid_devices.append(device)
-		_apns_check_errors(socket)
+	recipients = RecipientFilter()
+	limiter = get_rate_limiter("APNS", certificate or SETTINGS.get("APNS_CERTIFICATE"))
+	connections = max(1, connections or SETTINGS["APNS_CONNECTIONS"])
+	results = [None] * connections
+	invalid = []
+	exceptions = []
+	failed = set()
+
+	def send(i, devices):
+		try:
+			results[i] = _apns_send_stripe(
+				devices, alert, certificate=certificate, limiter=limiter, invalid=invalid, **kwargs
+			)
+		except Exception as e:
+			exceptions.append(e)
+			failed.add(i)
+			return True
+
+	def send_queued(i, queue):
+		devices = iter(queue.get, _DONE)
+		if send(i, devices):
+			# drain the queue of the stripe, so that queuing never blocks
+			for device in devices:
+				pass
+
+	if connections == 1:
+		send(0, recipients.unique(devices))
+	else:
+		queues = [Queue(APNS_STRIPE_QUEUE_SIZE) for i in range(connections)]
+		threads = [
+			threading.Thread(target=send_queued, args=(i, queues[i]))
+			for i in range(connections)
+		]
+		for thread in threads:
+			thread.start()
+		try:
+			i = 0
+			for device in recipients.unique(devices):
+				if len(failed) == connections:
+					break
+				# round-robin over the stripes that did not fail
+				while i in failed:
+					i = (i + 1) % connections
+				queues[i].put(device)
+				i = (i + 1) % connections
+		finally:
+			for queue in queues:
+				queue.put(_DONE)
+			for thread in threads:
+				thread.join()
+
+	ret = SendResult.merged([result for result in results if result is not None])
 
 	# GCMDevice and APNSDevice cannot be used together
 	# so we don't need to keep track the class of every device.
 	cls = None
 	invalid_registrations = []
-	for device in invalid_devices:
+	for device in invalid:
 		if not hasattr(device, 'invalidate'):
 			cls = device.__class__
 			invalid_registrations.append(device.registration_id)
 		else:
-			device.invalidate()
+			invalidate_device(device)
 
 	if cls:
-		cls.objects.filter(registration_id__in=invalid_registrations).update(active=False)
+		invalidate_registrations(cls.objects.model, invalid_registrations)
 
+	ret.duplicates = recipients.duplicates
+	ret.responses.append({"duplicates": recipients.duplicates})
 
-def apns_fetch_inactive_ids(certificate=None):
+	log = get_delivery_log("APNS", alert)
+	if log:
+		log.add(ret)
+		log.close()
+	if exceptions:
+		raise exceptions[0]
+	return ret
+
+
+def apns_fetch_inactive_tokens(certificate=None):
 	"""
-	Queries the APNS server for id's that are no longer active since
-	the last fetch
+	Queries the APNS server for the raw tokens that are no longer active
+	since the last fetch. See APNSDeviceQuerySet.filter_tokens().
 	"""
 	with closing(_apns_create_socket_to_feedback(certificate=certificate)) as socket:
-		inactive_ids = []
 		# Maybe we should have a flag to return the timestamp?
 		# It doesn't seem that useful right now, though.
-		for tStamp, registration_id in _apns_receive_feedback(socket, certificate=certificate):
-			inactive_ids.append(codecs.encode(registration_id, 'hex_codec'))
-		return inactive_ids
+		return [token for tStamp, token in _apns_receive_feedback(socket)]
+
+
+def apns_fetch_inactive_ids(certificate=None):
+	"""
+	Queries the APNS server for id's that are no longer active since
+	the last fetch
+	"""
+	return [codecs.encode(token, 'hex_codec') for token in apns_fetch_inactive_tokens(certificate=certificate)]
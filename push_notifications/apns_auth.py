@@ -0,0 +1,95 @@
+"""
+Token-based authentication for the APNS HTTP/2 provider API.
+Provider tokens are ES256 JWTs signed with the .p8 key of APNS_AUTH_KEY_PATH.
+A token is signed once and shared by every connection and thread of the
+process, then signed again once it is APNS_TOKEN_LIFETIME seconds old: Apple
+rejects tokens older than an hour, and refreshing them more than once every
+20 minutes.
+Requires PyJWT, with the cryptography package for ES256.
+"""
+
+import threading
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+
+
+_clock = getattr(time, "monotonic", time.time)
+
+
+class TokenProvider(object):
+	"""
+	Signs and caches the provider token of one key, for one team.
+	"""
+	def __init__(self, key_path, key_id, team_id, lifetime=None):
+		self.key_path = key_path
+		self.key_id = key_id
+		self.team_id = team_id
+		self.lifetime = lifetime or SETTINGS["APNS_TOKEN_LIFETIME"]
+		self._key = None
+		self._token = None
+		self._signed = None
+		self.lock = threading.Lock()
+
+	def _sign(self):
+		try:
+			import jwt
+		except ImportError:
+			raise ImproperlyConfigured("PyJWT is required for token-based APNS authentication.")
+
+		if self._key is None:
+			try:
+				with open(self.key_path, "r") as f:
+					self._key = f.read()
+			except IOError as e:
+				raise ImproperlyConfigured("The APNS auth key file at %r is not readable: %s" % (self.key_path, e))
+
+		token = jwt.encode(
+			{"iss": self.team_id, "iat": int(time.time())},
+			self._key,
+			algorithm="ES256",
+			headers={"kid": self.key_id},
+		)
+		# PyJWT < 2 returns bytes
+		return token.decode("ascii") if isinstance(token, bytes) else token
+
+	@property
+	def token(self):
+		""" Returns the current token, signing a new one if it expired """
+		with self.lock:
+			now = _clock()
+			if self._token is None or now - self._signed >= self.lifetime:
+				self._token = self._sign()
+				self._signed = now
+			return self._token
+
+	def headers(self):
+		""" Returns the authorization header of APNS requests """
+		return {"authorization": "bearer %s" % (self.token)}
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_token_provider(key_path=None, key_id=None, team_id=None):
+	"""
+	Returns the shared TokenProvider of a key, APNS_AUTH_KEY_PATH,
+	APNS_AUTH_KEY_ID and APNS_TEAM_ID by default.
+	"""
+	key_path = key_path or SETTINGS.get("APNS_AUTH_KEY_PATH")
+	key_id = key_id or SETTINGS.get("APNS_AUTH_KEY_ID")
+	team_id = team_id or SETTINGS.get("APNS_TEAM_ID")
+	if not (key_path and key_id and team_id):
+		raise ImproperlyConfigured(
+			'You need to set PUSH_NOTIFICATIONS_SETTINGS["APNS_AUTH_KEY_PATH"], ["APNS_AUTH_KEY_ID"] and '
+			'["APNS_TEAM_ID"] to use token-based APNS authentication.'
+		)
+
+	key = (key_path, key_id, team_id)
+	with _providers_lock:
+		if key not in _providers:
+			_providers[key] = TokenProvider(key_path, key_id, team_id)
+		return _providers[key]
@@ -0,0 +1,205 @@
+"""
+Broadcasts to a whole device table.
+The table is split in primary key ranges ("shards") which are sent by a pool
+of worker processes, each with its own database and provider connections.
+Named broadcasts keep a checkpoint per shard (see BroadcastCheckpoint) and
+resume from it when run again after an interruption, provided the audience
+and the message are unchanged. A device is sent to
+twice at most if the process dies between sending a chunk and saving the
+checkpoint of that chunk.
+"""
+
+import hashlib
+import json
+import multiprocessing
+import time
+
+from django.apps import apps
+from django.db import connections
+from django.db.models import F, Max, Min
+
+from . import NotificationError
+from .invalidation import flush_invalidations
+from .results import SendResult
+from .routing import audience
+
+try:
+	from django.core.exceptions import EmptyResultSet
+except ImportError:
+	# Django < 1.11
+	from django.db.models.sql.datastructures import EmptyResultSet
+
+
+def pk_ranges(queryset, shards):
+	"""
+	Splits the primary keys of the queryset into at most `shards` inclusive
+	(first, last) ranges of equal width.
+	"""
+	bounds = audience(queryset).aggregate(first=Min("pk"), last=Max("pk"))
+	first, last = bounds["first"], bounds["last"]
+	if first is None:
+		return []
+	width = max(1, -(-(last - first + 1) // shards))
+	return [(lo, min(lo + width - 1, last)) for lo in range(first, last + 1, width)]
+
+
+def _close_connections():
+	for connection in connections.all():
+		connection.close()
+
+
+def _init_worker():
+	if not apps.ready:
+		import django
+		django.setup()
+	# never share the parent's database connections
+	_close_connections()
+
+
+def _shard_queryset(model_label, query, first, last):
+	model = apps.get_model(*model_label)
+	queryset = model.objects.all()
+	queryset.query = query
+	return queryset.filter(pk__gte=first, pk__lte=last).order_by("pk")
+
+
+def _invalidated(result):
+	""" Returns the number of devices a send found invalid """
+	if isinstance(result, dict):
+		# BareDevice querysets, by provider
+		return sum(_invalidated(result.get(provider)) for provider in ("apns", "gcm"))
+	if isinstance(result, SendResult):
+		return result.statuses.count(SendResult.INVALID)
+	return 0
+
+
+def send_shard(shard):
+	"""
+	Sends a message to all devices of a shard, `chunk_size` devices at a time.
+	The invalidations it buffered are written before it returns, since pool
+	workers exit without running atexit handlers.
+	Returns the statistics of the shard.
+	"""
+	from .models import BroadcastCheckpoint
+
+	model_label, query, first, last, sent_pk, name, message, kwargs, chunk_size = shard
+	queryset = audience(_shard_queryset(model_label, query, first, last))
+	checkpoint = BroadcastCheckpoint.objects.filter(name=name, first_pk=first) if name else None
+
+	result = {"shard": (first, last), "devices": 0, "invalidated": 0, "errors": []}
+	start = time.time()
+	try:
+		while True:
+			pks = list(queryset.filter(pk__gt=sent_pk).values_list("pk", flat=True)[:chunk_size])
+			if not pks:
+				break
+			chunk = queryset.filter(pk__gt=sent_pk, pk__lte=pks[-1])
+			sent_pk = pks[-1]
+			invalidated = 0
+			try:
+				invalidated = _invalidated(chunk.send_message(message, **kwargs))
+			except NotificationError as e:
+				result["errors"].append(str(e))
+			result["devices"] += len(pks)
+			result["invalidated"] += invalidated
+			if checkpoint is not None:
+				checkpoint.update(
+					sent_pk=sent_pk,
+					devices=F("devices") + len(pks),
+					invalidated=F("invalidated") + invalidated
+				)
+		if checkpoint is not None:
+			checkpoint.update(completed=True)
+	finally:
+		flush_invalidations()
+	result["elapsed"] = time.time() - start
+	return result
+
+
+def fingerprint(queryset, message, kwargs):
+	""" Returns a hash of the audience and the message of a broadcast """
+	try:
+		sql, params = queryset.query.sql_with_params()
+	except EmptyResultSet:
+		sql, params = "", ()
+	data = json.dumps(
+		[queryset.model._meta.db_table, sql, [str(param) for param in params], message, kwargs],
+		sort_keys=True, default=str
+	)
+	return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def _get_shards(queryset, shards, name, message, kwargs):
+	"""
+	Returns the (first, last, sent) primary keys of the shards left to send.
+	The shards of a named broadcast are saved on its first run and reused
+	afterwards, so that the audience of a resumed broadcast does not change.
+	Resuming a named broadcast with another queryset or message raises a
+	ValueError.
+	"""
+	if not name:
+		return [(first, last, first - 1) for first, last in pk_ranges(queryset, shards)]
+
+	from .models import BroadcastCheckpoint
+
+	checkpoints = BroadcastCheckpoint.objects.filter(name=name)
+	digest = fingerprint(queryset, message, kwargs)
+	if not checkpoints.exists():
+		BroadcastCheckpoint.objects.bulk_create([
+			BroadcastCheckpoint(name=name, first_pk=first, last_pk=last, sent_pk=first - 1, fingerprint=digest)
+			for first, last in pk_ranges(queryset, shards)
+		])
+	elif checkpoints.exclude(fingerprint=digest).exists():
+		raise ValueError(
+			"The broadcast %r was started with another audience or message. "
+			"Use a new name to send this one." % (name)
+		)
+	return list(checkpoints.filter(completed=False).values_list("first_pk", "last_pk", "sent_pk"))
+
+
+def broadcast(queryset, message, processes=None, shards=None, chunk_size=1000, progress=None, name=None, **kwargs):
+	"""
+	Sends a message to every device in the queryset using `processes` worker
+	processes (one per CPU by default). Keyword arguments are passed on to the
+	queryset's send_message().
+	If `name` is given, the broadcast is checkpointed under that name and
+	calling broadcast() again with the same name only sends to the devices
+	that were not reached yet.
+	`progress`, if given, is called with the statistics of each shard as soon
+	as it is done.
+	Returns the aggregated statistics of the broadcast.
+	"""
+	processes = processes or multiprocessing.cpu_count()
+	opts = queryset.model._meta
+	model_label = (opts.app_label, opts.object_name)
+	tasks = [
+		(model_label, queryset.query, first, last, sent_pk, name, message, kwargs, chunk_size)
+		for first, last, sent_pk in _get_shards(queryset, shards or processes * 4, name, message, kwargs)
+	]
+
+	start = time.time()
+	if processes == 1:
+		results = (send_shard(task) for task in tasks)
+	else:
+		# forked workers must not inherit open database connections
+		_close_connections()
+		pool = multiprocessing.Pool(processes, initializer=_init_worker)
+		results = pool.imap_unordered(send_shard, tasks)
+
+	report = {"shards": [], "devices": 0, "invalidated": 0, "errors": []}
+	try:
+		for result in results:
+			report["shards"].append(result)
+			report["devices"] += result["devices"]
+			report["invalidated"] += result["invalidated"]
+			report["errors"] += result["errors"]
+			if progress:
+				progress(result)
+	finally:
+		if processes != 1:
+			pool.close()
+			pool.join()
+
+	report["elapsed"] = time.time() - start
+	report["throughput"] = report["devices"] / report["elapsed"] if report["elapsed"] else 0
+	return report
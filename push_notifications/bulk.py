@@ -0,0 +1,153 @@
+"""
+Matching rows against large sets of values, such as the registration ids
+to invalidate or prune, updating many rows at once, and claiming rows for
+batch processing.
+IN lists are split in chunks of BULK_MATCH_CHUNK_SIZE values (less on SQLite,
+which limits the number of parameters of a query). On PostgreSQL, sets of
+BULK_MATCH_TEMP_TABLE_THRESHOLD values or more are loaded in a temporary
+table with COPY instead, and matched with a semi-join against it which reads
+the primary keys of the matching rows. The table only lives as long as that
+transaction, which works with poolers that hand out connections per
+transaction such as PgBouncer.
+"""
+
+import itertools
+from binascii import hexlify
+
+from django.db import connections, models, transaction
+from django.db.models import Case, Value, When
+
+from .settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+
+try:
+	from io import StringIO
+except ImportError:
+	# Python 2 support
+	from StringIO import StringIO
+
+
+# the default SQLITE_MAX_VARIABLE_NUMBER
+SQLITE_MAX_PARAMETERS = 999
+
+_temp_tables = itertools.count()
+
+
+def chunk_size(connection, parameters=1):
+	"""
+	Returns how many values fit in the IN lists of a query on `connection`,
+	using `parameters` parameters per value.
+	"""
+	size = SETTINGS["BULK_MATCH_CHUNK_SIZE"]
+	if connection.vendor == "sqlite":
+		# leave room for the other parameters of the query
+		size = min(size, (SQLITE_MAX_PARAMETERS - 99) // parameters)
+	return size
+
+
+def chunks(values, size):
+	""" Splits a list of values in lists of at most `size` values """
+	for i in range(0, len(values), size):
+		yield values[i:i + size]
+
+
+def matching(queryset, field, values):
+	"""
+	Yields querysets which together hold the rows of `queryset` whose
+	`field` is one of `values`. Each queryset needs to be evaluated (or
+	updated) before the next one is requested.
+	"""
+	values = list(set(values))
+	if not values:
+		return
+	connection = connections[queryset.db]
+	threshold = SETTINGS["BULK_MATCH_TEMP_TABLE_THRESHOLD"]
+	if connection.vendor == "postgresql" and threshold and len(values) >= threshold:
+		for chunk in _temp_table_matching(connection, queryset, field, values):
+			yield chunk
+		return
+	for chunk in chunks(values, chunk_size(connection)):
+		yield queryset.filter(**{"%s__in" % (field): chunk})
+
+
+def update_matching(queryset, field, values, **updates):
+	"""
+	Updates the rows of `queryset` whose `field` is one of `values`.
+	Returns the number of rows updated.
+	"""
+	return sum(chunk.update(**updates) for chunk in matching(queryset, field, values))
+
+
+def bulk_update(queryset, instances, fields):
+	"""
+	Saves the `fields` of model instances in one UPDATE ... CASE WHEN per
+	chunk of instances, rather than an UPDATE per instance. Like update(),
+	this sends no signals. Returns the number of rows updated.
+	"""
+	instances = list(instances)
+	if not instances or not fields:
+		return 0
+	opts = queryset.model._meta
+	fields = [opts.get_field(name) for name in fields]
+	# an IN list parameter and a WHEN pair per field for each instance
+	size = chunk_size(connections[queryset.db], parameters=1 + 2 * len(fields))
+	updated = 0
+	for chunk in chunks(instances, size):
+		updated += queryset.filter(pk__in=[instance.pk for instance in chunk]).update(**dict(
+			(field.name, Case(*[
+				When(pk=instance.pk, then=Value(getattr(instance, field.attname), output_field=field))
+				for instance in chunk
+			], output_field=field))
+			for field in fields
+		))
+	return updated
+
+
+def claim(queryset, limit):
+	"""
+	Returns up to `limit` rows of the queryset, locked until the end of the
+	current transaction. Rows locked by other transactions are skipped
+	(SELECT ... FOR UPDATE SKIP LOCKED) where the database supports it, so
+	that several workers can claim rows at the same time.
+	"""
+	locked = queryset.select_for_update()
+	if getattr(connections[locked.db].features, "has_select_for_update_skip_locked", False):
+		# Django 1.11+
+		locked = queryset.select_for_update(skip_locked=True)
+	return list(locked[:limit])
+
+
+def _temp_table_matching(connection, queryset, field, values):
+	model_field = queryset.model._meta.get_field(field)
+	if isinstance(model_field, models.BinaryField):
+		column_type = "bytea"
+	elif model_field.get_internal_type() in ("AutoField", "BigAutoField", "BigIntegerField", "IntegerField"):
+		column_type = "bigint"
+	else:
+		column_type = "text"
+
+	data = StringIO()
+	for value in values:
+		if isinstance(value, (bytes, bytearray)) and column_type == "bytea":
+			# hex format, with the backslash escaped for COPY
+			value = u"\\\\x%s" % (hexlify(value).decode("ascii"))
+		else:
+			value = u"%s" % (value)
+			value = value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+		data.write(value + u"\n")
+	data.seek(0)
+
+	name = "push_notifications_match_%i" % (next(_temp_tables))
+	table = connection.ops.quote_name(name)
+	with transaction.atomic(using=queryset.db):
+		with connection.cursor() as cursor:
+			cursor.execute("CREATE TEMPORARY TABLE %s (value %s NOT NULL) ON COMMIT DROP" % (table, column_type))
+			cursor.copy_from(data, name, columns=["value"])
+			cursor.execute("ANALYZE %s" % (table))
+		column = "%s.%s" % (
+			connection.ops.quote_name(queryset.model._meta.db_table),
+			connection.ops.quote_name(model_field.column)
+		)
+		pks = list(queryset.extra(where=["%s IN (SELECT value FROM %s)" % (column, table)]).values_list("pk", flat=True))
+	# the caller's code never runs within the transaction of the table
+	for chunk in chunks(pks, chunk_size(connection)):
+		yield queryset.filter(pk__in=chunk)
@@ -0,0 +1,81 @@
+"""
+Duplicate recipient elimination for bulk sends.
+Devices are deduplicated by registration_id while they are being iterated,
+with a set by default or, for broadcasts too large to remember every
+registration_id, with a Bloom filter of bounded size.
+"""
+
+import hashlib
+import math
+import struct
+
+from .settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+
+
+class BloomFilter(object):
+	"""
+	A Bloom filter sized for `capacity` keys with a false positive rate of
+	`error_rate`. A false positive makes a recipient look like a duplicate.
+	"""
+	def __init__(self, capacity, error_rate=0.0001):
+		self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+		self.hashes = max(1, int(round(self.size / float(capacity) * math.log(2))))
+		self.bits = bytearray((self.size + 7) // 8)
+
+	def _positions(self, key):
+		if not isinstance(key, bytes):
+			key = key.encode("utf-8")
+		# double hashing, see Kirsch & Mitzenmacher
+		h1, h2 = struct.unpack("<QQ", hashlib.md5(key).digest())
+		for i in range(self.hashes):
+			yield (h1 + i * h2) % self.size
+
+	def add(self, key):
+		""" Add a key, returning whether it was (probably) already present """
+		present = True
+		for position in self._positions(key):
+			index, mask = position >> 3, 1 << (position & 7)
+			if not self.bits[index] & mask:
+				present = False
+				self.bits[index] |= mask
+		return present
+
+
+class RecipientFilter(object):
+	"""
+	Filters out devices whose registration_id was already seen and counts them.
+	"""
+	def __init__(self, bloom_capacity=None, bloom_error_rate=None):
+		if bloom_capacity is None:
+			bloom_capacity = SETTINGS.get("DEDUPLICATION_BLOOM_CAPACITY")
+		if bloom_capacity:
+			error_rate = bloom_error_rate or SETTINGS["DEDUPLICATION_BLOOM_ERROR_RATE"]
+			self._add = BloomFilter(bloom_capacity, error_rate).add
+		else:
+			self._seen = set()
+			self._add = self._add_to_set
+		self.duplicates = 0
+
+	def _add_to_set(self, registration_id):
+		if registration_id in self._seen:
+			return True
+		self._seen.add(registration_id)
+		return False
+
+	def unique(self, devices):
+		for device in devices:
+			if self._add(device.registration_id):
+				self.duplicates += 1
+			else:
+				yield device
+
+	def chunks(self, devices, n):
+		""" Yield successive lists of up to `n` unique devices """
+		chunk = []
+		for device in self.unique(devices):
+			chunk.append(device)
+			if len(chunk) == n:
+				yield chunk
+				chunk = []
+		if chunk:
+			yield chunk
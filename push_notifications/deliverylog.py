@@ -0,0 +1,107 @@
+"""
+Delivery log: an optional record of the outcome of bulk sends for every device.
+Enabled with PUSH_NOTIFICATIONS_SETTINGS["DELIVERY_LOG"]. Outcomes are
+buffered and written DELIVERY_LOG_BATCH_SIZE rows at a time, with COPY on
+PostgreSQL and an INSERT run with executemany() elsewhere, so that logging
+stays cheap next to the provider requests themselves.
+"""
+
+import json
+
+from django.db import connections, router
+
+from .results import SendResult
+from .settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+
+try:
+	from io import StringIO
+except ImportError:
+	# Python 2 support
+	from StringIO import StringIO
+
+
+class DeliveryLog(object):
+	"""
+	Records the SendResults of one bulk send as a Delivery and its
+	DeliveryOutcomes. Call close() once the send is over.
+	"""
+	def __init__(self, service, payload, batch_size=None):
+		from .models import Delivery
+
+		self.delivery = Delivery.objects.create(service=service, payload=payload)
+		self.batch_size = batch_size or SETTINGS["DELIVERY_LOG_BATCH_SIZE"]
+		self.rows = []
+		self.devices = 0
+		self.failures = 0
+
+	def add(self, result):
+		""" Buffers the outcomes of a SendResult """
+		for row, (pk, status) in enumerate(zip(result.pks, result.statuses)):
+			self.rows.append((pk, status, result.errors.get(row, "")))
+		self.devices += result.count
+		self.failures += result.failure
+		if len(self.rows) >= self.batch_size:
+			self.flush()
+
+	def add_failed(self, devices, exception):
+		""" Records devices whose request raised `exception` as errors """
+		result = SendResult()
+		for device in devices:
+			result.add(device.pk, SendResult.ERROR, error=exception.__class__.__name__)
+		self.add(result)
+
+	def flush(self):
+		from .models import DeliveryOutcome
+
+		if not self.rows:
+			return
+		connection = connections[router.db_for_write(DeliveryOutcome)]
+		if connection.vendor == "postgresql":
+			self._copy(connection, DeliveryOutcome)
+		else:
+			self._insert(connection, DeliveryOutcome)
+		self.rows = []
+
+	def _columns(self, model):
+		opts = model._meta
+		return [opts.get_field(name).column for name in ("delivery", "device_pk", "status", "error")]
+
+	def _insert(self, connection, model):
+		# executemany() of a prepared INSERT, cheaper than building model
+		# instances for bulk_create()
+		qn = connection.ops.quote_name
+		sql = "INSERT INTO %s (%s) VALUES (%%s, %%s, %%s, %%s)" % (
+			qn(model._meta.db_table),
+			", ".join(qn(column) for column in self._columns(model)),
+		)
+		with connection.cursor() as cursor:
+			cursor.executemany(sql, [(self.delivery.pk, pk, status, error) for pk, status, error in self.rows])
+
+	def _copy(self, connection, model):
+		data = StringIO()
+		for pk, status, error in self.rows:
+			data.write(u"%s\t%s\t%s\t%s\n" % (
+				self.delivery.pk,
+				"\\N" if pk is None else pk,
+				status,
+				error.replace("\\", "\\\\").replace("\t", " ").replace("\n", " "),
+			))
+		data.seek(0)
+		with connection.cursor() as cursor:
+			cursor.copy_from(data, model._meta.db_table, columns=self._columns(model))
+
+	def close(self):
+		from .models import Delivery
+
+		self.flush()
+		Delivery.objects.filter(pk=self.delivery.pk).update(devices=self.devices, failures=self.failures)
+
+
+def get_delivery_log(service, payload):
+	"""
+	Returns a DeliveryLog for a bulk send of `payload` (which is serialized
+	to JSON) through `service`, or None if the delivery log is disabled.
+	"""
+	if not SETTINGS.get("DELIVERY_LOG"):
+		return None
+	return DeliveryLog(service, json.dumps(payload, separators=(",", ":"), sort_keys=True))
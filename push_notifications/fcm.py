@@ -0,0 +1,276 @@
+"""
+Firebase Cloud Messaging, through the HTTP v1 API
+Documentation is available on the Firebase website:
+https://firebase.google.com/docs/reference/fcm/rest/v1/projects.messages
+
+The v1 API sends one message per request. Bulk sends spread the requests over
+FCM_MAX_CONNECTIONS threads, each keeping its own persistent connection.
+Requests are authenticated with OAuth access tokens of the service account in
+FCM_CREDENTIALS, which are cached and refreshed shortly before they expire.
+Requires google-auth (with requests).
+"""
+
+import atexit
+import datetime
+import json
+import os
+import socket
+import threading
+from multiprocessing.pool import ThreadPool
+
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import six
+
+from .dedupe import RecipientFilter
+from .deliverylog import get_delivery_log
+from .gcm import GCMError
+from .invalidation import invalidate_device, invalidate_registrations
+from .ratelimit import get_rate_limiter
+from .results import SendResult
+from .settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+
+try:
+	from http.client import HTTPException, HTTPSConnection
+except ImportError:
+	# Python 2 support
+	from httplib import HTTPException, HTTPSConnection
+
+
+SCOPE = "https://www.googleapis.com/auth/firebase.messaging"
+
+# errors meaning the registration token will never be valid again
+INVALID_REGISTRATION_ERRORS = ("UNREGISTERED", "INVALID_ARGUMENT", "SENDER_ID_MISMATCH")
+
+
+class FCMError(GCMError):
+	pass
+
+
+class AccessTokenProvider(object):
+	"""
+	Caches the OAuth access token of a service account, refreshing it
+	FCM_TOKEN_REFRESH_MARGIN seconds before it expires.
+	"""
+	def __init__(self, credentials_file):
+		self.credentials_file = credentials_file
+		self.credentials = None
+		self.lock = threading.Lock()
+
+	def _load(self):
+		try:
+			from google.oauth2 import service_account
+		except ImportError:
+			raise ImproperlyConfigured("google-auth is required to send messages through FCM.")
+		return service_account.Credentials.from_service_account_file(self.credentials_file, scopes=[SCOPE])
+
+	def _expires_soon(self):
+		margin = datetime.timedelta(seconds=SETTINGS["FCM_TOKEN_REFRESH_MARGIN"])
+		return self.credentials.expiry is None or self.credentials.expiry - margin <= datetime.datetime.utcnow()
+
+	@property
+	def project_id(self):
+		with self.lock:
+			if self.credentials is None:
+				self.credentials = self._load()
+			return self.credentials.project_id
+
+	@property
+	def token(self):
+		with self.lock:
+			if self.credentials is None:
+				self.credentials = self._load()
+			if not self.credentials.token or self._expires_soon():
+				from google.auth.transport.requests import Request
+				self.credentials.refresh(Request())
+			return self.credentials.token
+
+
+_token_providers = {}
+_token_providers_lock = threading.Lock()
+
+
+def _get_token_provider(credentials_file=None):
+	credentials_file = credentials_file or SETTINGS.get("FCM_CREDENTIALS")
+	if not credentials_file:
+		raise ImproperlyConfigured(
+			'You need to set PUSH_NOTIFICATIONS_SETTINGS["FCM_CREDENTIALS"] to send messages through FCM.'
+		)
+	with _token_providers_lock:
+		if credentials_file not in _token_providers:
+			_token_providers[credentials_file] = AccessTokenProvider(credentials_file)
+		return _token_providers[credentials_file]
+
+
+# one persistent connection per thread
+_local = threading.local()
+_pool = None
+_pool_key = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+	global _pool, _pool_key
+	# threads do not survive a fork, see push_notifications.broadcast
+	key = (os.getpid(), SETTINGS["FCM_MAX_CONNECTIONS"])
+	with _pool_lock:
+		if _pool_key != key:
+			if _pool is not None and _pool_key[0] == key[0]:
+				_pool.close()
+			_pool = ThreadPool(key[1])
+			_pool_key = key
+		return _pool
+
+
+@atexit.register
+def _close_pool():
+	if _pool is not None and _pool_key[0] == os.getpid():
+		_pool.close()
+		_pool.join()
+
+
+def _fcm_request(path, body, headers):
+	"""
+	POSTs to FCM on the connection of the current thread, reconnecting once
+	if the connection was closed. Returns the status and decoded body.
+	"""
+	connection = getattr(_local, "connection", None)
+	if connection is None:
+		connection = _local.connection = HTTPSConnection(SETTINGS["FCM_HOST"], timeout=SETTINGS["FCM_TIMEOUT"])
+	for attempt in range(2):
+		try:
+			connection.request("POST", path, body, headers)
+			response = connection.getresponse()
+			return response.status, response.read().decode("utf-8")
+		except (HTTPException, socket.error):
+			connection.close()
+			if attempt:
+				raise
+
+
+def _fcm_message(registration_id, data, collapse_key=None, time_to_live=None, priority=None,
+	restricted_package_name=None, dry_run=False, **kwargs):
+	"""
+	Builds the request body of a message, mapping the legacy GCM options to
+	their HTTP v1 equivalent.
+	"""
+	message = {"token": registration_id}
+	if data:
+		# data values must be strings
+		message["data"] = dict(
+			(k, v if isinstance(v, six.string_types) else json.dumps(v)) for k, v in data.items()
+		)
+	android = {}
+	if collapse_key:
+		android["collapse_key"] = collapse_key
+	if time_to_live is not None:
+		android["ttl"] = "%is" % (time_to_live)
+	if priority:
+		android["priority"] = priority
+	if restricted_package_name:
+		android["restricted_package_name"] = restricted_package_name
+	if android:
+		message["android"] = android
+	values = {"message": message}
+	if dry_run:
+		values["validate_only"] = True
+	return json.dumps(values, separators=(",", ":"), sort_keys=True).encode("utf-8")  # keys sorted for tests
+
+
+def _fcm_error(status, response):
+	""" Returns the FCM error code of a response, or None on success """
+	if status == 200:
+		return None
+	try:
+		error = json.loads(response)["error"]
+	except (ValueError, KeyError):
+		return "HTTP_%i" % (status)
+	for detail in error.get("details", []):
+		if "errorCode" in detail:
+			return detail["errorCode"]
+	return error.get("status") or "HTTP_%i" % (status)
+
+
+def _fcm_headers(provider):
+	return {
+		"Content-Type": "application/json",
+		"Authorization": "Bearer %s" % (provider.token),
+	}
+
+
+def _fcm_path(project_id=None, credentials_file=None):
+	project_id = project_id or SETTINGS.get("FCM_PROJECT_ID") or _get_token_provider(credentials_file).project_id
+	return "/v1/projects/%s/messages:send" % (project_id)
+
+
+def fcm_send_message(device, data, api_key=None, project_id=None, credentials_file=None, **kwargs):
+	"""
+	Sends an FCM notification to a single device.
+	Devices whose registration_id is no longer valid are deactivated, other
+	errors raise FCMError.
+	api_key is ignored: FCM authenticates with FCM_CREDENTIALS instead.
+
+	The legacy GCM keyword arguments collapse_key, time_to_live, priority,
+	restricted_package_name and dry_run are supported.
+	"""
+
+	body = _fcm_message(device.registration_id, data, **kwargs)
+	provider = _get_token_provider(credentials_file)
+	status, response = _fcm_request(_fcm_path(project_id, credentials_file), body, _fcm_headers(provider))
+	error = _fcm_error(status, response)
+	if error in INVALID_REGISTRATION_ERRORS:
+		invalidate_device(device)
+	elif error is not None:
+		raise FCMError(response)
+	return json.loads(response)
+
+
+def fcm_send_bulk_message(devices, data, api_key=None, project_id=None, credentials_file=None, **kwargs):
+	"""
+	Sends an FCM notification to one or more devices, FCM_MAX_CONNECTIONS
+	at a time. The devices need to be an iterable of devices or Recipients
+	of the same model.
+	Devices sharing a registration_id are only sent the notification once.
+	Returns a SendResult, errors are reported there rather than raised.
+	api_key is ignored: FCM authenticates with FCM_CREDENTIALS instead.
+	"""
+
+	path = _fcm_path(project_id, credentials_file)
+	provider = _get_token_provider(credentials_file)
+	limiter = get_rate_limiter("GCM", path)
+	pool = _get_pool()
+
+	def send(device):
+		body = _fcm_message(device.registration_id, data, **kwargs)
+		try:
+			status, response = _fcm_request(path, body, _fcm_headers(provider))
+		except (HTTPException, socket.error):
+			return device, "CONNECTION_ERROR"
+		return device, _fcm_error(status, response)
+
+	recipients = RecipientFilter()
+	log = get_delivery_log("GCM", data)
+	ret = SendResult()
+	try:
+		for chunk in recipients.chunks(devices, SETTINGS["GCM_MAX_RECIPIENTS"]):
+			if limiter:
+				limiter.acquire(len(chunk))
+			result = SendResult()
+			ids_to_remove = []
+			for device, error in pool.imap(send, chunk):
+				if error in INVALID_REGISTRATION_ERRORS:
+					ids_to_remove.append(device.registration_id)
+					result.add(device.pk, SendResult.INVALID, error=error)
+				elif error is not None:
+					result.add(device.pk, SendResult.ERROR, error=error)
+				else:
+					result.add(device.pk)
+			invalidate_registrations(chunk[0].__class__.objects.model, ids_to_remove)
+			ret.merge(result)
+			if log:
+				log.add(result)
+	finally:
+		if log:
+			log.close()
+
+	ret.duplicates = recipients.duplicates
+	return ret
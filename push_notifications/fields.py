@@ -1,5 +1,6 @@
 import re
-import struct
+from binascii import unhexlify, Error as BinasciiError
+
 from django import forms
 from django.core.validators import MaxValueValidator, MinValueValidator, RegexValidator
 from django.db import connection, models
@@ -7,10 +8,11 @@ from django.utils import six
 from django.utils.translation import ugettext_lazy as _
 
 
-__all__ = ["HexadecimalField", "HexIntegerField"]
+__all__ = ["BinaryTokenField", "HexadecimalField", "HexIntegerField"]
 
 UNSIGNED_64BIT_INT_MIN_VALUE = 0
 UNSIGNED_64BIT_INT_MAX_VALUE = 2 ** 64 - 1
+SIGNED_64BIT_INT_MAX_VALUE = 2 ** 63 - 1
 
 
 hex_re = re.compile(r"^(([0-9A-f])|(0x[0-9A-f]))+$")
@@ -22,16 +24,27 @@ signed_integer_engines = [
 ]
 
 
-def _using_signed_storage():
-	return connection.settings_dict["ENGINE"] in signed_integer_engines
+# Whether each connection alias stores HexIntegerFields as signed integers
+_signed_storage = {}
+
+
+def _using_signed_storage(connection=connection):
+	try:
+		return _signed_storage[connection.alias]
+	except KeyError:
+		signed = connection.settings_dict["ENGINE"] in signed_integer_engines
+		_signed_storage[connection.alias] = signed
+		return signed
 
 
 def _signed_to_unsigned_integer(value):
-	return struct.unpack("Q", struct.pack("q", value))[0]
+	return value & UNSIGNED_64BIT_INT_MAX_VALUE
 
 
 def _unsigned_to_signed_integer(value):
-	return struct.unpack("q", struct.pack("Q", value))[0]
+	if value > SIGNED_64BIT_INT_MAX_VALUE:
+		return value - 2 ** 64
+	return value
 
 
 def _hex_string_to_unsigned_integer(value):
@@ -42,6 +55,16 @@ def _unsigned_integer_to_hex_string(value):
 	return hex(value).rstrip("L")
 
 
+def _hex_string_to_bytes(value):
+	""" Returns the bytes of a hex string, None if it is not one """
+	if not value:
+		return None
+	try:
+		return unhexlify(value)
+	except (TypeError, ValueError, BinasciiError):
+		return None
+
+
 class HexadecimalField(forms.CharField):
 	"""
 	A form field that accepts only hexadecimal numbers
@@ -88,12 +111,18 @@ class HexIntegerField(models.BigIntegerField):
 			return super(HexIntegerField, self).db_type(connection=connection)
 
 	def get_prep_value(self, value):
-		""" Return the integer value to be stored from the hex string """
+		""" Return the unsigned integer value from the hex string """
 		if value is None or value == "":
 			return None
 		if isinstance(value, six.string_types):
 			value = _hex_string_to_unsigned_integer(value)
-		if _using_signed_storage():
+		return value
+
+	def get_db_prep_value(self, value, connection, prepared=False):
+		""" Return the integer value to be stored on this connection """
+		if not prepared:
+			value = self.get_prep_value(value)
+		if value is not None and _using_signed_storage(connection):
 			value = _unsigned_to_signed_integer(value)
 		return value
 
@@ -101,7 +130,7 @@ class HexIntegerField(models.BigIntegerField):
 		""" Return an unsigned int representation from all db backends """
 		if value is None:
 			return value
-		if _using_signed_storage():
+		if _using_signed_storage(connection):
 			value = _signed_to_unsigned_integer(value)
 		return value
 
@@ -123,3 +152,42 @@ class HexIntegerField(models.BigIntegerField):
 		# make sure validation is performed on integer value not string value
 		value = _hex_string_to_unsigned_integer(value)
 		return super(models.BigIntegerField, self).run_validators(value)
+
+
+class BinaryTokenField(models.BinaryField):
+	"""
+	Stores the raw bytes of the hexadecimal string in the `source` field of the
+	model, updated whenever the model is saved (bulk_create() included).
+	Uses a column of at most max_length bytes on MySQL and Oracle, so that it
+	can be indexed there too.
+	"""
+
+	def __init__(self, *args, **kwargs):
+		self.source = kwargs.pop("source", None)
+		super(BinaryTokenField, self).__init__(*args, **kwargs)
+
+	def deconstruct(self):
+		name, path, args, kwargs = super(BinaryTokenField, self).deconstruct()
+		if self.source is not None:
+			kwargs["source"] = self.source
+		return name, path, args, kwargs
+
+	def db_type(self, connection):
+		if connection.vendor == "mysql":
+			return "varbinary(%i)" % (self.max_length)
+		elif connection.vendor == "oracle":
+			return "RAW(%i)" % (self.max_length)
+		return super(BinaryTokenField, self).db_type(connection=connection)
+
+	def pre_save(self, model_instance, add):
+		if self.source is None:
+			return super(BinaryTokenField, self).pre_save(model_instance, add)
+		value = _hex_string_to_bytes(getattr(model_instance, self.source))
+		setattr(model_instance, self.attname, value)
+		return value
+
+	def from_db_value(self, value, expression, connection, context):
+		# PostgreSQL returns a memoryview (a buffer on Python 2)
+		if value is None:
+			return value
+		return bytes(value)
@@ -6,11 +6,16 @@ https://developer.android.com/google/gcm/index.html
 """
 
 import json
+import zlib
 
 from django.core.exceptions import ImproperlyConfigured
 
 from . import NotificationError
-from .models import GCMDevice, BareDevice
+from .dedupe import RecipientFilter
+from .deliverylog import get_delivery_log
+from .invalidation import invalidate_device, invalidate_registrations, replace_registration_id
+from .ratelimit import get_rate_limiter
+from .results import SendResult
 from .settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
 
 try:
@@ -26,15 +31,13 @@ class GCMError(NotificationError):
 	pass
 
 
-def _chunks(l, n):
-	"""
-	Yield successive chunks from list \a l with a minimum size \a n
-	"""
-	for i in range(0, len(l), n):
-		yield l[i:i + n]
+def _gzip(data, level):
+	# zlib rather than gzip.compress() for Python 2 support, wbits 16+ writes a gzip header
+	compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+	return compressor.compress(data) + compressor.flush()
 
 
-def _gcm_send(data, content_type, api_key=None):
+def _gcm_request(url, data, content_type, api_key=None):
 	key = SETTINGS.get("GCM_API_KEY") if api_key is None else api_key
 	if not key:
 		raise ImproperlyConfigured('You need to set PUSH_NOTIFICATIONS_SETTINGS["GCM_API_KEY"] to send messages through GCM.')
@@ -42,13 +45,20 @@ def _gcm_send(data, content_type, api_key=None):
 	headers = {
 		"Content-Type": content_type,
 		"Authorization": "key=%s" % (key),
-		"Content-Length": str(len(data)),
 	}
+	if SETTINGS["GCM_GZIP"] and len(data) >= SETTINGS["GCM_GZIP_MIN_SIZE"]:
+		data = _gzip(data, SETTINGS["GCM_GZIP_LEVEL"])
+		headers["Content-Encoding"] = "gzip"
+	headers["Content-Length"] = str(len(data))
 
-	request = Request(SETTINGS["GCM_POST_URL"], data, headers)
+	request = Request(url, data, headers)
 	return urlopen(request).read().decode("utf-8")
 
 
+def _gcm_send(data, content_type, api_key=None):
+	return _gcm_request(SETTINGS["GCM_POST_URL"], data, content_type, api_key=api_key)
+
+
 def _gcm_send_plain(device, data, api_key=None, **kwargs):
 	"""
 	Sends a GCM notification to a single registration_id.
@@ -80,25 +90,29 @@ def _gcm_send_plain(device, data, api_key=None, **kwargs):
 	if result.startswith("Error="):
 		if result in ("Error=NotRegistered", "Error=InvalidRegistration"):
 			# Deactivate the problematic device
-			if hasattr(device, "invalidate"):
-				device.invalidate()
-			else:
-				device.active = False
-				device.save()
+			invalidate_device(device)
 			return result
 
 		raise GCMError(result)
 
+	for line in result.splitlines():
+		if line.startswith("registration_id="):
+			replace_registration_id(device, line[len("registration_id="):])
+
 	return result
 
 
 def _gcm_send_json(devices, data, api_key=None, **kwargs):
 	"""
 	Sends a GCM notification to one or more devices. The devices needs to be
-	a list and need to be of the same model (BareDevice/GCMDevice).
-	This will send the notification as json data.
+	a list and need to be of the same model (BareDevice/GCMDevice), or
+	Recipients of that model.
+	This will send the notification as json data. Returns a SendResult, in
+	which the devices GCM reported an error for are ERROR rows.
 	"""
 
+	recipients = RecipientFilter(bloom_capacity=0)
+	devices = list(recipients.unique(devices))
 	values = {"registration_ids": [device.registration_id for device in devices]}
 
 	if data is not None:
@@ -117,24 +131,28 @@ def _gcm_send_json(devices, data, api_key=None, **kwargs):
 			api_key=api_key
 		)
 	)
-
-	if result["failure"]:
-		ids_to_remove = []
-		throw_error = 0
-		for index, er in enumerate(result["results"]):
-			if er.get("error", "none") in ("NotRegistered", "InvalidRegistration"):
-				ids_to_remove.append(values["registration_ids"][index])
-			elif er.get("error", "none") is not "none":
-				throw_error = 1
-		if ids_to_remove:
-			if isinstance(devices[0].__class__.objects, BareDevice):
-				BareDevice.objects.invalidate(registration_ids=ids_to_remove)
-			else:
-				removed = GCMDevice.objects.filter(registration_id__in=ids_to_remove)
-				removed.update(active=0)
-		if throw_error:
-			raise GCMError(result)
-	return result
+	result["duplicates"] = recipients.duplicates
+
+	ret = SendResult()
+	ret.duplicates = recipients.duplicates
+	ret.responses.append(result)
+	ids_to_remove = []
+	for device, er in zip(devices, result["results"]):
+		error = er.get("error")
+		if error in ("NotRegistered", "InvalidRegistration"):
+			ids_to_remove.append(device.registration_id)
+			ret.add(device.pk, SendResult.INVALID, error=error)
+		elif error is not None:
+			# such as Unavailable, for the caller to retry
+			ret.add(device.pk, SendResult.ERROR, error=error)
+		else:
+			canonical_id = er.get("registration_id")
+			if canonical_id:
+				replace_registration_id(device, canonical_id)
+			ret.add(device.pk, canonical_id=canonical_id)
+	if ids_to_remove:
+		invalidate_registrations(devices[0].__class__.objects.model, ids_to_remove)
+	return ret
 
 
 def gcm_send_message(device, data, api_key=None, **kwargs):
@@ -157,9 +175,12 @@ def gcm_send_message(device, data, api_key=None, **kwargs):
 
 def gcm_send_bulk_message(devices, data, **kwargs):
 	"""
-	Sends a GCM notification to one or more registration_ids. The registration_ids
-	needs to be a list.
+	Sends a GCM notification to one or more registration_ids. The devices
+	need to be an iterable of devices or Recipients.
 	This will send the notification as json data.
+	Devices sharing a registration_id are only sent the notification once.
+	Returns a SendResult of all the requests, where errors reported for a
+	device (such as Unavailable) are ERROR rows rather than raised.
 
 	A reference of extra keyword arguments sent to the server is available here:
 	https://developers.google.com/cloud-messaging/server-ref#downstream
@@ -168,20 +189,108 @@ def gcm_send_bulk_message(devices, data, **kwargs):
 	# GCM only allows up to 1000 reg ids per bulk message
 	# https://developer.android.com/google/gcm/gcm.html#request
 	max_recipients = SETTINGS.get("GCM_MAX_RECIPIENTS")
-	if len(devices) > max_recipients:
-		ret = []
-		for chunk in _chunks(devices, max_recipients):
-			ret.append(
-				_gcm_send_json(
+	limiter = get_rate_limiter("GCM", kwargs.get("api_key") or SETTINGS.get("GCM_API_KEY"))
+	recipients = RecipientFilter()
+	log = get_delivery_log("GCM", data)
+	ret = SendResult()
+	try:
+		for chunk in recipients.chunks(devices, max_recipients):
+			if limiter:
+				limiter.acquire(len(chunk))
+			duplicates = recipients.duplicates
+			try:
+				result = _gcm_send_json(
 					chunk,
 					data,
 					**kwargs
 				)
-			)
-		return ret
+			except Exception as e:
+				if log:
+					log.add_failed(chunk, e)
+				raise
+			# duplicates dropped while this chunk was being filled
+			result.responses[0]["duplicates"] = duplicates - ret.duplicates
+			result.duplicates = duplicates - ret.duplicates
+			ret.merge(result)
+			if log:
+				log.add(result)
+	finally:
+		if log:
+			log.close()
+
+	if ret.responses:
+		ret.responses[-1]["duplicates"] += recipients.duplicates - ret.duplicates
+	ret.duplicates = recipients.duplicates
+	return ret
+
+
+def gcm_send_topic_message(topic, data, api_key=None, **kwargs):
+	"""
+	Sends a GCM notification to all the devices subscribed to a topic.
+	This is a single request whatever the number of subscribers, GCM
+	does the fan-out.
 
-	return _gcm_send_json(
-		devices,
-		data,
-		**kwargs
-	)
+	A reference of extra keyword arguments sent to the server is available here:
+	https://developers.google.com/cloud-messaging/server-ref#downstream
+	"""
+
+	values = {"to": "/topics/%s" % (topic)}
+
+	if data is not None:
+		values["data"] = data
+
+	for k, v in kwargs.items():
+		if v:
+			values[k] = v
+
+	data = json.dumps(values, separators=(",", ":"), sort_keys=True).encode("utf-8")  # keys sorted for tests
+
+	result = json.loads(_gcm_send(data, "application/json", api_key=api_key))
+	if "error" in result:
+		raise GCMError(result)
+	return result
+
+
+def _gcm_batch_subscription(action, devices, topic, api_key=None):
+	"""
+	Adds (action="batchAdd") or removes (action="batchRemove") devices to or
+	from a topic through the Instance ID API, GCM_MAX_RECIPIENTS at a time.
+	https://developers.google.com/instance-id/reference/server#manage_relationship_maps_for_multiple_app_instances
+	"""
+
+	url = "%s:%s" % (SETTINGS["GCM_IID_URL"], action)
+	ret = []
+	for chunk in RecipientFilter(bloom_capacity=0).chunks(devices, SETTINGS["GCM_MAX_RECIPIENTS"]):
+		values = {
+			"to": "/topics/%s" % (topic),
+			"registration_tokens": [device.registration_id for device in chunk],
+		}
+		data = json.dumps(values, separators=(",", ":"), sort_keys=True).encode("utf-8")  # keys sorted for tests
+		result = json.loads(_gcm_request(url, data, "application/json", api_key=api_key))
+		if "error" in result:
+			raise GCMError(result)
+
+		ids_to_remove = [
+			values["registration_tokens"][index]
+			for index, er in enumerate(result["results"])
+			if er.get("error") in ("NOT_FOUND", "INVALID_ARGUMENT")
+		]
+		invalidate_registrations(chunk[0].__class__.objects.model, ids_to_remove)
+		ret.extend(result["results"])
+	return ret
+
+
+def gcm_subscribe(devices, topic, api_key=None):
+	"""
+	Subscribes devices (or Recipients) to a GCM topic. Returns the result of
+	each device, an empty dict on success.
+	"""
+	return _gcm_batch_subscription("batchAdd", devices, topic, api_key=api_key)
+
+
+def gcm_unsubscribe(devices, topic, api_key=None):
+	"""
+	Unsubscribes devices (or Recipients) from a GCM topic. Returns the result
+	of each device, an empty dict on success.
+	"""
+	return _gcm_batch_subscription("batchRemove", devices, topic, api_key=api_key)
@@ -0,0 +1,288 @@
+"""
+Write-behind invalidation of devices.
+With PUSH_NOTIFICATIONS_SETTINGS["INVALIDATION_BUFFER"] enabled, the invalid
+and canonical registration ids reported by the providers are gathered in a
+buffer shared by every send of the process, and written in set-based
+UPDATEs once INVALIDATION_BUFFER_SIZE of them are pending or the oldest is
+INVALIDATION_BUFFER_INTERVAL seconds old (a timer is armed when the first one
+is buffered), by a thread of their own, and when the process exits. Otherwise devices are invalidated as soon as the provider
+reports them.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db import connections, router
+from django.db.models import Case, TextField, Value, When
+
+from .bulk import chunk_size, chunks, matching
+from .settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+
+
+_clock = getattr(time, "monotonic", time.time)
+logger = logging.getLogger(__name__)
+
+
+class InvalidationBuffer(object):
+	"""
+	A thread-safe buffer of the registration ids to invalidate and of the
+	canonical registration ids to replace, by device model.
+	"""
+	def __init__(self, size=None, interval=None):
+		self.size = size or SETTINGS["INVALIDATION_BUFFER_SIZE"]
+		self.interval = interval if interval is not None else SETTINGS["INVALIDATION_BUFFER_INTERVAL"]
+		self.lock = threading.Lock()
+		# the thread writing the buffer behind the sends, if any
+		self.thread = None
+		self.flushing = False
+		# flushes the buffer once the oldest item is `interval` seconds old
+		self.timer = None
+		self._reset()
+
+	def _reset(self):
+		self.invalid = {}
+		self.canonical = {}
+		self.pending = 0
+		self.started = None
+		if self.timer is not None:
+			self.timer.cancel()
+			self.timer = None
+
+	def _added(self, count):
+		self.pending += count
+		if self.started is None:
+			self.started = _clock()
+			if 0 < self.interval < float("inf"):
+				self.timer = threading.Timer(self.interval, self._flush_on_timer)
+				self.timer.daemon = True
+				self.timer.start()
+		return self.pending >= self.size or _clock() - self.started >= self.interval
+
+	def invalidate(self, model, registration_ids):
+		""" Buffers registration ids of `model` to invalidate """
+		with self.lock:
+			self.invalid.setdefault(model, set()).update(registration_ids)
+			full = self._added(len(registration_ids))
+		if full:
+			self._flush_behind()
+
+	def replace(self, model, registration_id, canonical_id):
+		""" Buffers the replacement of a registration id of `model` by its canonical id """
+		with self.lock:
+			self.canonical.setdefault(model, {})[registration_id] = canonical_id
+			full = self._added(1)
+		if full:
+			self._flush_behind()
+
+	def take(self):
+		""" Empties the buffer, returning its pending invalidations and replacements """
+		with self.lock:
+			pending = (self.invalid, self.canonical)
+			self._reset()
+		return pending
+
+	def restore(self, invalid, canonical):
+		""" Puts back invalidations and replacements taken from the buffer """
+		with self.lock:
+			for model, registration_ids in invalid.items():
+				self.invalid.setdefault(model, set()).update(registration_ids)
+			for model, mapping in canonical.items():
+				pending = self.canonical.setdefault(model, {})
+				for registration_id, canonical_id in mapping.items():
+					# a replacement buffered in the meantime is more recent
+					pending.setdefault(registration_id, canonical_id)
+			self._added(
+				sum(len(registration_ids) for registration_ids in invalid.values()) +
+				sum(len(mapping) for mapping in canonical.values())
+			)
+
+	def flush(self):
+		"""
+		Writes the pending invalidations and replacements. They are put back
+		in the buffer if the write fails.
+		"""
+		pending = self.take()
+		try:
+			write_invalidations(*pending)
+		except Exception:
+			self.restore(*pending)
+			raise
+
+	def _flush_behind(self):
+		""" Flushes in a thread of its own, unless one is already running """
+		if any(connection.in_atomic_block for connection in connections.all()):
+			# the thread would not see the rows of the transaction
+			self.flush()
+			return
+		with self.lock:
+			if self.flushing:
+				return
+			self.flushing = True
+		self.thread = threading.Thread(target=self._flush_in_thread)
+		self.thread.start()
+
+	def _flush_on_timer(self):
+		with self.lock:
+			if not self.pending or self.flushing:
+				return
+			self.flushing = True
+		self.thread = threading.current_thread()
+		self._flush_in_thread()
+
+	def _flush_in_thread(self):
+		try:
+			self.flush()
+		except Exception:
+			logger.exception("Writing the invalidation buffer failed, it will be retried")
+		finally:
+			with self.lock:
+				self.flushing = False
+			connections.close_all()
+
+
+def write_invalidations(invalid, canonical):
+	"""
+	Writes invalidations and replacements taken from an InvalidationBuffer:
+	registration ids to invalidate and canonical ids by registration id, by
+	device model.
+	"""
+	for model, mapping in canonical.items():
+		_replace_registration_ids(model, mapping)
+	for model, registration_ids in invalid.items():
+		model.objects.invalidate(list(registration_ids))
+
+
+def _replace_registration_ids(model, mapping):
+	"""
+	Replaces registration ids by their canonical id, in set-based UPDATEs.
+	Devices whose canonical id is already registered are invalidated
+	instead, so that the device is only sent notifications once.
+	"""
+	registered = set()
+	for devices in matching(model.objects.all(), "registration_id", mapping.values()):
+		registered.update(devices.values_list("registration_id", flat=True))
+	replacements = {}
+	duplicates = []
+	for registration_id, canonical_id in mapping.items():
+		if canonical_id in registered:
+			duplicates.append(registration_id)
+		else:
+			replacements[registration_id] = canonical_id
+			registered.add(canonical_id)
+
+	# an IN list parameter and a WHEN pair per registration id
+	size = chunk_size(connections[router.db_for_write(model)], parameters=3)
+	for chunk in chunks(list(replacements.items()), size):
+		model.objects.filter(registration_id__in=[old for old, new in chunk]).update(registration_id=Case(
+			*[When(registration_id=old, then=Value(new)) for old, new in chunk],
+			output_field=TextField()
+		))
+	if replacements:
+		from .models import mark_segments_dirty
+		mark_segments_dirty(model)
+	if duplicates:
+		model.objects.invalidate(duplicates)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+# buffers set for the current thread by deferred_invalidations()
+_local = threading.local()
+
+
+def get_invalidation_buffer():
+	"""
+	Returns the InvalidationBuffer of the current thread if there is one,
+	else the one of the process, or None if it is disabled.
+	"""
+	global _buffer
+	buffer = getattr(_local, "buffer", None)
+	if buffer is not None:
+		return buffer
+	if not SETTINGS.get("INVALIDATION_BUFFER"):
+		return None
+	with _buffer_lock:
+		if _buffer is None:
+			_buffer = InvalidationBuffer()
+		return _buffer
+
+
+@contextmanager
+def deferred_invalidations(buffer):
+	"""
+	Gathers the invalidations of the sends of the current thread in `buffer`
+	until the block exits. They are written when the buffer is flushed.
+	"""
+	previous = getattr(_local, "buffer", None)
+	_local.buffer = buffer
+	try:
+		yield buffer
+	finally:
+		_local.buffer = previous
+
+
+def flush_invalidations():
+	""" Writes the pending invalidations of the process, if any """
+	if _buffer is not None:
+		_buffer.flush()
+
+
+@atexit.register
+def _flush_at_exit():
+	try:
+		flush_invalidations()
+	except Exception:
+		logger.exception("Writing the invalidation buffer at exit failed")
+
+
+def invalidate_registrations(model, registration_ids):
+	""" Invalidates the devices of `model` with these registration ids """
+	if not registration_ids:
+		return
+	buffer = get_invalidation_buffer()
+	if buffer:
+		buffer.invalidate(model, registration_ids)
+	else:
+		model.objects.invalidate(registration_ids)
+
+
+def invalidate_device(device):
+	"""
+	Invalidates a single device, model instance or Recipient.
+	Instances are deactivated in memory right away, and saved unless the
+	invalidation buffer is enabled.
+	"""
+	buffer = get_invalidation_buffer()
+	if buffer is None or device.pk is None:
+		if hasattr(device, "invalidate"):
+			device.invalidate()
+		elif hasattr(device, "save"):
+			device.active = False
+			device.save()
+		else:
+			device.__class__.objects.invalidate([device.registration_id])
+		return
+
+	if hasattr(device, "invalidate"):
+		device.invalidate(save=False)
+	elif hasattr(device, "save"):
+		device.active = False
+	buffer.invalidate(device.__class__.objects.model, [device.registration_id])
+
+
+def replace_registration_id(device, canonical_id):
+	"""
+	Records the canonical registration id a provider returned for a device,
+	buffered if the invalidation buffer is enabled.
+	"""
+	if canonical_id == device.registration_id:
+		return
+	model = device.__class__.objects.model
+	buffer = get_invalidation_buffer()
+	if buffer:
+		buffer.replace(model, device.registration_id, canonical_id)
+	else:
+		_replace_registration_ids(model, {device.registration_id: canonical_id})
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+	can_import_settings = True
+	help = 'Send a message to all active devices, split across worker processes'
+
+	def add_arguments(self, parser):
+		parser.add_argument('service', choices=('apns', 'gcm'), help='Which device table to broadcast to')
+		parser.add_argument('message')
+		parser.add_argument('--processes', type=int, default=None,
+			help='Number of worker processes. Defaults to the number of CPUs')
+		parser.add_argument('--shards', type=int, default=None,
+			help='Number of primary key ranges to split the devices in. Defaults to 4 per process')
+		parser.add_argument('--chunk-size', type=int, default=1000,
+			help='Number of devices loaded and sent at a time by each worker')
+		parser.add_argument('--name', default=None,
+			help='Checkpoint the broadcast under this name. Running it again with the same name resumes it')
+
+	def handle(self, *args, **options):
+		from push_notifications.broadcast import broadcast
+		from push_notifications.models import APNSDevice, GCMDevice
+
+		model = APNSDevice if options['service'] == 'apns' else GCMDevice
+
+		def progress(shard):
+			self.stdout.write('shard %d-%d: %d devices, %d invalidated, %d errors in %.2fs' % (
+				shard['shard'][0], shard['shard'][1], shard['devices'], shard['invalidated'],
+				len(shard['errors']), shard['elapsed']
+			))
+
+		try:
+			report = broadcast(
+				model.objects.filter(active=True),
+				options['message'],
+				processes=options['processes'],
+				shards=options['shards'],
+				chunk_size=options['chunk_size'],
+				progress=progress,
+				name=options['name'],
+			)
+		except ValueError as e:
+			raise CommandError(str(e))
+		for error in report['errors']:
+			self.stderr.write(error)
+		self.stdout.write('sent to %d devices (%d invalidated) in %.2fs, %.1f devices/s' % (
+			report['devices'], report['invalidated'], report['elapsed'], report['throughput']
+		))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+	can_import_settings = True
+	help = 'Delete GCM devices registered more than once, keeping the most recent registration'
+
+	def handle(self, *args, **options):
+		from django.db import connections
+		from django.db.models import Count, Max
+		from push_notifications.bulk import chunk_size, chunks
+		from push_notifications.models import GCMDevice
+
+		duplicated = list(GCMDevice.objects.values('registration_id')
+			.annotate(count=Count('id'), keep=Max('id'))
+			.filter(count__gt=1).order_by()
+			.values_list('registration_id', 'keep', 'count'))
+		# a registration id and the primary key to keep per duplicate
+		size = chunk_size(connections[GCMDevice.objects.db], parameters=2)
+		deleted = 0
+		for chunk in chunks(duplicated, size):
+			GCMDevice.objects.filter(registration_id__in=[registration_id for registration_id, keep, count in chunk]) \
+				.exclude(pk__in=[keep for registration_id, keep, count in chunk]) \
+				.delete()
+			deleted += sum(count - 1 for registration_id, keep, count in chunk)
+		self.stdout.write('deleted %d duplicate devices' % deleted)
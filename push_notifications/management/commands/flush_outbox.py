@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+	can_import_settings = True
+	help = 'Send the notifications waiting in the outbox'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch-size', type=int, default=None,
+			help='Number of messages claimed and sent at a time (default: OUTBOX_BATCH_SIZE)')
+		parser.add_argument('--interval', type=float, default=None,
+			help='Keep flushing the outbox every INTERVAL seconds until interrupted')
+		parser.add_argument('--prune', action='store_true', default=False,
+			help='Delete the messages given up on after OUTBOX_MAX_ATTEMPTS attempts, instead of flushing')
+
+	def handle(self, *args, **options):
+		from push_notifications.outbox import flush, given_up, prune
+
+		if options['prune']:
+			self.stdout.write('deleted %d messages given up on' % (prune()))
+			return
+		while True:
+			report = flush(batch_size=options['batch_size'])
+			if report['messages'] or report['errors'] or options['interval'] is None:
+				self.stdout.write('sent %d messages in %d bulk sends, %d errors' % (
+					report['messages'], report['sends'], len(report['errors'])
+				))
+				for error in report['errors']:
+					self.stderr.write(error)
+				failed = given_up().count()
+				if failed:
+					self.stderr.write('%d messages were given up on, see their last_error (--prune deletes them)' % (failed))
+			if options['interval'] is None:
+				break
+			time.sleep(options['interval'])
@@ -0,0 +1,37 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+	can_import_settings = True
+	help = 'Delete the delivery log entries older than the retention period'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--days', type=int, default=None,
+			help='Retention period in days (default: DELIVERY_LOG_RETENTION_DAYS)')
+
+	def handle(self, *args, **options):
+		from django.db import connections
+		from django.utils import timezone
+		from push_notifications.bulk import chunk_size
+		from push_notifications.models import Delivery, DeliveryOutcome
+		from push_notifications.settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+
+		days = options['days']
+		if days is None:
+			days = SETTINGS['DELIVERY_LOG_RETENTION_DAYS']
+		deliveries = Delivery.objects.filter(date_created__lt=timezone.now() - timedelta(days=days)).order_by('pk')
+		size = chunk_size(connections[Delivery.objects.db])
+		deleted = count = 0
+		while True:
+			pks = list(deliveries.values_list('pk', flat=True)[:size])
+			if not pks:
+				break
+			# outcomes first, in a single statement rather than through the cascade
+			outcomes = DeliveryOutcome.objects.filter(delivery_id__in=pks)
+			count += outcomes.count()
+			outcomes.delete()
+			Delivery.objects.filter(pk__in=pks).delete()
+			deleted += len(pks)
+		self.stdout.write('deleted %d deliveries (%d device outcomes)' % (deleted, count))
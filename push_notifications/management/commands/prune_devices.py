@@ -1,4 +1,5 @@
 from django.core.management.base import BaseCommand
+from django.db import connections
 
 
 class Command(BaseCommand):
@@ -6,11 +7,19 @@ class Command(BaseCommand):
 	help = 'Deactivate APNS devices that are not receiving notifications'
 
 	def handle(self, *args, **options):
-		from push_notifications.models import APNSDevice, get_expired_tokens
-		expired = get_expired_tokens()
-		devices = APNSDevice.objects.filter(registration_id__in=expired)
-		for d in devices:
-			self.stdout.write('deactivating [%s]' % d.registration_id)
-			d.active = False
-			d.save()
-		self.stdout.write('deactivated %d devices' % len(devices))
+		from push_notifications.apns import apns_fetch_inactive_tokens
+		from push_notifications.bulk import chunk_size, chunks
+		from push_notifications.models import APNSDevice
+		from push_notifications.routing import audience
+		expired = apns_fetch_inactive_tokens()
+		devices = audience(APNSDevice.objects.all())
+		registration_ids = []
+		# matched on the raw tokens of the feedback service, without hex encoding them
+		for tokens in chunks(expired, chunk_size(connections[devices.db], parameters=2)):
+			for registration_id in devices.filter_tokens(tokens).values_list('registration_id', flat=True):
+				self.stdout.write('deactivating [%s]' % registration_id)
+				registration_ids.append(registration_id)
+		# devices may be read from READ_DB, they are always deactivated on the primary
+		if registration_ids:
+			APNSDevice.objects.invalidate(registration_ids)
+		self.stdout.write('deactivated %d devices' % len(registration_ids))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+	can_import_settings = True
+	help = 'Recompute the members of the segments whose devices changed'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--all', action='store_true', default=False,
+			help='Refresh every segment, not only the dirty ones')
+
+	def handle(self, *args, **options):
+		from push_notifications.models import Segment
+
+		segments = Segment.objects.all()
+		if not options['all']:
+			segments = segments.filter(dirty=True)
+		for segment in segments.iterator():
+			segment.refresh()
+			self.stdout.write('%s: %d devices' % (segment.name, segment.count()))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+	can_import_settings = True
+	help = 'Send the scheduled notifications that are due'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch-size', type=int, default=None,
+			help='Number of notifications claimed and sent at a time (default: SCHEDULER_BATCH_SIZE)')
+		parser.add_argument('--chunk-size', type=int, default=1000,
+			help='Number of devices read and sent to at a time')
+		parser.add_argument('--interval', type=float, default=None,
+			help='Keep sending due notifications every INTERVAL seconds until interrupted')
+
+	def handle(self, *args, **options):
+		from push_notifications.scheduler import send_due
+
+		while True:
+			for notification in send_due(batch_size=options['batch_size'], chunk_size=options['chunk_size']):
+				if notification.error:
+					self.stderr.write('%s: %s' % (notification.pk, notification.error))
+				else:
+					self.stdout.write('%s: sent to %d devices, %d failures' % (
+						notification.pk, notification.devices, notification.failures
+					))
+			if options['interval'] is None:
+				break
+			time.sleep(options['interval'])
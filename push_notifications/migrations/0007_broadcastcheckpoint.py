@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('push_notifications', '0006_rollback_fcm_wns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BroadcastCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, verbose_name='Broadcast name')),
+                ('first_pk', models.BigIntegerField(verbose_name='First primary key of the shard')),
+                ('last_pk', models.BigIntegerField(verbose_name='Last primary key of the shard')),
+                ('sent_pk', models.BigIntegerField(verbose_name='Last primary key sent to')),
+                ('devices', models.PositiveIntegerField(default=0, verbose_name='Devices sent to')),
+                ('invalidated', models.PositiveIntegerField(default=0, verbose_name='Devices invalidated')),
+                ('completed', models.BooleanField(default=False, verbose_name='Is completed')),
+                ('fingerprint', models.CharField(blank=True, max_length=40, verbose_name='Audience and message hash')),
+                ('date_updated', models.DateTimeField(auto_now=True, verbose_name='Update date')),
+            ],
+            options={
+                'verbose_name': 'Broadcast checkpoint',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='broadcastcheckpoint',
+            unique_together=set([('name', 'first_pk')]),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('push_notifications', '0007_broadcastcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Segment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Name')),
+                ('service', models.CharField(choices=[('APNS', 'APNS devices'), ('GCM', 'GCM devices')], max_length=4, verbose_name='Devices')),
+                ('filters', models.TextField(default='{}', help_text='JSON object of queryset filter() keyword arguments', verbose_name='Filters')),
+                ('ranges', models.TextField(default='[]', editable=False, verbose_name='Member ranges')),
+                ('dirty', models.BooleanField(default=True, editable=False, verbose_name='Needs refresh')),
+                ('date_refreshed', models.DateTimeField(auto_now=True, verbose_name='Refresh date')),
+            ],
+            options={
+                'verbose_name': 'Segment',
+            },
+        ),
+    ]
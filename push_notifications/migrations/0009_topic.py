@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('push_notifications', '0008_segment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Topic',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, validators=[django.core.validators.RegexValidator('^[a-zA-Z0-9_.~%-]+$', 'Enter a valid topic name.')], verbose_name='Name')),
+                ('date_created', models.DateTimeField(auto_now_add=True, verbose_name='Creation date')),
+                ('apns_devices', models.ManyToManyField(blank=True, related_name='topics', to='push_notifications.APNSDevice', verbose_name='APNS subscribers')),
+                ('gcm_devices', models.ManyToManyField(blank=True, related_name='topics', to='push_notifications.GCMDevice', verbose_name='GCM subscribers')),
+            ],
+            options={
+                'verbose_name': 'Topic',
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('push_notifications', '0009_topic'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Delivery',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('service', models.CharField(choices=[('APNS', 'APNS'), ('GCM', 'GCM')], max_length=4, verbose_name='Notification service')),
+                ('payload', models.TextField(blank=True, verbose_name='Payload')),
+                ('devices', models.PositiveIntegerField(default=0, verbose_name='Devices sent to')),
+                ('failures', models.PositiveIntegerField(default=0, verbose_name='Failures')),
+                ('date_created', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Creation date')),
+            ],
+            options={
+                'verbose_name': 'Delivery',
+                'verbose_name_plural': 'Deliveries',
+            },
+        ),
+        migrations.CreateModel(
+            name='DeliveryOutcome',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_pk', models.BigIntegerField(db_index=True, null=True, verbose_name='Device primary key')),
+                ('status', models.PositiveSmallIntegerField(choices=[(0, 'sent'), (1, 'invalid'), (2, 'error')], verbose_name='Status')),
+                ('error', models.CharField(blank=True, max_length=64, verbose_name='Error')),
+                ('delivery', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outcomes', to='push_notifications.Delivery', verbose_name='Delivery')),
+            ],
+            options={
+                'verbose_name': 'Delivery outcome',
+            },
+        ),
+    ]
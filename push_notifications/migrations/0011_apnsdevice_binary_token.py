@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, transaction
+import push_notifications.fields
+
+BATCH_SIZE = 1000
+
+
+def convert_tokens(apps, schema_editor):
+    """Fill in binary_token from registration_id, BATCH_SIZE devices per transaction."""
+    APNSDevice = apps.get_model('push_notifications', 'APNSDevice')
+    db = schema_editor.connection.alias
+    devices = APNSDevice.objects.using(db).order_by('pk')
+    last_pk = None
+    while True:
+        batch = devices.filter(binary_token__isnull=True)
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        batch = list(batch.values_list('pk', 'registration_id')[:BATCH_SIZE])
+        if not batch:
+            break
+        with transaction.atomic(using=db):
+            for pk, registration_id in batch:
+                token = push_notifications.fields._hex_string_to_bytes(registration_id)
+                if token is not None:
+                    devices.filter(pk=pk).update(binary_token=token)
+        last_pk = batch[-1][0]
+
+
+class Migration(migrations.Migration):
+    # each batch is committed on its own
+    atomic = False
+
+    dependencies = [
+        ('push_notifications', '0010_delivery_log'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apnsdevice',
+            name='binary_token',
+            field=push_notifications.fields.BinaryTokenField(db_index=True, max_length=32, null=True, source='registration_id', verbose_name='Binary token'),
+        ),
+        migrations.RunPython(convert_tokens, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('push_notifications', '0011_apnsdevice_binary_token'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('service', models.CharField(choices=[('APNS', 'APNS'), ('GCM', 'GCM')], max_length=4, verbose_name='Notification service')),
+                ('device_pk', models.BigIntegerField(verbose_name='Device primary key')),
+                ('payload', models.TextField(verbose_name='Payload')),
+                ('enqueue_id', models.CharField(blank=True, db_index=True, max_length=32, verbose_name='Enqueue call')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Send attempts')),
+                ('last_error', models.TextField(blank=True, verbose_name='Last error')),
+                ('claimed_until', models.DateTimeField(blank=True, null=True, verbose_name='Claimed until')),
+                ('date_created', models.DateTimeField(auto_now_add=True, verbose_name='Creation date')),
+            ],
+            options={
+                'verbose_name': 'Outbox message',
+            },
+        ),
+    ]
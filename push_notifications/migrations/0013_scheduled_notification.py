@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('push_notifications', '0012_outbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduledNotification',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(blank=True, max_length=255, verbose_name='Name')),
+                ('service', models.CharField(choices=[('APNS', 'APNS devices'), ('GCM', 'GCM devices')], max_length=4, verbose_name='Devices')),
+                ('filters', models.TextField(default='{}', help_text='JSON object of queryset filter() keyword arguments', verbose_name='Filters')),
+                ('payload', models.TextField(verbose_name='Payload')),
+                ('first_pk', models.BigIntegerField(blank=True, null=True, verbose_name='First device primary key')),
+                ('last_pk', models.BigIntegerField(blank=True, null=True, verbose_name='Last device primary key')),
+                ('due_at', models.DateTimeField(verbose_name='Due date')),
+                ('date_claimed', models.DateTimeField(blank=True, null=True, verbose_name='Claim date')),
+                ('date_sent', models.DateTimeField(blank=True, null=True, verbose_name='Send date')),
+                ('devices', models.PositiveIntegerField(default=0, verbose_name='Devices sent to')),
+                ('failures', models.PositiveIntegerField(default=0, verbose_name='Failures')),
+                ('error', models.TextField(blank=True, verbose_name='Error')),
+                ('date_created', models.DateTimeField(auto_now_add=True, verbose_name='Creation date')),
+            ],
+            options={
+                'verbose_name': 'Scheduled notification',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='schedulednotification',
+            index_together=set([('date_sent', 'due_at')]),
+        ),
+    ]
@@ -1,14 +1,76 @@
 from __future__ import unicode_literals
 
+import json
+import operator
+import threading
+from binascii import hexlify
+from functools import reduce
+
 from django.conf import settings
-from django.core.exceptions import ValidationError
-from django.db import models
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.core.validators import RegexValidator
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils.functional import cached_property
 from django.utils.translation import ugettext_lazy as _
 
+from . import NotificationError, segments
 from .apns import (apns_fetch_inactive_ids, apns_send_bulk_message,
                    apns_send_message)
-from .fields import HexIntegerField
+from .bulk import update_matching
+from .fields import BinaryTokenField, HexIntegerField
+from .results import SendResult
+from .routing import audience
+from .settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+from .signals import devices_invalidated
+
+
+class Recipient(object):
+	"""
+	The part of a device needed to send it a notification.
+	Bulk sends from querysets use recipients instead of model instances, see
+	for_model() and the recipients() method of the device querysets.
+	"""
+	__slots__ = ("pk", "registration_id", "user_id", "binary_token")
+	_classes = {}
+
+	def __init__(self, pk, registration_id, user_id=None, binary_token=None):
+		self.pk = pk
+		self.registration_id = registration_id
+		self.user_id = user_id
+		self.binary_token = binary_token
+
+	@classmethod
+	def for_model(cls, model):
+		"""
+		Returns the recipient class of a device model. Like model instances,
+		its instances can be invalidated through their class's manager.
+		"""
+		try:
+			return cls._classes[model]
+		except KeyError:
+			recipient_class = type(str("%sRecipient" % (model.__name__)), (cls, ), {
+				"__slots__": (),
+				"objects": model.objects,
+			})
+			cls._classes[model] = recipient_class
+			return recipient_class
+
+
+def get_gcm_backend(backend=None):
+	"""
+	Returns the single and bulk send functions of a GCM backend: "gcm" (the
+	legacy HTTP API) or "fcm" (the FCM HTTP v1 API), GCM_BACKEND by default.
+	"""
+	backend = backend or SETTINGS["GCM_BACKEND"]
+	if backend == "fcm":
+		from .fcm import fcm_send_bulk_message, fcm_send_message
+		return fcm_send_message, fcm_send_bulk_message
+	elif backend == "gcm":
+		from .gcm import gcm_send_bulk_message, gcm_send_message
+		return gcm_send_message, gcm_send_bulk_message
+	raise ImproperlyConfigured("Unknown GCM backend: %r" % (backend))
 
 
 class DeviceManager(models.Manager):
@@ -18,42 +80,101 @@ class DeviceManager(models.Manager):
 
 	def invalidate(self, registration_ids):
 		"""Called when some registration ids are deemed invalid. """
-		self.filter(registration_id__in=registration_ids).update(service=self.model.INACTIVE)
+		update_matching(self.all(), "registration_id", registration_ids, service=self.model.INACTIVE)
+		devices_invalidated.send(sender=self.model, registration_ids=registration_ids)
+
+
+def _send_concurrently(sends):
+	"""
+	Runs the send functions of several providers in parallel, each in its own
+	thread with its own database connections. A single provider, or sends
+	made inside a transaction (whose invalidations need to be part of it),
+	run inline. Returns a report with the result of each provider, and the
+	NotificationErrors raised by the failed ones under "errors". Any other
+	exception is raised once all the providers are done.
+	"""
+	report = dict((provider, None) for provider in sends)
+	report["errors"] = {}
+	exceptions = []
+
+	def run(provider, send, threaded):
+		try:
+			report[provider] = send()
+		except NotificationError as e:
+			report["errors"][provider] = e
+		except Exception as e:
+			if not threaded:
+				raise
+			exceptions.append(e)
+		finally:
+			if threaded:
+				for connection in connections.all():
+					connection.close()
+
+	if len(sends) == 1 or any(connection.in_atomic_block for connection in connections.all()):
+		for provider, send in sorted(sends.items()):
+			run(provider, send, False)
+		return report
+
+	threads = [
+		threading.Thread(target=run, args=(provider, send, True))
+		for provider, send in sends.items()
+	]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	if exceptions:
+		raise exceptions[0]
+	return report
 
 
 class DeviceQuerySet(models.query.QuerySet):
 	def send_message(self, message, **kwargs):
-		if self:
-			gcmDevices = []
-			apnsDevices = []
-
-			for device in self:
-				if device.service == self.model.APNS:
-					apnsDevices.append(device)
-				elif device.service == self.model.GCM:
-					gcmDevices.append(device)
-
-			if apnsDevices:
-				apns_send_bulk_message(
-					devices=apnsDevices,
-					alert=message,
-					certificate=apnsDevices[0].APNS_CERTIFICATE,
-					**kwargs
-				)
+		"""
+		Sends a message to the APNS and GCM devices of the queryset, both
+		providers at the same time.
+		Returns a dict of the "apns" and "gcm" results, along with the
+		exceptions raised by either provider under "errors".
+		"""
+		backend = kwargs.pop("backend", None)
+		gcmDevices = []
+		apnsDevices = []
+
+		recipient_class = Recipient.for_model(self.model)
+		values = audience(self).values_list("pk", "service", "registration_id")
+		for pk, service, registration_id in values.iterator():
+			if service == self.model.APNS:
+				apnsDevices.append(recipient_class(pk, registration_id))
+			elif service == self.model.GCM:
+				gcmDevices.append(recipient_class(pk, registration_id))
+
+		sends = {}
+		if apnsDevices:
+			sends["apns"] = lambda: apns_send_bulk_message(
+				devices=apnsDevices,
+				alert=message,
+				certificate=self.model.APNS_CERTIFICATE,
+				**kwargs
+			)
+
+		if gcmDevices:
+			gcm_kwargs = kwargs.copy()
+			data = gcm_kwargs.pop("extra", {})
+			if message is not None:
+				data["message"] = message
 
-			if gcmDevices:
-				data = kwargs.pop("extra", {})
-				if message is not None:
-					data["message"] = message
+			gcm_send_bulk_message = get_gcm_backend(backend)[1]
+			sends["gcm"] = lambda: gcm_send_bulk_message(
+				devices=gcmDevices,
+				data=data,
+				api_key=self.model.GCM_API_KEY,
+				**gcm_kwargs
+			)
 
-				from .gcm import gcm_send_bulk_message
-				return gcm_send_bulk_message(
-					devices=gcmDevices,
-					data=data,
-					api_key=gcmDevices[0].GCM_API_KEY,
-					**kwargs
-				)
-			return None
+		if sends:
+			return _send_concurrently(sends)
+		return None
 
 
 class BareDevice(models.Model):
@@ -97,6 +218,7 @@ class BareDevice(models.Model):
 		super(BareDevice, self).save(*args, **kwargs)
 
 	def send_message(self, message, **kwargs):
+		backend = kwargs.pop("backend", None)
 		if self.active:
 			if self.service == self.APNS:
 				return apns_send_message(
@@ -109,7 +231,7 @@ class BareDevice(models.Model):
 				data = kwargs.pop("extra", {})
 				if message is not None:
 					data["message"] = message
-				from .gcm import gcm_send_message
+				gcm_send_message = get_gcm_backend(backend)[0]
 				return gcm_send_message(
 					device=self,
 					data=data,
@@ -140,27 +262,137 @@ class Device(models.Model):
 	class Meta:
 		abstract = True
 
+	def queue_message(self, message, **kwargs):
+		""" Queues a message for the device in the outbox, see push_notifications.outbox """
+		from .outbox import enqueue
+		return enqueue([self], message, **kwargs)
+
 	def __unicode__(self):
 		return self.name or \
 			str(self.device_id or "") or \
 			"%s for %s" % (self.__class__.__name__, self.user or "unknown user")
 
 
-class GCMDeviceManager(models.Manager):
+class RegistrationManagerMixin(object):
+	"""
+	Registers devices by registration_id without creating duplicates.
+	"""
+
+	def invalidate(self, registration_ids):
+		"""Called when some registration ids are deemed invalid. """
+		update_matching(self.all(), "registration_id", registration_ids, active=False)
+		devices_invalidated.send(sender=self.model, registration_ids=registration_ids)
+
+	def upsert(self, registration_id, **defaults):
+		"""
+		Creates the device with this registration_id, or updates the existing
+		one(s) with the given values. Returns the device.
+		When registration_id is unique, this is a single statement on
+		PostgreSQL (9.5+) and MySQL. Otherwise it is an UPDATE followed by an
+		INSERT: for GCMDevice, whose registration_id is not unique, two
+		concurrent registrations of a new registration id can still create
+		two devices, which the dedupe_devices command cleans up.
+		"""
+		connection = connections[self.db]
+		unique = self.model._meta.get_field("registration_id").unique
+		if unique and connection.vendor in ("postgresql", "mysql"):
+			pk = self._upsert_statement(connection, registration_id, defaults)
+			mark_segments_dirty(self.model)
+			return self.get(pk=pk)
+
+		with transaction.atomic(using=self.db):
+			if self._update_registration(registration_id, defaults):
+				mark_segments_dirty(self.model)
+				return self.filter(registration_id=registration_id).order_by("-pk")[0]
+			try:
+				with transaction.atomic(using=self.db):
+					return self.create(registration_id=registration_id, **defaults)
+			except IntegrityError:
+				# registered concurrently, by the time we get here it exists
+				self._update_registration(registration_id, defaults)
+				return self.get(registration_id=registration_id)
+
+	def _update_registration(self, registration_id, defaults):
+		devices = self.filter(registration_id=registration_id)
+		if not defaults:
+			return devices.exists()
+		return devices.update(**defaults)
+
+	def _upsert_statement(self, connection, registration_id, defaults):
+		qn = connection.ops.quote_name
+		opts = self.model._meta
+		device = self.model(registration_id=registration_id, **defaults)
+		fields = [field for field in opts.concrete_fields if not field.primary_key]
+		updated = [
+			field for field in fields
+			if field.name in defaults or field.attname in defaults
+		] or [opts.get_field("registration_id")]
+
+		sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+			qn(opts.db_table),
+			", ".join(qn(field.column) for field in fields),
+			", ".join(["%s"] * len(fields)),
+		)
+		if connection.vendor == "postgresql":
+			sql += " ON CONFLICT (%s) DO UPDATE SET %s RETURNING %s" % (
+				qn(opts.get_field("registration_id").column),
+				", ".join("%s = EXCLUDED.%s" % (qn(field.column), qn(field.column)) for field in updated),
+				qn(opts.pk.column),
+			)
+		else:
+			# LAST_INSERT_ID(expr) makes lastrowid the id of the updated row
+			sql += " ON DUPLICATE KEY UPDATE %s, %s = LAST_INSERT_ID(%s)" % (
+				", ".join("%s = VALUES(%s)" % (qn(field.column), qn(field.column)) for field in updated),
+				qn(opts.pk.column),
+				qn(opts.pk.column),
+			)
+		params = [
+			field.get_db_prep_save(field.pre_save(device, True), connection=connection)
+			for field in fields
+		]
+
+		with connection.cursor() as cursor:
+			cursor.execute(sql, params)
+			if connection.vendor == "postgresql":
+				return cursor.fetchone()[0]
+			return cursor.lastrowid
+
+
+class GCMDeviceManager(RegistrationManagerMixin, models.Manager):
 	def get_queryset(self):
 		return GCMDeviceQuerySet(self.model)
 
 
-class GCMDeviceQuerySet(models.query.QuerySet):
+class RecipientQuerySetMixin(object):
+	def recipients(self):
+		"""
+		Iterate over the devices as lightweight Recipient records
+		"""
+		recipient_class = Recipient.for_model(self.model)
+		for pk, registration_id, user_id in self.values_list("pk", "registration_id", "user_id").iterator():
+			yield recipient_class(pk, registration_id, user_id)
+
+	def queue_message(self, message, **kwargs):
+		""" Queues a message for the devices in the outbox, see push_notifications.outbox """
+		from .outbox import enqueue
+		return enqueue(self.recipients(), message, **kwargs)
+
+
+class GCMDeviceQuerySet(RecipientQuerySetMixin, models.query.QuerySet):
 	def send_message(self, message, **kwargs):
-		if self:
-			from .gcm import gcm_send_bulk_message
+		devices = audience(self)
+		if devices.exists():
+			return self.send_to_recipients(devices.recipients(), message, **kwargs)
 
-			data = kwargs.pop("extra", {})
-			if message is not None:
-				data["message"] = message
+	def send_to_recipients(self, recipients, message, **kwargs):
+		""" Sends a message to Recipients of the model of the queryset, in bulk """
+		gcm_send_bulk_message = get_gcm_backend(kwargs.pop("backend", None))[1]
+
+		data = kwargs.pop("extra", {})
+		if message is not None:
+			data["message"] = message
 
-			return gcm_send_bulk_message(devices=self, data=data, **kwargs)
+		return gcm_send_bulk_message(devices=recipients, data=data, **kwargs)
 
 
 class GCMDevice(Device):
@@ -177,28 +409,57 @@ class GCMDevice(Device):
 		verbose_name = _("GCM device")
 
 	def send_message(self, message, **kwargs):
-		from .gcm import gcm_send_message
+		gcm_send_message = get_gcm_backend(kwargs.pop("backend", None))[0]
 		data = kwargs.pop("extra", {})
 		if message is not None:
 			data["message"] = message
 		return gcm_send_message(device=self, data=data, **kwargs)
 
 
-class APNSDeviceManager(models.Manager):
+class APNSDeviceManager(RegistrationManagerMixin, models.Manager):
 	def get_queryset(self):
 		return APNSDeviceQuerySet(self.model)
 
 
-class APNSDeviceQuerySet(models.query.QuerySet):
+class APNSDeviceQuerySet(RecipientQuerySetMixin, models.query.QuerySet):
+	def recipients(self):
+		"""
+		Iterate over the devices as lightweight Recipient records, with their
+		binary token
+		"""
+		recipient_class = Recipient.for_model(self.model)
+		values = self.values_list("pk", "registration_id", "user_id", "binary_token")
+		for pk, registration_id, user_id, binary_token in values.iterator():
+			yield recipient_class(pk, registration_id, user_id, binary_token)
+
+	def filter_tokens(self, tokens):
+		"""
+		Filters the devices by raw token, such as the tokens of the feedback
+		service. Devices without a binary token are matched by registration_id.
+		"""
+		tokens = list(tokens)
+		return self.filter(
+			models.Q(binary_token__in=tokens) |
+			models.Q(binary_token__isnull=True, registration_id__in=[hexlify(token).decode("ascii") for token in tokens])
+		)
+
 	def send_message(self, message, **kwargs):
-		if self:
-			return apns_send_bulk_message(devices=self, alert=message, **kwargs)
+		devices = audience(self)
+		if devices.exists():
+			return self.send_to_recipients(devices.recipients(), message, **kwargs)
+
+	def send_to_recipients(self, recipients, message, **kwargs):
+		""" Sends a message to Recipients of the model of the queryset, in bulk """
+		return apns_send_bulk_message(devices=recipients, alert=message, **kwargs)
 
 
 class APNSDevice(Device):
 	device_id = models.UUIDField(verbose_name=_("Device ID"), blank=True, null=True, db_index=True,
 		help_text="UDID / UIDevice.identifierForVendor()")
 	registration_id = models.CharField(verbose_name=_("Registration ID"), max_length=64, unique=True)
+	# the registration_id as 32 bytes, which APNS frames and feedback use
+	binary_token = BinaryTokenField(verbose_name=_("Binary token"), source="registration_id",
+		max_length=32, null=True, db_index=True)
 
 	objects = APNSDeviceManager()
 
@@ -209,7 +470,314 @@ class APNSDevice(Device):
 		return apns_send_message(device=self, alert=message, **kwargs)
 
 
+class Segment(models.Model):
+	"""
+	A precomputed audience: the devices of one model matching `filters`.
+	Members are stored as primary key ranges, so sending to a segment does
+	not run its filters again. Saving, deleting, registering or invalidating
+	devices only marks the segments of their model as dirty; a dirty segment
+	recomputes its members when they are next read, or from the
+	refresh_segments command.
+	Devices changed with a queryset update() or created with bulk_create()
+	outside of this app are not tracked; call mark_segments_dirty() after those.
+	"""
+	APNS = "APNS"
+	GCM = "GCM"
+	SERVICES = (
+		(APNS, _("APNS devices")),
+		(GCM, _("GCM devices")),
+	)
+
+	name = models.CharField(max_length=255, verbose_name=_("Name"), unique=True)
+	service = models.CharField(max_length=4, choices=SERVICES, verbose_name=_("Devices"))
+	filters = models.TextField(verbose_name=_("Filters"), default="{}",
+		help_text=_("JSON object of queryset filter() keyword arguments"))
+	ranges = models.TextField(verbose_name=_("Member ranges"), default="[]", editable=False)
+	dirty = models.BooleanField(verbose_name=_("Needs refresh"), default=True, editable=False)
+	date_refreshed = models.DateTimeField(verbose_name=_("Refresh date"), auto_now=True)
+
+	# Number of ranges per query when sending to a segment
+	SEND_RANGES = 100
+
+	class Meta:
+		verbose_name = _("Segment")
+
+	def __unicode__(self):
+		return self.name
+
+	def get_model(self):
+		return APNSDevice if self.service == self.APNS else GCMDevice
+
+	def get_filters(self):
+		return json.loads(self.filters)
+
+	def get_ranges(self):
+		if self.dirty:
+			self.refresh()
+		return json.loads(self.ranges)
+
+	def count(self):
+		""" Returns the number of members of the segment """
+		return segments.count(self.get_ranges())
+
+	def contains(self, device):
+		return segments.contains(self.get_ranges(), device.pk)
+
+	def refresh(self):
+		""" Recomputes the members of the segment by running its filters """
+		# cleared first, so that devices changed meanwhile mark it dirty again
+		Segment.objects.filter(pk=self.pk).update(dirty=False)
+		self.dirty = False
+		pks = self.get_model().objects.filter(**self.get_filters()).order_by("pk").values_list("pk", flat=True)
+		self.ranges = json.dumps(segments.pks_to_ranges(pks.iterator()), separators=(",", ":"))
+		self.save(update_fields=("ranges", "date_refreshed"))
+
+	def devices(self, ranges=None):
+		""" Returns a queryset of the members of the segment """
+		ranges = self.get_ranges() if ranges is None else ranges
+		if not ranges:
+			return self.get_model().objects.none()
+		query = reduce(operator.or_, (models.Q(pk__range=(first, last)) for first, last in ranges))
+		return self.get_model().objects.filter(query)
+
+	def send_message(self, message, **kwargs):
+		"""
+		Sends a message to all the members of the segment, SEND_RANGES ranges
+		at a time. Returns the merged SendResult of the bulk sends.
+		"""
+		ranges = self.get_ranges()
+		return SendResult.merged(
+			self.devices(ranges[i:i + self.SEND_RANGES]).send_message(message, **kwargs)
+			for i in range(0, len(ranges), self.SEND_RANGES)
+		)
+
+
+def mark_segments_dirty(model):
+	"""
+	Marks the segments of a device model as needing a refresh. This is a
+	single UPDATE, which matches no rows while they are already dirty.
+	"""
+	service = Segment.APNS if issubclass(model, APNSDevice) else Segment.GCM
+	Segment.objects.filter(service=service, dirty=False).update(dirty=True)
+
+
+@receiver(post_save, sender=APNSDevice)
+@receiver(post_save, sender=GCMDevice)
+@receiver(post_delete, sender=APNSDevice)
+@receiver(post_delete, sender=GCMDevice)
+def update_segments(sender, instance, **kwargs):
+	mark_segments_dirty(sender)
+
+
+@receiver(devices_invalidated, sender=APNSDevice)
+@receiver(devices_invalidated, sender=GCMDevice)
+def update_segments_on_invalidation(sender, registration_ids, **kwargs):
+	mark_segments_dirty(sender)
+
+
+topic_name_validator = RegexValidator(
+	r"^[a-zA-Z0-9_.~%-]+$",
+	_("Enter a valid topic name.")
+)
+
+
+class Topic(models.Model):
+	"""
+	A group of devices that can be sent a notification at once.
+	GCM subscriptions are mirrored to the GCM topic of the same name, so that
+	sending to the topic is a single request and GCM does the fan-out.
+	APNS subscribers are streamed from the subscription table to the bulk sender.
+	"""
+	name = models.CharField(max_length=255, verbose_name=_("Name"), unique=True,
+		validators=[topic_name_validator])
+	apns_devices = models.ManyToManyField(APNSDevice, blank=True, related_name="topics",
+		verbose_name=_("APNS subscribers"))
+	gcm_devices = models.ManyToManyField(GCMDevice, blank=True, related_name="topics",
+		verbose_name=_("GCM subscribers"))
+	date_created = models.DateTimeField(verbose_name=_("Creation date"), auto_now_add=True)
+
+	class Meta:
+		verbose_name = _("Topic")
+
+	def __unicode__(self):
+		return self.name
+
+	def _subscribers(self, devices):
+		# devices (or Recipients) of one model, model instances have their
+		# manager on their class too
+		model = devices[0].__class__.objects.model
+		return self.apns_devices if model is APNSDevice else self.gcm_devices
+
+	def subscribe(self, devices):
+		""" Subscribes devices (or Recipients) of one model to the topic """
+		devices = list(devices)
+		if not devices:
+			return
+		subscribers = self._subscribers(devices)
+		if subscribers.model is GCMDevice:
+			from .gcm import gcm_subscribe
+			gcm_subscribe(devices, self.name)
+		subscribers.add(*[device.pk for device in devices])
+
+	def unsubscribe(self, devices):
+		""" Unsubscribes devices (or Recipients) of one model from the topic """
+		devices = list(devices)
+		if not devices:
+			return
+		subscribers = self._subscribers(devices)
+		if subscribers.model is GCMDevice:
+			from .gcm import gcm_unsubscribe
+			gcm_unsubscribe(devices, self.name)
+		subscribers.remove(*[device.pk for device in devices])
+
+	def send_message(self, message, **kwargs):
+		"""
+		Sends a message to the active subscribers of the topic.
+		Returns a dict of the "apns" and "gcm" results. GCM subscribers get
+		the message through the legacy GCM API whatever the backend.
+		"""
+		kwargs = kwargs.copy()
+		kwargs.pop("backend", None)
+		ret = {"apns": None, "gcm": None}
+		ret["apns"] = self.apns_devices.filter(active=True).send_message(message, **kwargs)
+
+		if self.gcm_devices.filter(active=True).exists():
+			from .gcm import gcm_send_topic_message
+			data = kwargs.pop("extra", {})
+			if message is not None:
+				data["message"] = message
+			ret["gcm"] = gcm_send_topic_message(self.name, data, **kwargs)
+		return ret
+
+
 # This is an APNS-only function right now, but maybe GCM will implement it
 # in the future.  But the definition of 'expired' may not be the same. Whatevs
 def get_expired_tokens():
 	return apns_fetch_inactive_ids()
+
+
+class BroadcastCheckpoint(models.Model):
+	"""
+	Progress of one shard of a named broadcast, so that an interrupted
+	broadcast can be resumed. See push_notifications.broadcast.
+	"""
+	name = models.CharField(max_length=255, verbose_name=_("Broadcast name"))
+	first_pk = models.BigIntegerField(verbose_name=_("First primary key of the shard"))
+	last_pk = models.BigIntegerField(verbose_name=_("Last primary key of the shard"))
+	sent_pk = models.BigIntegerField(verbose_name=_("Last primary key sent to"))
+	devices = models.PositiveIntegerField(verbose_name=_("Devices sent to"), default=0)
+	invalidated = models.PositiveIntegerField(verbose_name=_("Devices invalidated"), default=0)
+	completed = models.BooleanField(verbose_name=_("Is completed"), default=False)
+	fingerprint = models.CharField(max_length=40, verbose_name=_("Audience and message hash"), blank=True)
+	date_updated = models.DateTimeField(verbose_name=_("Update date"), auto_now=True)
+
+	class Meta:
+		verbose_name = _("Broadcast checkpoint")
+		unique_together = (("name", "first_pk"), )
+
+
+class Delivery(models.Model):
+	"""
+	A bulk send recorded by the delivery log, see push_notifications.deliverylog.
+	"""
+	SERVICES = (
+		("APNS", "APNS"),
+		("GCM", "GCM"),
+	)
+
+	service = models.CharField(max_length=4, choices=SERVICES, verbose_name=_("Notification service"))
+	payload = models.TextField(verbose_name=_("Payload"), blank=True)
+	devices = models.PositiveIntegerField(verbose_name=_("Devices sent to"), default=0)
+	failures = models.PositiveIntegerField(verbose_name=_("Failures"), default=0)
+	date_created = models.DateTimeField(verbose_name=_("Creation date"), auto_now_add=True, db_index=True)
+
+	class Meta:
+		verbose_name = _("Delivery")
+		verbose_name_plural = _("Deliveries")
+
+
+class DeliveryOutcome(models.Model):
+	"""
+	The outcome of a delivery for one device. device_pk is not a foreign key
+	so that the log outlives deleted devices and costs no constraint checks.
+	"""
+	delivery = models.ForeignKey(Delivery, related_name="outcomes", verbose_name=_("Delivery"))
+	device_pk = models.BigIntegerField(verbose_name=_("Device primary key"), null=True, db_index=True)
+	status = models.PositiveSmallIntegerField(verbose_name=_("Status"), choices=[
+		(status, name) for status, name in sorted(SendResult.STATUSES.items())
+	])
+	error = models.CharField(max_length=64, verbose_name=_("Error"), blank=True)
+
+	class Meta:
+		verbose_name = _("Delivery outcome")
+
+
+class OutboxMessage(models.Model):
+	"""
+	A notification waiting in the outbox to be sent to one device, see
+	push_notifications.outbox. device_pk is not a foreign key, like
+	DeliveryOutcome, since it refers to either device model.
+	"""
+	SERVICES = Delivery.SERVICES
+
+	service = models.CharField(max_length=4, choices=SERVICES, verbose_name=_("Notification service"))
+	device_pk = models.BigIntegerField(verbose_name=_("Device primary key"))
+	payload = models.TextField(verbose_name=_("Payload"))
+	enqueue_id = models.CharField(max_length=32, verbose_name=_("Enqueue call"), blank=True, db_index=True)
+	attempts = models.PositiveIntegerField(verbose_name=_("Send attempts"), default=0)
+	last_error = models.TextField(verbose_name=_("Last error"), blank=True)
+	claimed_until = models.DateTimeField(verbose_name=_("Claimed until"), blank=True, null=True)
+	date_created = models.DateTimeField(verbose_name=_("Creation date"), auto_now_add=True)
+
+	class Meta:
+		verbose_name = _("Outbox message")
+
+
+class ScheduledNotification(models.Model):
+	"""
+	A notification to send once due_at has passed to the active devices of
+	one model matching `filters`, see push_notifications.scheduler.
+	first_pk and last_pk, when set, restrict it to a range of devices so that
+	a campaign can be spread over several notifications.
+	"""
+	APNS = Segment.APNS
+	GCM = Segment.GCM
+	SERVICES = Segment.SERVICES
+
+	name = models.CharField(max_length=255, verbose_name=_("Name"), blank=True)
+	service = models.CharField(max_length=4, choices=SERVICES, verbose_name=_("Devices"))
+	filters = models.TextField(verbose_name=_("Filters"), default="{}",
+		help_text=_("JSON object of queryset filter() keyword arguments"))
+	payload = models.TextField(verbose_name=_("Payload"))
+	first_pk = models.BigIntegerField(verbose_name=_("First device primary key"), null=True, blank=True)
+	last_pk = models.BigIntegerField(verbose_name=_("Last device primary key"), null=True, blank=True)
+	due_at = models.DateTimeField(verbose_name=_("Due date"))
+	date_claimed = models.DateTimeField(verbose_name=_("Claim date"), null=True, blank=True)
+	date_sent = models.DateTimeField(verbose_name=_("Send date"), null=True, blank=True)
+	devices = models.PositiveIntegerField(verbose_name=_("Devices sent to"), default=0)
+	failures = models.PositiveIntegerField(verbose_name=_("Failures"), default=0)
+	error = models.TextField(verbose_name=_("Error"), blank=True)
+	date_created = models.DateTimeField(verbose_name=_("Creation date"), auto_now_add=True)
+
+	class Meta:
+		verbose_name = _("Scheduled notification")
+		# the scheduler looks for unsent notifications by due date
+		index_together = (("date_sent", "due_at"), )
+
+	def __unicode__(self):
+		return self.name or "%s notification due at %s" % (self.service, self.due_at)
+
+	def get_model(self):
+		return APNSDevice if self.service == self.APNS else GCMDevice
+
+	def get_filters(self):
+		return json.loads(self.filters)
+
+	def get_queryset(self):
+		""" Returns the active devices the notification is for """
+		queryset = self.get_model().objects.filter(active=True, **self.get_filters())
+		if self.first_pk is not None:
+			queryset = queryset.filter(pk__gte=self.first_pk)
+		if self.last_pk is not None:
+			queryset = queryset.filter(pk__lte=self.last_pk)
+		return queryset
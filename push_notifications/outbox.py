@@ -0,0 +1,192 @@
+"""
+Transactional outbox.
+enqueue() records notifications in the OutboxMessage table as part of the
+current transaction instead of sending them: they are only sent if the
+transaction commits, and never while it is open. Once the transaction
+commits (Django 1.9+, with OUTBOX_FLUSH_ON_COMMIT), the messages of each
+enqueue() call are sent, up to OUTBOX_COMMIT_BATCH_SIZE of them; the others
+are left to the flush_outbox command. flush() coalesces the pending messages
+sharing a payload into a bulk send per service.
+"""
+
+import json
+import logging
+import uuid
+from datetime import timedelta
+
+from django.db import connections, router, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import NotificationError
+from .bulk import chunk_size, claim, matching, update_matching
+from .settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+
+
+logger = logging.getLogger(__name__)
+
+
+def encode_payload(message, kwargs):
+	# keys sorted so that identical messages share a payload
+	return json.dumps({"message": message, "kwargs": kwargs}, separators=(",", ":"), sort_keys=True)
+
+
+def enqueue(devices, message, **kwargs):
+	"""
+	Queues a message for devices (or Recipients) of APNSDevice or GCMDevice.
+	Keyword arguments are those of send_message() and need to be JSON
+	serializable. Returns the number of messages queued.
+	"""
+	from .models import APNSDevice, GCMDevice, OutboxMessage
+
+	payload = encode_payload(message, kwargs)
+	enqueue_id = uuid.uuid4().hex
+	messages = []
+	for device in devices:
+		model = device.__class__.objects.model
+		if issubclass(model, APNSDevice):
+			service = "APNS"
+		elif issubclass(model, GCMDevice):
+			service = "GCM"
+		else:
+			raise TypeError("Only APNSDevice and GCMDevice devices can be queued, not %s." % (model.__name__))
+		messages.append(OutboxMessage(service=service, device_pk=device.pk, payload=payload, enqueue_id=enqueue_id))
+	if not messages:
+		return 0
+
+	db = router.db_for_write(OutboxMessage)
+	OutboxMessage.objects.using(db).bulk_create(messages)
+	if SETTINGS["OUTBOX_FLUSH_ON_COMMIT"] and hasattr(transaction, "on_commit"):
+		# on Django 1.8, the messages wait for the flush_outbox command
+		transaction.on_commit(lambda: _flush_enqueued(enqueue_id), using=db)
+	return len(messages)
+
+
+def _flush_enqueued(enqueue_id):
+	# run once the transaction committed: its exceptions would reach the
+	# code that committed, which has nothing to do with them
+	try:
+		flush(batch_size=SETTINGS["OUTBOX_COMMIT_BATCH_SIZE"], max_batches=1, enqueue_id=enqueue_id)
+	except Exception:
+		logger.exception("Flushing the outbox on commit failed, the messages are left to flush_outbox")
+
+
+def _send(model, payload, pks):
+	""" Returns the errors of the devices which could not be sent to, by pk """
+	data = json.loads(payload)
+	queryset = model.objects.filter(active=True)
+	recipients = []
+	for devices in matching(queryset, "pk", pks):
+		recipients.extend(devices.recipients())
+	if not recipients:
+		return {}
+	result = queryset.send_to_recipients(recipients, data["message"], **data["kwargs"])
+	return dict((result.pks[row], error) for row, error in result.errors.items() if result.statuses[row] == result.ERROR)
+
+
+def _claim(db, pending, batch_size):
+	"""
+	Claims a batch of messages in a transaction of its own, for
+	OUTBOX_CLAIM_TIMEOUT seconds, counting it as an attempt.
+	"""
+	from .models import OutboxMessage
+
+	now = timezone.now()
+	with transaction.atomic(using=db):
+		batch = claim(pending.filter(Q(claimed_until__isnull=True) | Q(claimed_until__lt=now)), batch_size)
+		update_matching(
+			OutboxMessage.objects.using(db), "pk", [message.pk for message in batch],
+			claimed_until=now + timedelta(seconds=SETTINGS["OUTBOX_CLAIM_TIMEOUT"]), attempts=F("attempts") + 1
+		)
+	return batch
+
+
+def flush(batch_size=None, max_batches=None, enqueue_id=None):
+	"""
+	Sends the pending messages of the outbox (or of one enqueue() call),
+	`batch_size` (by default OUTBOX_BATCH_SIZE) at a time, in a bulk send per
+	service and payload, and up to `max_batches` batches. Each batch is
+	claimed in a short transaction, sent, and then deleted, so that a message
+	is sent at least once even if the process dies: the claim expires after
+	OUTBOX_CLAIM_TIMEOUT seconds. Messages whose send raised a
+	NotificationError, or whose device the provider reported an error for,
+	keep the error and are left for the next flush, up to OUTBOX_MAX_ATTEMPTS
+	attempts.
+	Returns the number of messages and bulk sends, and the errors.
+	"""
+	from .models import APNSDevice, GCMDevice, OutboxMessage
+
+	batch_size = batch_size or SETTINGS["OUTBOX_BATCH_SIZE"]
+	db = router.db_for_write(OutboxMessage)
+	pending = OutboxMessage.objects.using(db).filter(attempts__lt=SETTINGS["OUTBOX_MAX_ATTEMPTS"])
+	if enqueue_id is not None:
+		pending = pending.filter(enqueue_id=enqueue_id)
+	report = {"messages": 0, "sends": 0, "errors": []}
+	last_pk = 0
+	batches = 0
+	while max_batches is None or batches < max_batches:
+		batch = _claim(db, pending.filter(pk__gt=last_pk).order_by("pk"), batch_size)
+		if not batch:
+			break
+		last_pk = batch[-1].pk
+		batches += 1
+
+		groups = {}
+		for message in batch:
+			groups.setdefault((message.service, message.payload), []).append(message)
+		sent = []
+		failed = {}
+		try:
+			for (service, payload), messages in sorted(groups.items()):
+				model = APNSDevice if service == "APNS" else GCMDevice
+				try:
+					errors = _send(model, payload, [message.device_pk for message in messages])
+				except NotificationError as e:
+					report["errors"].append(str(e))
+					failed.setdefault(str(e), []).extend(message.pk for message in messages)
+					continue
+				for message in messages:
+					if message.device_pk in errors:
+						error = "%s device %s: %s" % (service, message.device_pk, errors[message.device_pk])
+						report["errors"].append(error)
+						failed.setdefault(error, []).append(message.pk)
+					else:
+						sent.append(message.pk)
+				report["sends"] += 1
+		except Exception as e:
+			# the messages of this send and of the next ones are released
+			done = set(sent).union(*failed.values())
+			failed.setdefault("%s: %s" % (e.__class__.__name__, e), []).extend(
+				message.pk for message in batch if message.pk not in done
+			)
+			raise
+		finally:
+			# what was sent is deleted even if a later send raised
+			for messages in matching(OutboxMessage.objects.using(db), "pk", sent):
+				messages.delete()
+			for error, pks in failed.items():
+				update_matching(OutboxMessage.objects.using(db), "pk", pks, last_error=error, claimed_until=None)
+			report["messages"] += len(sent)
+	return report
+
+
+def given_up():
+	""" Returns the messages no longer sent after OUTBOX_MAX_ATTEMPTS attempts """
+	from .models import OutboxMessage
+
+	return OutboxMessage.objects.using(router.db_for_write(OutboxMessage)).filter(
+		attempts__gte=SETTINGS["OUTBOX_MAX_ATTEMPTS"]
+	)
+
+
+def prune():
+	""" Deletes the messages given up on, returning how many were deleted """
+	messages = given_up()
+	size = chunk_size(connections[messages.db])
+	deleted = 0
+	while True:
+		pks = list(messages.order_by("pk").values_list("pk", flat=True)[:size])
+		if not pks:
+			return deleted
+		messages.filter(pk__in=pks).delete()
+		deleted += len(pks)
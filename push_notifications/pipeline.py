@@ -0,0 +1,163 @@
+"""
+Pipelined bulk sends.
+Bulk sends otherwise read the devices, send to them and write their
+invalidations in turn. send_pipelined() runs those three stages at once: a
+reader thread loads the next chunks of devices while the current one is
+being sent, and a writer thread applies the invalidations of the chunks
+already sent. The stages are connected by bounded queues, so that a stage
+running ahead waits for the others instead of buffering the whole audience.
+"""
+
+import threading
+
+from django.db import connections
+
+from .invalidation import InvalidationBuffer, deferred_invalidations, write_invalidations
+from .results import SendResult
+from .routing import audience
+
+try:
+	from queue import Empty, Full, Queue
+except ImportError:
+	# Python 2 support
+	from Queue import Empty, Full, Queue
+
+
+# how often blocked stages check whether the pipeline was stopped
+POLL_INTERVAL = 0.1
+
+_DONE = object()
+
+
+class _Stage(threading.Thread):
+	""" A pipeline thread, which records its exception and closes its database connections """
+	def __init__(self, target):
+		super(_Stage, self).__init__()
+		self.daemon = True
+		self.target = target
+		self.exception = None
+
+	def run(self):
+		try:
+			self.target()
+		except Exception as e:
+			self.exception = e
+		finally:
+			for connection in connections.all():
+				connection.close()
+
+
+def _put(queue, item, stop):
+	while not stop.is_set():
+		try:
+			queue.put(item, timeout=POLL_INTERVAL)
+			return True
+		except Full:
+			pass
+	return False
+
+
+def _get(queue, stop):
+	while True:
+		try:
+			return queue.get(timeout=POLL_INTERVAL)
+		except Empty:
+			if stop.is_set():
+				return _DONE
+
+
+def pipeline(read, send, write, queue_size=2):
+	"""
+	Runs `read`, an iterable of batches, in a reader thread; `send` on each
+	batch in the current thread; and `write` on each value `send` returns in
+	a writer thread. At most `queue_size` batches wait between two stages.
+	An exception in any stage stops the pipeline and is raised once all the
+	stages are done. Unless the writer failed, what was sent is still written.
+	"""
+	stop = threading.Event()
+	batches = Queue(queue_size)
+	writes = Queue(queue_size)
+
+	def reader():
+		try:
+			for batch in read:
+				if not _put(batches, batch, stop):
+					return
+		finally:
+			_put(batches, _DONE, stop)
+
+	def writer():
+		try:
+			while True:
+				item = _get(writes, stop)
+				if item is _DONE:
+					return
+				write(item)
+		except Exception:
+			stop.set()
+			raise
+
+	reader_stage = _Stage(reader)
+	writer_stage = _Stage(writer)
+	reader_stage.start()
+	writer_stage.start()
+	try:
+		while True:
+			batch = _get(batches, stop)
+			if batch is _DONE:
+				break
+			if not _put(writes, send(batch), stop):
+				break
+		_put(writes, _DONE, stop)
+	except BaseException:
+		stop.set()
+		raise
+	finally:
+		writer_stage.join()
+		stop.set()
+		reader_stage.join()
+
+	for stage in (reader_stage, writer_stage):
+		if stage.exception is not None:
+			raise stage.exception
+
+
+def send_pipelined(queryset, message, chunk_size=1000, queue_size=2, **kwargs):
+	"""
+	Sends a message to the devices of a GCMDevice or APNSDevice queryset,
+	`chunk_size` devices at a time in primary key order, with reads, sends
+	and invalidations overlapping. Keyword arguments are passed on to the
+	bulk sender. Returns the merged SendResult.
+	"""
+	queryset = audience(queryset.order_by("pk"))
+	results = []
+
+	def read():
+		last_pk = None
+		while True:
+			chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+			recipients = list(chunk[:chunk_size].recipients())
+			if not recipients:
+				return
+			yield recipients
+			last_pk = recipients[-1].pk
+
+	def send(recipients):
+		# keep the invalidations of the chunk for the writer
+		buffer = InvalidationBuffer(size=float("inf"), interval=float("inf"))
+		sent = False
+		try:
+			with deferred_invalidations(buffer):
+				results.append(queryset.send_to_recipients(recipients, message, **kwargs))
+			sent = True
+		finally:
+			if not sent:
+				# the pipeline stops, write what the chunk invalidated before it failed
+				write_invalidations(*buffer.take())
+		return buffer.take()
+
+	def write(pending):
+		write_invalidations(*pending)
+
+	pipeline(read(), send, write, queue_size=queue_size)
+	return SendResult.merged(results)
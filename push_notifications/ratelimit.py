@@ -0,0 +1,128 @@
+"""
+Rate limiting for bulk sends.
+Limits are configured per provider (and optionally per credential) in
+PUSH_NOTIFICATIONS_SETTINGS["RATE_LIMITS"] and are shared by every thread
+of the process. Setting a "cache" alias on a limit shares it across
+processes through the Django cache instead.
+"""
+
+import hashlib
+import threading
+import time
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+
+
+_clock = getattr(time, "monotonic", time.time)
+
+
+class TokenBucket(object):
+	"""
+	A thread-safe token bucket.
+	The bucket refills at `rate` tokens per second and holds at most `burst`
+	tokens. Taking more tokens than are available puts the bucket in debt,
+	which the caller pays off by sleeping.
+	"""
+	def __init__(self, rate, burst=None):
+		self.rate = float(rate)
+		self.burst = float(burst if burst is not None else rate)
+		self.tokens = self.burst
+		self.updated = _clock()
+		self.lock = threading.Lock()
+
+	def reserve(self, tokens=1):
+		""" Take `tokens` from the bucket and return how long to wait for them """
+		with self.lock:
+			now = _clock()
+			self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+			self.updated = now
+			self.tokens -= tokens
+			if self.tokens >= 0:
+				return 0
+			return -self.tokens / self.rate
+
+	def acquire(self, tokens=1):
+		delay = self.reserve(tokens)
+		if delay > 0:
+			time.sleep(delay)
+
+
+class CacheRateLimiter(object):
+	"""
+	A fixed-window limiter stored in the Django cache, shared by all
+	processes using that cache. It allows `rate` tokens per wall-clock second.
+	"""
+	def __init__(self, rate, key, cache_alias="default"):
+		from django.core.cache import caches
+
+		self.rate = int(rate)
+		self.key = key
+		self.cache = caches[cache_alias]
+
+	def acquire(self, tokens=1):
+		while tokens > 0:
+			n = min(tokens, self.rate)
+			while True:
+				now = time.time()
+				window = int(now)
+				key = "%s:%i" % (self.key, window)
+				self.cache.add(key, 0, timeout=2)
+				try:
+					count = self.cache.incr(key, n)
+				except ValueError:
+					# the window expired between add() and incr()
+					continue
+				if count <= self.rate:
+					break
+				time.sleep(window + 1 - now)
+			tokens -= n
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def _get_limit_config(provider, credential):
+	limits = SETTINGS.get("RATE_LIMITS") or {}
+	config = limits.get(provider)
+	if not config:
+		return None
+	credentials = config.get("CREDENTIALS") or {}
+	if credential in credentials:
+		# an override inherits what it does not set, such as "cache"
+		config = dict(config, **credentials[credential])
+		del config["CREDENTIALS"]
+	return config
+
+
+def _create_rate_limiter(provider, credential, config):
+	if not config.get("rate"):
+		raise ImproperlyConfigured(
+			'PUSH_NOTIFICATIONS_SETTINGS["RATE_LIMITS"][%r] needs a "rate".' % (provider)
+		)
+	if config.get("cache"):
+		digest = hashlib.md5(str(credential).encode("utf-8")).hexdigest()
+		key = "push_notifications:ratelimit:%s:%s" % (provider, digest)
+		return CacheRateLimiter(config["rate"], key, config["cache"])
+	return TokenBucket(config["rate"], config.get("burst"))
+
+
+def get_rate_limiter(provider, credential=None):
+	"""
+	Returns the limiter shared by all sends for `provider` ("GCM" or "APNS")
+	with `credential` (the API key or certificate path), or None when the
+	provider is not rate limited.
+	"""
+	key = (provider, credential)
+	limiter = _limiters.get(key)
+	if limiter is None:
+		config = _get_limit_config(provider, credential)
+		if config is None:
+			return None
+		with _limiters_lock:
+			limiter = _limiters.get(key)
+			if limiter is None:
+				limiter = _limiters[key] = _create_rate_limiter(provider, credential, config)
+	return limiter
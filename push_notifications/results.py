@@ -0,0 +1,152 @@
+"""
+Results of bulk sends.
+A SendResult holds one row per device that was sent to, in columns, so that
+the results of large sends stay compact and can be merged cheaply.
+"""
+
+import array
+import numbers
+import warnings
+
+
+class SendResult(object):
+	"""
+	The outcome of a bulk send, with one row per device:
+	- pks: primary keys of the devices (None for unsaved devices)
+	- statuses: SENT, INVALID (the device was deactivated) or ERROR
+	- canonical_ids: the registration id to use from now on, or None
+	- errors: error code of the rows in error, by row number
+	`duplicates` counts the duplicate recipients that were skipped.
+	`responses` are the raw provider responses, see legacy().
+	pks and statuses are arrays of machine integers (pks fall back to a
+	list for other primary keys), and canonical ids and errors are only
+	stored for the rows that have one.
+	"""
+	SENT = 0
+	INVALID = 1
+	ERROR = 2
+	STATUSES = {SENT: "sent", INVALID: "invalid", ERROR: "error"}
+
+	def __init__(self):
+		self.pks = array.array("l")
+		self.statuses = array.array("B")
+		# canonical ids by row number
+		self.canonical_rows = {}
+		self.errors = {}
+		self.duplicates = 0
+		self.responses = []
+
+	def _add_pk(self, pk):
+		if isinstance(self.pks, array.array):
+			if isinstance(pk, numbers.Integral) and not isinstance(pk, bool):
+				try:
+					self.pks.append(pk)
+					return
+				except OverflowError:
+					pass
+			self.pks = list(self.pks)
+		self.pks.append(pk)
+
+	def add(self, pk, status=SENT, canonical_id=None, error=None):
+		row = len(self.pks)
+		if error is not None:
+			self.errors[row] = error
+		if canonical_id is not None:
+			self.canonical_rows[row] = canonical_id
+		self._add_pk(pk)
+		self.statuses.append(status)
+
+	def merge(self, other):
+		""" Appends the rows of another result to this one """
+		offset = len(self.pks)
+		if isinstance(self.pks, array.array) and isinstance(other.pks, array.array):
+			self.pks.extend(other.pks)
+		else:
+			self.pks = list(self.pks)
+			self.pks.extend(other.pks)
+		self.statuses.extend(other.statuses)
+		for row, canonical_id in other.canonical_rows.items():
+			self.canonical_rows[offset + row] = canonical_id
+		for row, error in other.errors.items():
+			self.errors[offset + row] = error
+		self.duplicates += other.duplicates
+		self.responses.extend(other.responses)
+		return self
+
+	@classmethod
+	def merged(cls, results):
+		""" Returns a new result holding the rows of all the given results (None is skipped) """
+		ret = cls()
+		for result in results:
+			if result is not None:
+				ret.merge(result)
+		return ret
+
+	@property
+	def count(self):
+		return len(self.pks)
+
+	@property
+	def success(self):
+		return self.statuses.count(self.SENT)
+
+	@property
+	def failure(self):
+		return self.count - self.success
+
+	def pks_with_status(self, status):
+		return [pk for pk, s in zip(self.pks, self.statuses) if s == status]
+
+	@property
+	def canonical_ids(self):
+		return [self.canonical_rows.get(row) for row in range(self.count)]
+
+	def canonical(self):
+		""" Returns a dict of the new registration ids by device pk """
+		return dict((self.pks[row], rid) for row, rid in self.canonical_rows.items())
+
+	def legacy(self):
+		"""
+		Returns what bulk senders returned before SendResult: None if nothing
+		was sent, the provider response of a single request or the list of
+		responses of several.
+		"""
+		if not self.responses:
+			return None
+		if len(self.responses) == 1:
+			return self.responses[0]
+		return self.responses
+
+	def __getitem__(self, key):
+		warnings.warn(
+			"Indexing the result of a bulk send is deprecated, use its attributes or legacy().",
+			DeprecationWarning, stacklevel=2
+		)
+		return self.legacy()[key]
+
+	def __iter__(self):
+		# iterates like the legacy response, rather than through __getitem__()
+		warnings.warn(
+			"Iterating over the result of a bulk send is deprecated, use its attributes or legacy().",
+			DeprecationWarning, stacklevel=2
+		)
+		return iter(self.legacy() or ())
+
+	def __len__(self):
+		return self.count
+
+	def __bool__(self):
+		return self.count > 0
+
+	# Python 2 support
+	__nonzero__ = __bool__
+
+	def __str__(self):
+		counts = ", ".join(
+			"%i %s" % (self.statuses.count(status), name)
+			for status, name in sorted(self.STATUSES.items())
+		)
+		return "%s, %i duplicates" % (counts, self.duplicates)
+
+	def __repr__(self):
+		return "<SendResult: %s>" % (self)
@@ -0,0 +1,20 @@
+"""
+Database routing of audience reads.
+With PUSH_NOTIFICATIONS_SETTINGS["READ_DB"] set, the devices a bulk send
+goes to are read from that database alias, typically a replica, while
+invalidations, canonical ids and everything else are written to (and read
+back from) the database Django routes writes to.
+"""
+
+from .settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+
+
+def audience(queryset):
+	"""
+	Returns the queryset reading from READ_DB, unless it is not set or the
+	queryset was already given a database with using().
+	"""
+	alias = SETTINGS.get("READ_DB")
+	if alias and queryset._db is None:
+		return queryset.using(alias)
+	return queryset
@@ -0,0 +1,168 @@
+"""
+Scheduled notifications.
+schedule() and schedule_local() record ScheduledNotifications, which
+send_due() (and the send_scheduled command) sends through send_pipelined()
+once they are due. A campaign can be spread over time: its devices are then
+split in primary key ranges, each sent by a notification due a little later
+than the previous one.
+"""
+
+import json
+from datetime import timedelta
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import router, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import NotificationError
+from .broadcast import pk_ranges
+from .bulk import claim
+from .outbox import encode_payload
+from .pipeline import send_pipelined
+from .settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+
+
+def schedule(model, message, due_at, filters=None, spread=0, buckets=None, name="", **kwargs):
+	"""
+	Schedules a message to the active devices of `model` (APNSDevice or
+	GCMDevice) matching `filters` at `due_at`. With `spread` seconds, the
+	devices are split in `buckets` primary key ranges (by default one per
+	SCHEDULER_BUCKET_INTERVAL seconds) sent one after the other over that
+	period. Keyword arguments are those of send_message() and need to be JSON
+	serializable. Returns the ScheduledNotifications created.
+	"""
+	from .models import APNSDevice, ScheduledNotification
+
+	filters = filters or {}
+	ranges = [(None, None)]
+	if spread:
+		buckets = buckets or max(1, int(spread // SETTINGS["SCHEDULER_BUCKET_INTERVAL"]))
+		ranges = pk_ranges(model.objects.filter(active=True, **filters), buckets) or ranges
+		# devices registered in the meantime go to the first or last bucket
+		ranges[0] = (None, ranges[0][1])
+		ranges[-1] = (ranges[-1][0], None)
+
+	service = ScheduledNotification.APNS if issubclass(model, APNSDevice) else ScheduledNotification.GCM
+	filters = json.dumps(filters, separators=(",", ":"), sort_keys=True)
+	payload = encode_payload(message, kwargs)
+	step = float(spread) / len(ranges)
+	return [
+		ScheduledNotification.objects.create(
+			name=name, service=service, filters=filters, payload=payload,
+			first_pk=first, last_pk=last, due_at=due_at + timedelta(seconds=i * step)
+		)
+		for i, (first, last) in enumerate(ranges)
+	]
+
+
+def local_due_at(local_time, tz_name):
+	"""
+	Returns when the wall-clock `local_time` (a naive datetime) happens in the
+	time zone `tz_name`, as a datetime comparable to timezone.now().
+	"""
+	try:
+		import pytz
+	except ImportError:
+		raise ImproperlyConfigured("pytz is required to schedule notifications in local time.")
+
+	tz = pytz.timezone(tz_name)
+	due_at = tz.normalize(tz.localize(local_time)).astimezone(pytz.utc)
+	if not timezone.is_aware(timezone.now()):
+		# USE_TZ = False: datetimes are naive, in the default time zone
+		due_at = timezone.make_naive(due_at, timezone.get_default_timezone())
+	return due_at
+
+
+def schedule_local(model, message, local_time, timezone_lookup, timezones=None, filters=None, **kwargs):
+	"""
+	Schedules a message at the wall-clock `local_time` of each device, whose
+	time zone name (such as "Europe/Brussels") is given by the lookup
+	`timezone_lookup`, e.g. "user__profile__timezone". `timezones` defaults to
+	those of the devices matching `filters`; devices without a time zone are
+	left out. Other arguments are those of schedule().
+	Returns the ScheduledNotifications created, one set per time zone.
+	"""
+	filters = filters or {}
+	if timezones is None:
+		timezones = model.objects.filter(active=True, **filters).exclude(**{
+			"%s__isnull" % (timezone_lookup): True
+		}).order_by().values_list(timezone_lookup, flat=True).distinct()
+
+	notifications = []
+	for tz_name in sorted(set(timezones)):
+		zone_filters = dict(filters, **{timezone_lookup: tz_name})
+		notifications.extend(schedule(
+			model, message, local_due_at(local_time, tz_name), filters=zone_filters, **kwargs
+		))
+	return notifications
+
+
+def _claim(db, pending, batch_size):
+	"""
+	Claims a batch of due notifications in a transaction of its own, for
+	SCHEDULER_CLAIM_TIMEOUT seconds.
+	"""
+	from .models import ScheduledNotification
+
+	now = timezone.now()
+	expired = now - timedelta(seconds=SETTINGS["SCHEDULER_CLAIM_TIMEOUT"])
+	with transaction.atomic(using=db):
+		batch = claim(
+			pending.filter(Q(date_claimed__isnull=True) | Q(date_claimed__lt=expired)).order_by("due_at", "pk"),
+			batch_size
+		)
+		ScheduledNotification.objects.using(db).filter(pk__in=[claimed.pk for claimed in batch]).update(date_claimed=now)
+	return batch
+
+
+def send_due(batch_size=None, chunk_size=1000, now=None):
+	"""
+	Sends the notifications due at `now` (by default, the current time),
+	`batch_size` (by default SCHEDULER_BATCH_SIZE) at a time, each through
+	send_pipelined() in chunks of `chunk_size` devices. Each batch is claimed
+	in a short transaction, so that several schedulers can run at once, and
+	each notification is then sent outside of any transaction and marked as
+	sent as soon as it is done. Notifications claimed by a scheduler that
+	died before sending them are claimed again once the claim expires. A notification whose send raised an exception
+	is marked as sent with the error, since part of its devices may have got
+	it; exceptions other than NotificationError are raised again once the
+	rest of the batch is released for the next run.
+	Returns the notifications sent.
+	"""
+	from .models import ScheduledNotification
+
+	batch_size = batch_size or SETTINGS["SCHEDULER_BATCH_SIZE"]
+	now = now or timezone.now()
+	db = router.db_for_write(ScheduledNotification)
+	pending = ScheduledNotification.objects.using(db).filter(date_sent__isnull=True, due_at__lte=now)
+	sent = []
+	while True:
+		batch = _claim(db, pending, batch_size)
+		if not batch:
+			break
+		for i, notification in enumerate(batch):
+			data = json.loads(notification.payload)
+			exception = None
+			try:
+				result = send_pipelined(
+					notification.get_queryset(), data["message"], chunk_size=chunk_size, **data["kwargs"]
+				)
+			except NotificationError as e:
+				notification.error = str(e)
+			except Exception as e:
+				notification.error = "%s: %s" % (e.__class__.__name__, e)
+				exception = e
+			else:
+				notification.devices = result.count
+				notification.failures = result.failure
+			notification.date_sent = timezone.now()
+			notification.save(update_fields=("devices", "failures", "error", "date_sent"))
+			sent.append(notification)
+			if exception is not None:
+				# the notifications of the batch not sent yet can be claimed again
+				ScheduledNotification.objects.using(db).filter(
+					pk__in=[claimed.pk for claimed in batch[i + 1:]]
+				).update(date_claimed=None)
+				raise exception
+	return sent
@@ -0,0 +1,33 @@
+"""
+Compact sets of primary keys, stored as sorted lists of inclusive
+[first, last] ranges. Used by the Segment model to remember its members,
+which are recomputed as a whole when read after a device change rather than
+maintained one device at a time.
+"""
+
+import bisect
+
+
+def pks_to_ranges(pks):
+	""" Returns the ranges of an iterable of sorted primary keys """
+	ranges = []
+	for pk in pks:
+		if ranges and ranges[-1][1] + 1 == pk:
+			ranges[-1][1] = pk
+		elif not ranges or ranges[-1][1] < pk:
+			ranges.append([pk, pk])
+	return ranges
+
+
+def count(ranges):
+	return sum(last - first + 1 for first, last in ranges)
+
+
+def _index(ranges, pk):
+	""" Returns the index of the first range starting after pk """
+	return bisect.bisect_right(ranges, [pk, float("inf")])
+
+
+def contains(ranges, pk):
+	i = _index(ranges, pk)
+	return i > 0 and ranges[i - 1][1] >= pk
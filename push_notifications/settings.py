@@ -3,14 +3,73 @@ from django.conf import settings
 PUSH_NOTIFICATIONS_SETTINGS = getattr(settings, "PUSH_NOTIFICATIONS_SETTINGS", {})
 
 
+# Bulk sends
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("DEDUPLICATION_BLOOM_CAPACITY", None)
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("DEDUPLICATION_BLOOM_ERROR_RATE", 0.0001)
+
+
+# Databases
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("READ_DB", None)
+
+
+# Outbox
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("OUTBOX_BATCH_SIZE", 10000)
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("OUTBOX_FLUSH_ON_COMMIT", True)
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("OUTBOX_COMMIT_BATCH_SIZE", 1000)
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("OUTBOX_CLAIM_TIMEOUT", 300)
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("OUTBOX_MAX_ATTEMPTS", 5)
+
+
+# Scheduled notifications
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("SCHEDULER_BATCH_SIZE", 10)
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("SCHEDULER_BUCKET_INTERVAL", 60)
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("SCHEDULER_CLAIM_TIMEOUT", 3600)
+
+
+# Bulk matching
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("BULK_MATCH_CHUNK_SIZE", 1000)
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("BULK_MATCH_TEMP_TABLE_THRESHOLD", 10000)
+
+
+# Delivery log
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("DELIVERY_LOG", False)
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("DELIVERY_LOG_BATCH_SIZE", 10000)
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("DELIVERY_LOG_RETENTION_DAYS", 30)
+
+
+# Invalidation
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("INVALIDATION_BUFFER", False)
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("INVALIDATION_BUFFER_SIZE", 1000)
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("INVALIDATION_BUFFER_INTERVAL", 5)
+
+
 # GCM
 PUSH_NOTIFICATIONS_SETTINGS.setdefault("GCM_POST_URL", "https://android.googleapis.com/gcm/send")
 PUSH_NOTIFICATIONS_SETTINGS.setdefault("GCM_MAX_RECIPIENTS", 1000)
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("GCM_IID_URL", "https://iid.googleapis.com/iid/v1")
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("GCM_BACKEND", "gcm")
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("GCM_GZIP", False)
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("GCM_GZIP_LEVEL", 6)
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("GCM_GZIP_MIN_SIZE", 1024)
+
+
+# FCM
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("FCM_PROJECT_ID", None)
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("FCM_CREDENTIALS", None)
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("FCM_HOST", "fcm.googleapis.com")
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("FCM_MAX_CONNECTIONS", 32)
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("FCM_TIMEOUT", 30)
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("FCM_TOKEN_REFRESH_MARGIN", 300)
 
 
 # APNS
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("APNS_AUTH_KEY_PATH", None)
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("APNS_AUTH_KEY_ID", None)
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("APNS_TEAM_ID", None)
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("APNS_TOKEN_LIFETIME", 50 * 60)
 PUSH_NOTIFICATIONS_SETTINGS.setdefault("APNS_PORT", 2195)
 PUSH_NOTIFICATIONS_SETTINGS.setdefault("APNS_FEEDBACK_PORT", 2196)
+PUSH_NOTIFICATIONS_SETTINGS.setdefault("APNS_CONNECTIONS", 1)
 PUSH_NOTIFICATIONS_SETTINGS.setdefault("APNS_ERROR_TIMEOUT", None)
 PUSH_NOTIFICATIONS_SETTINGS.setdefault("APNS_MAX_NOTIFICATION_SIZE", 2048)
 if settings.DEBUG:
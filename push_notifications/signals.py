@@ -0,0 +1,6 @@
+from django.dispatch import Signal
+
+
+# Sent by the device managers when devices are invalidated. Invalidation
+# uses a queryset update(), so post_save is not sent for those devices.
+devices_invalidated = Signal(providing_args=["registration_ids"])
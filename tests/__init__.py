@@ -2,6 +2,21 @@ from test_models import *
 from test_gcm_push_payload import *
 from test_apns_push_payload import *
 from test_management_commands import *
+from test_ratelimit import *
+from test_dedupe import *
+from test_fields import *
+from test_segments import *
+from test_topics import *
+from test_results import *
+from test_deliverylog import *
+from test_apns_auth import *
+from test_fcm import *
+from test_invalidation import *
+from test_bulk import *
+from test_pipeline import *
+from test_routing import *
+from test_outbox import *
+from test_scheduler import *
 
 # conditionally test rest_framework api if the DRF package is installed
 try:
@@ -10,3 +25,11 @@ except ImportError:
 	pass
 else:
 	from test_rest_framework import *
+
+# conditionally test the tastypie resources if the package is installed
+try:
+	import tastypie
+except ImportError:
+	pass
+else:
+	from test_tastypie import *
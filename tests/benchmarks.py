@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+"""
+Micro-benchmarks for the hot paths of the app.
+Run with: python tests/benchmarks.py
+"""
+import struct
+import timeit
+
+from runtests import setup
+
+
+def bench(name, func, number=100000):
+	elapsed = min(timeit.Timer(func).repeat(number=number, repeat=3))
+	print("%-50s %8.3f us" % (name, elapsed / number * 1e6))
+	return elapsed
+
+
+def benchmark_hex_integer_field():
+	from django.db import connections
+	from push_notifications import fields
+	from push_notifications.fields import HexIntegerField
+
+	class OldHexIntegerField(HexIntegerField):
+		""" The implementation before signedness was cached per connection """
+		def get_prep_value(self, value):
+			if value is None or value == "":
+				return None
+			if isinstance(value, fields.six.string_types):
+				value = int(value, 16)
+			if fields.connection.settings_dict["ENGINE"] in fields.signed_integer_engines:
+				value = struct.unpack("q", struct.pack("Q", value))[0]
+			return value
+
+		def get_db_prep_value(self, value, connection, prepared=False):
+			if not prepared:
+				value = self.get_prep_value(value)
+			return value
+
+		def from_db_value(self, value, expression, connection, context):
+			if value is None:
+				return value
+			if fields.connection.settings_dict["ENGINE"] in fields.signed_integer_engines:
+				value = struct.unpack("Q", struct.pack("q", value))[0]
+			return value
+
+	connection = connections["default"]
+	old_field, field = OldHexIntegerField(), HexIntegerField()
+	print("HexIntegerField")
+	for name, func in (
+		("get_db_prep_value", lambda f: f.get_db_prep_value("0xfedcba9876543210", connection)),
+		("lookup", lambda f: f.get_db_prep_value(f.get_prep_value("0xfedcba9876543210"), connection, True)),
+		("from_db_value", lambda f: f.from_db_value(-81985529216486896, None, connection, None)),
+	):
+		old = bench("  %s (before)" % (name), lambda: func(old_field))
+		new = bench("  %s" % (name), lambda: func(field))
+		print("  %.1fx faster" % (old / new))
+
+
+def benchmark_recipients():
+	import sys
+	from push_notifications.models import GCMDevice
+
+	GCMDevice.objects.bulk_create(
+		GCMDevice(registration_id="registration-id-%i" % (i), device_id=i) for i in range(10000)
+	)
+	queryset = GCMDevice.objects.all()
+	print("Loading 10000 devices")
+	old = bench("  model instances", lambda: list(queryset.iterator()), number=10)
+	new = bench("  recipients", lambda: list(queryset.recipients()), number=10)
+	print("  %.1fx faster" % (old / new))
+	device, recipient = next(queryset.iterator()), next(queryset.recipients())
+	print("  %i bytes per instance (with its __dict__), %i bytes per recipient" % (
+		sys.getsizeof(device) + sys.getsizeof(device.__dict__), sys.getsizeof(recipient)
+	))
+	queryset.delete()
+
+
+def benchmark_delivery_log():
+	import json
+	import mock
+	from push_notifications.gcm import gcm_send_bulk_message
+	from push_notifications.models import Delivery, Recipient
+	from push_notifications.settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+
+	def respond(data, content_type, api_key=None):
+		count = len(json.loads(data.decode("utf-8"))["registration_ids"])
+		return json.dumps({"failure": 0, "results": [{"message_id": "1:08"}] * count})
+
+	recipients = [Recipient(i, "registration-id-%i" % (i)) for i in range(10000)]
+	print("Sending to 10000 devices (provider requests mocked)")
+	with mock.patch("push_notifications.gcm._gcm_send", side_effect=respond):
+		old = bench("  without delivery log", lambda: gcm_send_bulk_message(recipients, {"message": "Hi"}), number=5)
+		with mock.patch.dict(SETTINGS, {"DELIVERY_LOG": True}):
+			new = bench("  with delivery log", lambda: gcm_send_bulk_message(recipients, {"message": "Hi"}), number=5)
+	print("  logging adds %.2f us per device" % ((new - old) / 5 / 10000 * 1e6))
+	Delivery.objects.all().delete()
+
+
+def benchmark_fcm(latency=0.005):
+	import json
+	import time
+	import mock
+	from push_notifications.fcm import fcm_send_bulk_message
+	from push_notifications.gcm import gcm_send_bulk_message
+	from push_notifications.models import Recipient
+	from push_notifications.settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+
+	def gcm_respond(data, content_type, api_key=None):
+		time.sleep(latency)
+		count = len(json.loads(data.decode("utf-8"))["registration_ids"])
+		return json.dumps({"failure": 0, "results": [{"message_id": "1:08"}] * count})
+
+	def fcm_respond(path, body, headers):
+		time.sleep(latency)
+		return 200, '{"name":"projects/test/messages/1"}'
+
+	recipients = [Recipient(i, "registration-id-%i" % (i)) for i in range(2000)]
+	print("Sending to 2000 devices (provider requests mocked, %i ms per request)" % (latency * 1000))
+	with mock.patch("push_notifications.gcm._gcm_send", side_effect=gcm_respond):
+		bench("  legacy GCM multicast", lambda: gcm_send_bulk_message(recipients, {"message": "Hi"}), number=1)
+	provider = mock.Mock(token="token", project_id="test")
+	with mock.patch("push_notifications.fcm._get_token_provider", return_value=provider):
+		with mock.patch("push_notifications.fcm._fcm_request", side_effect=fcm_respond):
+			for connections in (32, 128):
+				with mock.patch.dict(SETTINGS, {"FCM_MAX_CONNECTIONS": connections}):
+					bench(
+						"  FCM HTTP v1, %i connections" % (connections),
+						lambda: fcm_send_bulk_message(recipients, {"message": "Hi"}), number=1
+					)
+
+
+def benchmark_gcm_gzip():
+	import base64
+	import json
+	import os
+	from push_notifications.gcm import _gzip
+
+	# 1000 random registration ids of the usual length (152 characters)
+	registration_ids = [
+		"APA91b" + base64.urlsafe_b64encode(os.urandom(110)).decode("ascii")[:146] for i in range(1000)
+	]
+	data = json.dumps(
+		{"data": {"message": "Hello world"}, "registration_ids": registration_ids}, separators=(",", ":")
+	).encode("utf-8")
+	print("Compressing a 1000 recipient GCM request (%i bytes)" % (len(data)))
+	for level in (1, 6, 9):
+		size = len(_gzip(data, level))
+		bench("  level %i: %i bytes (%.0f%%)" % (level, size, 100.0 * size / len(data)), lambda: _gzip(data, level), number=100)
+
+
+def benchmark_apns_striping(latency=0.0005):
+	import time
+	import mock
+	from push_notifications.apns import apns_send_bulk_message
+	from push_notifications.models import Recipient
+
+	def write(frame):
+		time.sleep(latency)
+
+	def create_socket(certificate=None):
+		return mock.MagicMock(write=write)
+
+	recipients = [Recipient(i, "%064x" % (i)) for i in range(2000)]
+	print("Sending to 2000 APNS devices (socket writes mocked, %.1f ms per write)" % (latency * 1000))
+	with mock.patch("push_notifications.apns._apns_create_socket_to_push", side_effect=create_socket):
+		for connections in (1, 2, 4, 8):
+			bench(
+				"  %i connections" % (connections),
+				lambda: apns_send_bulk_message(recipients, "Hi", connections=connections), number=1
+			)
+
+
+def benchmark_pipeline(latency=0.002):
+	import time
+	from push_notifications.pipeline import pipeline
+
+	def read():
+		for i in range(50):
+			time.sleep(latency)
+			yield i
+
+	def work(batch):
+		time.sleep(latency)
+		return batch
+
+	print("50 chunks of %i ms reads, sends and writes" % (latency * 1000))
+	bench("  in turn", lambda: [work(work(batch)) for batch in read()], number=1)
+	bench("  pipelined", lambda: pipeline(read(), work, work), number=1)
+
+
+if __name__ == "__main__":
+	setup()
+	benchmark_hex_integer_field()
+	benchmark_recipients()
+	benchmark_delivery_log()
+	benchmark_fcm()
+	benchmark_gcm_gzip()
+	benchmark_apns_striping()
+	benchmark_pipeline()
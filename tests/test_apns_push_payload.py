@@ -1,6 +1,11 @@
+import ssl
+from binascii import hexlify
+
 import mock
 from django.test import TestCase
+from push_notifications import apns
 from push_notifications.apns import _apns_send, APNSDataOverflow
+from push_notifications.results import SendResult
 
 
 class APNSPushPayloadTest(TestCase):
@@ -29,3 +34,153 @@ class APNSPushPayloadTest(TestCase):
 		with mock.patch("push_notifications.apns._apns_pack_frame") as p:
 			self.assertRaises(APNSDataOverflow, _apns_send, "123", "_" * 2049, socket=socket)
 			p.assert_has_calls([])
+
+	def test_bulk_send_splices_binary_tokens(self):
+		from push_notifications.models import APNSDevice
+		from binascii import unhexlify
+
+		APNSDevice.objects.create(registration_id="ab" * 32)
+		with mock.patch("push_notifications.apns._apns_create_socket_to_push", mock.MagicMock()):
+			with mock.patch("push_notifications.apns._apns_pack_frame", return_value=b"") as p:
+				APNSDevice.objects.all().send_message("Hello world")
+		token = p.call_args[0][0]
+		self.assertIsInstance(token, bytearray)
+		self.assertEqual(bytes(token), unhexlify("ab" * 32))
+		self.assertEqual(
+			apns._apns_pack_frame(token, b"{}", 0, 0, 10),
+			apns._apns_pack_frame("ab" * 32, b"{}", 0, 0, 10)
+		)
+
+
+class APNSSocketTest(TestCase):
+	def setUp(self):
+		import tempfile
+		self.certfile = tempfile.NamedTemporaryFile(suffix=".pem")
+		self.addCleanup(self.certfile.close)
+		self.addCleanup(apns._ssl_contexts.clear)
+		self.addCleanup(apns._ssl_sessions.clear)
+
+	def test_ssl_context_is_cached_until_the_certificate_changes(self):
+		import os
+		with mock.patch("push_notifications.apns.ssl.create_default_context") as create:
+			context = apns._apns_ssl_context(self.certfile.name)
+			self.assertIs(apns._apns_ssl_context(self.certfile.name), context)
+			self.assertEqual(create.call_count, 1)
+			context.load_cert_chain.assert_called_once_with(self.certfile.name)
+
+			mtime = os.stat(self.certfile.name).st_mtime + 10
+			os.utime(self.certfile.name, (mtime, mtime))
+			apns._apns_ssl_context(self.certfile.name)
+			self.assertEqual(create.call_count, 2)
+
+	def test_ssl_context_without_create_default_context(self):
+		# Python 3.3
+		with mock.patch("push_notifications.apns.ssl") as ssl_module:
+			del ssl_module.create_default_context
+			context = apns._apns_ssl_context(self.certfile.name, "/etc/ssl/ca.pem")
+		self.assertIs(context, ssl_module.SSLContext.return_value)
+		context.load_verify_locations.assert_called_once_with("/etc/ssl/ca.pem")
+		self.assertEqual(context.verify_mode, ssl_module.CERT_REQUIRED)
+
+	def test_socket_without_ssl_context(self):
+		# Python 2.7 before 2.7.9
+		with mock.patch("push_notifications.apns.ssl") as ssl_module:
+			del ssl_module.SSLContext
+			with mock.patch("push_notifications.apns.socket.socket"):
+				sock = apns._apns_create_socket(("gateway.push.apple.com", 2195), certificate=self.certfile.name)
+		self.assertIs(sock, ssl_module.wrap_socket.return_value)
+		self.assertEqual(ssl_module.wrap_socket.call_args[1]["cert_reqs"], ssl_module.CERT_NONE)
+		sock.connect.assert_called_once_with(("gateway.push.apple.com", 2195))
+
+	def test_missing_certificate(self):
+		from django.core.exceptions import ImproperlyConfigured
+		with self.assertRaises(ImproperlyConfigured):
+			apns._apns_ssl_context("/nonexistent/certificate.pem")
+
+	def test_socket_reuses_the_context_and_session(self):
+		context = mock.MagicMock()
+		with mock.patch("push_notifications.apns._apns_ssl_context", return_value=context):
+			with mock.patch("push_notifications.apns.socket.socket"):
+				for i in range(2):
+					apns._apns_create_socket(("gateway.push.apple.com", 2195), certificate=self.certfile.name)
+		kwargs = context.wrap_socket.call_args[1]
+		self.assertEqual(kwargs["server_hostname"], "gateway.push.apple.com")
+		if hasattr(ssl, "SSLSession"):
+			self.assertIs(kwargs["session"], context.wrap_socket.return_value.session)
+
+
+class APNSBulkSendTest(TestCase):
+	def test_devices_are_striped_over_connections(self):
+		from push_notifications.models import Recipient
+
+		devices = [Recipient(i, "%02x" % (i) * 32) for i in range(7)]
+		sockets = [mock.MagicMock() for i in range(3)]
+		with mock.patch.dict(apns.SETTINGS, {"APNS_CONNECTIONS": 3}):
+			with mock.patch("push_notifications.apns._apns_create_socket_to_push", side_effect=sockets):
+				with mock.patch("push_notifications.apns._apns_send") as p:
+					result = apns.apns_send_bulk_message(devices, "Hello world")
+		self.assertEqual(sorted(result.pks), list(range(7)))
+		self.assertEqual(result.success, 7)
+		# each connection numbers its own notifications
+		for sock in sockets:
+			identifiers = [call[1]["identifier"] for call in p.call_args_list if call[1]["socket"] is sock]
+			self.assertEqual(identifiers, list(range(len(identifiers))))
+
+	def test_stripe_resends_after_an_error(self):
+		from push_notifications.models import Recipient
+
+		devices = [Recipient(i, "%02x" % (i) * 32) for i in range(4)]
+		errors = [apns.APNSServerError(8, 1), apns.APNSServerError(1, 3), None]
+		with mock.patch("push_notifications.apns._apns_create_socket_to_push", mock.MagicMock()):
+			with mock.patch("push_notifications.apns._apns_check_errors", side_effect=errors):
+				with mock.patch("push_notifications.apns._apns_send") as p:
+					result = apns._apns_send_stripe(devices, "Hello world")
+		self.assertEqual([call[1]["identifier"] for call in p.call_args_list], [0, 1, 2, 3, 2, 3])
+		self.assertEqual(
+			list(result.statuses), [SendResult.SENT, SendResult.INVALID, SendResult.SENT, SendResult.ERROR]
+		)
+		self.assertEqual(result.errors, {1: "InvalidRegistration", 3: "ProcessingError"})
+
+	def test_devices_are_streamed_to_the_connections(self):
+		from push_notifications.models import Recipient
+
+		read = []
+
+		def devices():
+			for i in range(100):
+				read.append(i)
+				yield Recipient(i, "%02x" % (i) * 32)
+
+		ahead = []
+
+		def send(*args, **kwargs):
+			ahead.append(len(read) - len(ahead))
+
+		with mock.patch.object(apns, "APNS_STRIPE_QUEUE_SIZE", 2):
+			with mock.patch("push_notifications.apns._apns_create_socket_to_push", mock.MagicMock()):
+				with mock.patch("push_notifications.apns._apns_send", side_effect=send):
+					result = apns.apns_send_bulk_message(devices(), "Hello world", connections=2)
+		self.assertEqual(result.success, 100)
+		# each connection has at most one device being sent and a full queue,
+		# and the reader one more device waiting for room
+		self.assertLessEqual(max(ahead), 2 * (2 + 1) + 1)
+
+	def test_failed_connection_keeps_the_results_of_the_others(self):
+		from push_notifications.models import APNSDevice
+
+		for i in range(6):
+			APNSDevice.objects.create(registration_id="%02x" % (i) * 32)
+		sockets = [mock.MagicMock(), apns.APNSError("Connection refused")]
+		sent = []
+
+		def send(token, *args, **kwargs):
+			sent.append(token)
+			raise apns.InvalidRegistration
+
+		with mock.patch("push_notifications.apns._apns_create_socket_to_push", side_effect=sockets):
+			with mock.patch("push_notifications.apns._apns_send", side_effect=send):
+				with self.assertRaises(apns.APNSError):
+					APNSDevice.objects.all().send_message("Hello world", connections=2)
+		self.assertTrue(sent)
+		invalidated = APNSDevice.objects.filter(active=False).values_list("registration_id", flat=True)
+		self.assertEqual(sorted(invalidated), sorted(hexlify(bytes(token)).decode("ascii") for token in sent))
@@ -0,0 +1,91 @@
+from unittest import skipUnless
+
+import mock
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase
+from push_notifications.bulk import bulk_update, chunk_size, matching, update_matching
+from push_notifications.models import GCMDevice
+from push_notifications.settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+
+
+class BulkMatchingTest(TestCase):
+	def test_chunk_size(self):
+		with mock.patch.dict(SETTINGS, {"BULK_MATCH_CHUNK_SIZE": 5000}):
+			if connection.vendor == "sqlite":
+				self.assertEqual(chunk_size(connection), 900)
+				self.assertEqual(chunk_size(connection, parameters=2), 450)
+			else:
+				self.assertEqual(chunk_size(connection), 5000)
+
+	def test_matching_chunks(self):
+		GCMDevice.objects.bulk_create([GCMDevice(registration_id="abc%i" % (i)) for i in range(5)])
+		with mock.patch.dict(SETTINGS, {"BULK_MATCH_CHUNK_SIZE": 2}):
+			chunks = [
+				list(devices.values_list("registration_id", flat=True))
+				for devices in matching(GCMDevice.objects.all(), "registration_id", ["abc0", "abc2", "abc4", "abc5", "abc0"])
+			]
+		self.assertEqual(len(chunks), 2)
+		self.assertEqual(sorted(sum(chunks, [])), ["abc0", "abc2", "abc4"])
+
+	def test_invalidate_more_ids_than_query_parameters(self):
+		GCMDevice.objects.bulk_create([GCMDevice(registration_id="abc%i" % (i)) for i in range(1500)], batch_size=450)
+		registration_ids = ["abc%i" % (i) for i in range(0, 3000, 2)]
+		self.assertEqual(update_matching(GCMDevice.objects.all(), "registration_id", registration_ids, name="even"), 750)
+		GCMDevice.objects.invalidate(registration_ids)
+		self.assertEqual(GCMDevice.objects.filter(active=False).count(), 750)
+
+	def test_bulk_update(self):
+		GCMDevice.objects.bulk_create([GCMDevice(registration_id="abc%i" % (i)) for i in range(5)])
+		devices = list(GCMDevice.objects.order_by("pk"))
+		for i, device in enumerate(devices):
+			device.name = "device %i" % (i)
+			device.device_id = i
+		with mock.patch.dict(SETTINGS, {"BULK_MATCH_CHUNK_SIZE": 2}):
+			with self.assertNumQueries(3):
+				self.assertEqual(bulk_update(GCMDevice.objects.all(), devices, ["name", "device_id"]), 5)
+		self.assertEqual(
+			list(GCMDevice.objects.order_by("pk").values_list("name", "device_id")),
+			[("device %i" % (i), i) for i in range(5)]
+		)
+
+
+@skipUnless(connection.vendor == "postgresql", "temporary tables are only used on PostgreSQL")
+class TempTableMatchingTest(TransactionTestCase):
+	def temp_tables(self):
+		with connection.cursor() as cursor:
+			cursor.execute("SELECT count(*) FROM pg_tables WHERE tablename LIKE 'push_notifications_match_%%'")
+			return cursor.fetchone()[0]
+
+	def test_matching(self):
+		GCMDevice.objects.bulk_create([GCMDevice(registration_id="abc%i" % (i)) for i in range(5)])
+		with mock.patch.dict(SETTINGS, {"BULK_MATCH_TEMP_TABLE_THRESHOLD": 2}):
+			self.assertEqual(
+				update_matching(GCMDevice.objects.all(), "registration_id", ["abc1", "abc3", "abc5", "a\\b\tc"], name="odd"), 2
+			)
+			self.assertEqual(
+				sorted(GCMDevice.objects.filter(name="odd").values_list("registration_id", flat=True)), ["abc1", "abc3"]
+			)
+		# dropped when the transaction commits
+		self.assertEqual(self.temp_tables(), 0)
+
+	def test_caller_exceptions_are_not_committed_later(self):
+		GCMDevice.objects.bulk_create([GCMDevice(registration_id="abc%i" % (i)) for i in range(5)])
+		with mock.patch.dict(SETTINGS, {"BULK_MATCH_TEMP_TABLE_THRESHOLD": 2}):
+			chunks = matching(GCMDevice.objects.all(), "registration_id", ["abc1", "abc3"])
+			with self.assertRaises(ValueError):
+				with transaction.atomic():
+					for devices in chunks:
+						devices.update(name="odd")
+						raise ValueError()
+			del chunks
+		self.assertFalse(GCMDevice.objects.filter(name="odd").exists())
+		self.assertEqual(self.temp_tables(), 0)
+
+	def test_stopping_early_keeps_the_updates(self):
+		GCMDevice.objects.bulk_create([GCMDevice(registration_id="abc%i" % (i)) for i in range(5)])
+		with mock.patch.dict(SETTINGS, {"BULK_MATCH_TEMP_TABLE_THRESHOLD": 2}):
+			for devices in matching(GCMDevice.objects.all(), "registration_id", ["abc1", "abc3"]):
+				devices.update(name="odd")
+				break
+		self.assertEqual(GCMDevice.objects.filter(name="odd").count(), 2)
+		self.assertEqual(self.temp_tables(), 0)
@@ -0,0 +1,46 @@
+import json
+
+import mock
+from django.test import TestCase
+from push_notifications.apns import apns_send_bulk_message
+from push_notifications.dedupe import BloomFilter, RecipientFilter
+from push_notifications.gcm import gcm_send_bulk_message
+from push_notifications.models import APNSDevice, GCMDevice
+from tests.mock_responses import GCM_MULTIPLE_JSON_RESPONSE
+
+
+class DeduplicationTest(TestCase):
+	def test_bloom_filter(self):
+		bloom = BloomFilter(1000)
+		self.assertFalse(bloom.add("abc"))
+		self.assertFalse(bloom.add(u"abc1"))
+		self.assertTrue(bloom.add("abc"))
+		self.assertTrue(bloom.add(u"abc1"))
+		false_positives = sum(bloom.add("key%i" % (i)) for i in range(1000))
+		self.assertLess(false_positives, 5)
+
+	def test_recipient_filter_chunks(self):
+		devices = [GCMDevice(registration_id=registration_id) for registration_id in ("a", "b", "a", "c", "b", "d")]
+		for recipients in (RecipientFilter(), RecipientFilter(bloom_capacity=100)):
+			chunks = list(recipients.chunks(devices, 3))
+			self.assertEqual(
+				[[device.registration_id for device in chunk] for chunk in chunks],
+				[["a", "b", "c"], ["d"]]
+			)
+			self.assertEqual(recipients.duplicates, 2)
+
+	def test_gcm_bulk_send_deduplicates(self):
+		devices = [GCMDevice(registration_id=registration_id) for registration_id in ("abc", "abc1", "abc", "abc1", "abc")]
+		with mock.patch("push_notifications.gcm._gcm_send", return_value=GCM_MULTIPLE_JSON_RESPONSE) as p:
+			result = gcm_send_bulk_message(devices, {"message": "Hello world"})
+		self.assertEqual(json.loads(p.call_args[0][0].decode("utf-8"))["registration_ids"], ["abc", "abc1"])
+		self.assertEqual(result.duplicates, 3)
+		self.assertEqual(result.count, 2)
+
+	def test_apns_bulk_send_deduplicates(self):
+		devices = [APNSDevice(registration_id=registration_id) for registration_id in ("abc", "abc", "abc1")]
+		with mock.patch("push_notifications.apns._apns_create_socket_to_push", mock.MagicMock()):
+			with mock.patch("push_notifications.apns._apns_send") as p:
+				result = apns_send_bulk_message(devices, "Hello world")
+		self.assertEqual([call[0][0] for call in p.call_args_list], ["abc", "abc1"])
+		self.assertEqual(result.duplicates, 1)
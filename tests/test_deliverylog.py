@@ -0,0 +1,58 @@
+import mock
+from django.test import TestCase
+from push_notifications.apns import apns_send_bulk_message
+from push_notifications.models import APNSDevice, Delivery, GCMDevice
+from push_notifications.results import SendResult
+from push_notifications.settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+from tests.mock_responses import GCM_JSON_RESPONSE_ERROR
+
+
+class DeliveryLogTest(TestCase):
+	def test_disabled_by_default(self):
+		GCMDevice.objects.create(registration_id="abc")
+		with mock.patch("push_notifications.gcm._gcm_send", return_value='{"failure":0,"results":[{}]}'):
+			GCMDevice.objects.all().send_message("Hello world")
+		self.assertFalse(Delivery.objects.exists())
+
+	def test_gcm_delivery_log(self):
+		devices = [GCMDevice.objects.create(registration_id="abc%i" % (i)) for i in range(3)]
+		with mock.patch.dict(SETTINGS, {"DELIVERY_LOG": True, "DELIVERY_LOG_BATCH_SIZE": 2}):
+			with mock.patch("push_notifications.gcm._gcm_send", return_value=GCM_JSON_RESPONSE_ERROR):
+				GCMDevice.objects.all().send_message("Hello world")
+		delivery = Delivery.objects.get()
+		self.assertEqual((delivery.service, delivery.payload), ("GCM", '{"message":"Hello world"}'))
+		self.assertEqual((delivery.devices, delivery.failures), (3, 2))
+		self.assertEqual(
+			list(delivery.outcomes.order_by("device_pk").values_list("device_pk", "status", "error")),
+			[
+				(devices[0].pk, SendResult.INVALID, "NotRegistered"),
+				(devices[1].pk, SendResult.SENT, ""),
+				(devices[2].pk, SendResult.INVALID, "InvalidRegistration"),
+			]
+		)
+
+	def test_apns_delivery_log(self):
+		devices = [APNSDevice.objects.create(registration_id="%02i" % (i) * 32) for i in range(2)]
+		with mock.patch.dict(SETTINGS, {"DELIVERY_LOG": True}):
+			with mock.patch("push_notifications.apns._apns_create_socket_to_push", mock.MagicMock()):
+				with mock.patch("push_notifications.apns._apns_send"):
+					apns_send_bulk_message(APNSDevice.objects.all().recipients(), "Hello world")
+		delivery = Delivery.objects.get()
+		self.assertEqual((delivery.service, delivery.payload, delivery.devices), ("APNS", '"Hello world"', 2))
+		self.assertEqual(
+			sorted(delivery.outcomes.values_list("device_pk", flat=True)),
+			[device.pk for device in devices]
+		)
+
+	def test_failed_request_is_logged(self):
+		devices = [GCMDevice.objects.create(registration_id="abc%i" % (i)) for i in range(3)]
+		with mock.patch.dict(SETTINGS, {"DELIVERY_LOG": True, "GCM_MAX_RECIPIENTS": 2}):
+			with mock.patch("push_notifications.gcm._gcm_send", side_effect=[GCM_JSON_RESPONSE_ERROR, IOError()]):
+				with self.assertRaises(IOError):
+					GCMDevice.objects.all().send_message("Hello world")
+		delivery = Delivery.objects.get()
+		self.assertEqual((delivery.devices, delivery.failures), (3, 2))
+		self.assertEqual(
+			list(delivery.outcomes.filter(status=SendResult.ERROR).values_list("device_pk", "error")),
+			[(devices[2].pk, "IOError" if str is bytes else "OSError")]
+		)
@@ -0,0 +1,103 @@
+import json
+
+import mock
+from django.test import TestCase
+from push_notifications import fcm
+from push_notifications.models import BareDevice, GCMDevice
+from push_notifications.results import SendResult
+from push_notifications.settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+
+
+FCM_SUCCESS = '{"name":"projects/test/messages/1"}'
+FCM_UNREGISTERED = json.dumps({"error": {"code": 404, "status": "NOT_FOUND", "details": [
+	{"@type": "type.googleapis.com/google.firebase.fcm.v1.FcmError", "errorCode": "UNREGISTERED"}
+]}})
+FCM_UNAVAILABLE = '{"error":{"code":503,"status":"UNAVAILABLE"}}'
+
+
+class FCMTest(TestCase):
+	def setUp(self):
+		provider = mock.Mock(token="access-token", project_id="test")
+		patcher = mock.patch("push_notifications.fcm._get_token_provider", return_value=provider)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def test_message_payload(self):
+		self.assertEqual(
+			json.loads(fcm._fcm_message("abc", {"message": "Hello world", "count": 2}, time_to_live=3600, dry_run=True).decode("utf-8")),
+			{
+				"message": {"token": "abc", "data": {"message": "Hello world", "count": "2"}, "android": {"ttl": "3600s"}},
+				"validate_only": True,
+			}
+		)
+
+	def test_single_message(self):
+		with mock.patch("push_notifications.fcm._fcm_request", return_value=(200, FCM_SUCCESS)) as p:
+			with mock.patch.dict(SETTINGS, {"GCM_BACKEND": "fcm"}):
+				GCMDevice(registration_id="abc").send_message("Hello world")
+		path, body, headers = p.call_args[0]
+		self.assertEqual(path, "/v1/projects/test/messages:send")
+		self.assertEqual(headers["Authorization"], "Bearer access-token")
+
+	def test_bulk_message(self):
+		devices = [GCMDevice.objects.create(registration_id="abc%i" % (i)) for i in range(3)]
+		responses = {"abc0": (200, FCM_SUCCESS), "abc1": (404, FCM_UNREGISTERED), "abc2": (503, FCM_UNAVAILABLE)}
+
+		def request(path, body, headers):
+			return responses[json.loads(body.decode("utf-8"))["message"]["token"]]
+
+		with mock.patch("push_notifications.fcm._fcm_request", side_effect=request):
+			result = GCMDevice.objects.all().send_message("Hello world", backend="fcm")
+		self.assertEqual(list(result.pks), [device.pk for device in devices])
+		self.assertEqual(list(result.statuses), [SendResult.SENT, SendResult.INVALID, SendResult.ERROR])
+		self.assertEqual(result.errors, {1: "UNREGISTERED", 2: "UNAVAILABLE"})
+		self.assertFalse(GCMDevice.objects.get(registration_id="abc1").active)
+
+	def test_access_token_is_refreshed_before_it_expires(self):
+		import datetime
+		import sys
+		provider = fcm.AccessTokenProvider("service-account.json")
+		credentials = mock.Mock(token="token", expiry=datetime.datetime.utcnow() + datetime.timedelta(hours=1))
+		google = mock.Mock()
+		modules = {
+			"google": google, "google.auth": google.auth, "google.auth.transport": google.auth.transport,
+			"google.auth.transport.requests": google.auth.transport.requests,
+		}
+		with mock.patch.object(provider, "_load", return_value=credentials):
+			with mock.patch.dict(sys.modules, modules):
+				self.assertEqual(provider.token, "token")
+				self.assertFalse(credentials.refresh.called)
+
+				credentials.expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=60)
+				provider.token
+				credentials.refresh.assert_called_once_with(google.auth.transport.requests.Request.return_value)
+
+
+class SimpleDevice(BareDevice):
+	# maps to the table left by the SimpleDevice model of earlier migrations
+	class Meta:
+		app_label = "push_notifications"
+
+
+class FCMBareDeviceTest(TestCase):
+	def setUp(self):
+		provider = mock.Mock(token="access-token", project_id="test")
+		patcher = mock.patch("push_notifications.fcm._get_token_provider", return_value=provider)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def test_mixed_queryset(self):
+		SimpleDevice.objects.create(service=SimpleDevice.APNS, registration_id="ab" * 32)
+		SimpleDevice.objects.create(service=SimpleDevice.GCM, registration_id="abc")
+		with mock.patch("push_notifications.models.apns_send_bulk_message") as apns:
+			with mock.patch("push_notifications.fcm._fcm_request", return_value=(200, FCM_SUCCESS)) as p:
+				ret = SimpleDevice.objects.all().send_message("Hello world", backend="fcm")
+		self.assertNotIn("backend", apns.call_args[1])
+		self.assertEqual(json.loads(p.call_args[0][1].decode("utf-8"))["message"]["token"], "abc")
+		self.assertEqual(ret["errors"], {})
+
+	def test_apns_device(self):
+		device = SimpleDevice(service=SimpleDevice.APNS, registration_id="ab" * 32)
+		with mock.patch("push_notifications.models.apns_send_message") as apns:
+			device.send_message("Hello world", backend="fcm")
+		self.assertNotIn("backend", apns.call_args[1])
@@ -0,0 +1,60 @@
+import mock
+from django.db import connection
+from django.test import TestCase
+from push_notifications import fields
+from push_notifications.fields import HexIntegerField
+from push_notifications.models import GCMDevice
+
+
+class HexIntegerFieldTest(TestCase):
+	def test_signed_conversions(self):
+		for unsigned, signed in ((0, 0), (1, 1), (2 ** 63 - 1, 2 ** 63 - 1), (2 ** 63, -2 ** 63), (2 ** 64 - 1, -1)):
+			self.assertEqual(fields._unsigned_to_signed_integer(unsigned), signed)
+			self.assertEqual(fields._signed_to_unsigned_integer(signed), unsigned)
+
+	def test_get_db_prep_value(self):
+		field = HexIntegerField()
+		with mock.patch.dict("push_notifications.fields._signed_storage", {connection.alias: True}):
+			self.assertEqual(field.get_db_prep_value("0xffffffffffffffff", connection), -1)
+			self.assertEqual(field.get_db_prep_value(2 ** 64 - 1, connection, prepared=True), -1)
+			self.assertIsNone(field.get_db_prep_value("", connection))
+		with mock.patch.dict("push_notifications.fields._signed_storage", {connection.alias: False}):
+			self.assertEqual(field.get_db_prep_value("0xffffffffffffffff", connection), 2 ** 64 - 1)
+
+	def test_round_trip(self):
+		GCMDevice.objects.create(registration_id="abc", device_id="0xffffffffffffffff")
+		GCMDevice.objects.create(registration_id="abc1", device_id="0x01")
+		self.assertEqual(GCMDevice.objects.get(registration_id="abc").device_id, 2 ** 64 - 1)
+		self.assertEqual(
+			sorted(GCMDevice.objects.filter(device_id__in=["0xffffffffffffffff", 1]).values_list("registration_id", flat=True)),
+			["abc", "abc1"]
+		)
+		self.assertEqual(GCMDevice.objects.get(device_id=2 ** 64 - 1).registration_id, "abc")
+
+
+class BinaryTokenFieldTest(TestCase):
+	def test_token_follows_registration_id(self):
+		from binascii import unhexlify
+		from push_notifications.models import APNSDevice
+
+		device = APNSDevice.objects.create(registration_id="ab" * 32)
+		APNSDevice.objects.bulk_create([APNSDevice(registration_id="CD" * 32), APNSDevice(registration_id="invalid")])
+		self.assertEqual(APNSDevice.objects.get(pk=device.pk).binary_token, unhexlify("ab" * 32))
+		self.assertEqual(APNSDevice.objects.get(registration_id="CD" * 32).binary_token, unhexlify("cd" * 32))
+		self.assertIsNone(APNSDevice.objects.get(registration_id="invalid").binary_token)
+
+		device.registration_id = "ef" * 32
+		device.save()
+		self.assertEqual(APNSDevice.objects.get(pk=device.pk).binary_token, unhexlify("ef" * 32))
+
+	def test_filter_tokens(self):
+		from binascii import unhexlify
+		from push_notifications.models import APNSDevice
+
+		APNSDevice.objects.create(registration_id="AB" * 32)
+		APNSDevice.objects.create(registration_id="cd" * 32)
+		APNSDevice.objects.create(registration_id="ef" * 32)
+		# not converted yet
+		APNSDevice.objects.filter(registration_id="cd" * 32).update(binary_token=None)
+		devices = APNSDevice.objects.all().filter_tokens([unhexlify("ab" * 32), unhexlify("cd" * 32)])
+		self.assertEqual(sorted(devices.values_list("registration_id", flat=True)), ["AB" * 32, "cd" * 32])
@@ -51,3 +51,25 @@ class GCMPushPayloadTest(TestCase):
 				"application/json",
 				api_key=None
 			)
+
+	def test_gzip_request_body(self):
+		import gzip
+		import io
+		from push_notifications.gcm import _gcm_send
+		from push_notifications.settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+
+		data = b'{"registration_ids":["' + b'a' * 2000 + b'"]}'
+		with mock.patch.dict(SETTINGS, {"GCM_API_KEY": "key", "GCM_GZIP": True}):
+			with mock.patch("push_notifications.gcm.Request") as request, mock.patch("push_notifications.gcm.urlopen"):
+				_gcm_send(data, "application/json")
+				url, body, headers = request.call_args[0]
+				self.assertEqual(headers["Content-Encoding"], "gzip")
+				self.assertEqual(headers["Content-Length"], str(len(body)))
+				self.assertLess(len(body), len(data))
+				self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(body)).read(), data)
+
+				# small bodies are sent as is
+				_gcm_send(b"registration_id=abc", "application/x-www-form-urlencoded;charset=UTF-8")
+				url, body, headers = request.call_args[0]
+				self.assertNotIn("Content-Encoding", headers)
+				self.assertEqual(body, b"registration_id=abc")
@@ -0,0 +1,156 @@
+import threading
+
+import mock
+from django.db import DatabaseError
+from django.test import TestCase, TransactionTestCase
+from push_notifications import invalidation
+from push_notifications.gcm import gcm_send_bulk_message, gcm_send_message
+from push_notifications.invalidation import InvalidationBuffer
+from push_notifications.models import GCMDevice
+from push_notifications.settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+
+
+class InvalidationBufferTest(TestCase):
+	def test_flush_on_size(self):
+		devices = [GCMDevice.objects.create(registration_id="abc%i" % (i)) for i in range(3)]
+		buffer = InvalidationBuffer(size=3, interval=60)
+		buffer.invalidate(GCMDevice, ["abc0", "abc1"])
+		self.assertEqual(GCMDevice.objects.filter(active=False).count(), 0)
+		buffer.invalidate(GCMDevice, ["abc2"])
+		self.assertEqual(GCMDevice.objects.filter(active=False).count(), len(devices))
+		self.assertEqual(buffer.pending, 0)
+
+	def test_flush_on_interval(self):
+		GCMDevice.objects.create(registration_id="abc")
+		buffer = InvalidationBuffer(size=100, interval=0)
+		buffer.invalidate(GCMDevice, ["abc"])
+		self.assertFalse(GCMDevice.objects.get().active)
+
+	def test_replace_registration_ids(self):
+		GCMDevice.objects.create(registration_id="abc")
+		GCMDevice.objects.create(registration_id="abc1")
+		GCMDevice.objects.create(registration_id="abc2")
+		buffer = InvalidationBuffer(size=100, interval=60)
+		buffer.replace(GCMDevice, "abc", "abc3")
+		# abc2 is already registered, the old device is invalidated instead
+		buffer.replace(GCMDevice, "abc1", "abc2")
+		buffer.flush()
+		self.assertEqual(
+			sorted(GCMDevice.objects.values_list("registration_id", "active")),
+			[("abc1", False), ("abc2", True), ("abc3", True)]
+		)
+
+	def test_sends_are_buffered(self):
+		device = GCMDevice.objects.create(registration_id="abc")
+		GCMDevice.objects.create(registration_id="abc1")
+		GCMDevice.objects.create(registration_id="abc2")
+		buffer = InvalidationBuffer(size=100, interval=60)
+		response = (
+			'{"multicast_id":108,"success":1,"failure":1,"canonical_ids":1,"results":['
+			'{"message_id":"1:09","registration_id":"abc3"},{"error":"NotRegistered"}]}'
+		)
+		with mock.patch.dict(SETTINGS, {"INVALIDATION_BUFFER": True}):
+			with mock.patch("push_notifications.invalidation._buffer", buffer):
+				with mock.patch("push_notifications.gcm._gcm_send", return_value="Error=NotRegistered"):
+					gcm_send_message(device, {"message": "Hello world"})
+				with mock.patch("push_notifications.gcm._gcm_send", return_value=response):
+					gcm_send_bulk_message(
+						GCMDevice.objects.filter(registration_id__in=["abc1", "abc2"]).order_by("pk").recipients(),
+						{"message": "Hello world"}
+					)
+
+		# the instance is deactivated in memory, the database waits for the flush
+		self.assertFalse(device.active)
+		self.assertEqual(GCMDevice.objects.filter(active=False).count(), 0)
+		self.assertEqual(buffer.pending, 3)
+		buffer.flush()
+		self.assertEqual(
+			sorted(GCMDevice.objects.values_list("registration_id", "active")),
+			[("abc", False), ("abc2", False), ("abc3", True)]
+		)
+
+	def test_canonical_ids_without_buffer(self):
+		GCMDevice.objects.create(registration_id="abc")
+		GCMDevice.objects.create(registration_id="abc1")
+		response = (
+			'{"multicast_id":108,"success":2,"failure":0,"canonical_ids":1,"results":['
+			'{"message_id":"1:08","registration_id":"abc2"},{"message_id":"1:09"}]}'
+		)
+		with mock.patch("push_notifications.gcm._gcm_send", return_value=response):
+			gcm_send_bulk_message(GCMDevice.objects.order_by("pk").recipients(), {"message": "Hello world"})
+		self.assertEqual(sorted(GCMDevice.objects.values_list("registration_id", flat=True)), ["abc1", "abc2"])
+
+	def test_failed_flush_is_put_back(self):
+		GCMDevice.objects.create(registration_id="abc")
+		buffer = InvalidationBuffer(size=100, interval=60)
+		buffer.invalidate(GCMDevice, ["abc"])
+		buffer.replace(GCMDevice, "abc1", "abc2")
+		with mock.patch("push_notifications.invalidation.write_invalidations", side_effect=DatabaseError):
+			with self.assertRaises(DatabaseError):
+				buffer.flush()
+		self.assertEqual(buffer.pending, 2)
+		self.assertEqual(buffer.invalid, {GCMDevice: set(["abc"])})
+		self.assertEqual(buffer.canonical, {GCMDevice: {"abc1": "abc2"}})
+		buffer.flush()
+		self.assertFalse(GCMDevice.objects.get().active)
+
+	def test_failed_flush_at_exit_is_logged(self):
+		buffer = mock.Mock()
+		buffer.flush.side_effect = DatabaseError
+		with mock.patch("push_notifications.invalidation._buffer", buffer):
+			with mock.patch("push_notifications.invalidation.logger") as logger:
+				invalidation._flush_at_exit()
+		self.assertTrue(logger.exception.called)
+
+
+class InvalidationBufferThreadTest(TransactionTestCase):
+	def test_flush_runs_behind_the_send(self):
+		threads = []
+		release = threading.Event()
+
+		def write(invalid, canonical):
+			threads.append(threading.current_thread())
+			release.wait(5)
+			raise DatabaseError
+
+		buffer = InvalidationBuffer(size=1, interval=60)
+		with mock.patch("push_notifications.invalidation.write_invalidations", side_effect=write):
+			with mock.patch("push_notifications.invalidation.logger") as logger:
+				buffer.invalidate(GCMDevice, ["abc"])
+				# the send returns while the write is in progress
+				self.assertTrue(buffer.flushing)
+				buffer.invalidate(GCMDevice, ["abc1"])
+				release.set()
+				buffer.thread.join()
+		self.assertEqual(len(threads), 1)
+		self.assertIsNot(threads[0], threading.current_thread())
+		self.assertTrue(logger.exception.called)
+		self.assertFalse(buffer.flushing)
+		self.assertEqual(buffer.invalid, {GCMDevice: set(["abc", "abc1"])})
+
+	def test_flush_on_timer(self):
+		written = threading.Event()
+		threads = []
+
+		def write(invalid, canonical):
+			threads.append(threading.current_thread())
+			written.set()
+
+		buffer = InvalidationBuffer(size=100, interval=0.05)
+		with mock.patch("push_notifications.invalidation.write_invalidations", side_effect=write):
+			# no further send comes to notice that the interval passed
+			buffer.invalidate(GCMDevice, ["abc"])
+			self.assertTrue(written.wait(5))
+			buffer.thread.join()
+		self.assertIsNot(threads[0], threading.current_thread())
+		self.assertEqual(buffer.pending, 0)
+		self.assertIsNone(buffer.timer)
+
+	def test_flush_cancels_the_timer(self):
+		buffer = InvalidationBuffer(size=100, interval=60)
+		buffer.invalidate(GCMDevice, ["abc"])
+		timer = buffer.timer
+		self.assertTrue(timer.is_alive())
+		buffer.take()
+		timer.join(5)
+		self.assertFalse(timer.is_alive())
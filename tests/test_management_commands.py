@@ -1,3 +1,5 @@
+import json
+
 import mock
 
 from django.core.management import call_command
@@ -18,7 +20,180 @@ class CommandsTestCase(TestCase):
 				mock.MagicMock()):
 			with mock.patch('push_notifications.apns._apns_receive_feedback',
 					mock.MagicMock()) as receiver:
-				receiver.side_effect = lambda s, certificate: [(b'', b'abc')]
+				receiver.side_effect = lambda s: [(b'', b'abc')]
 				call_command('prune_devices')
 		device.refresh_from_db()
 		self.assertFalse(device.active)
+
+	def test_prune_delivery_log(self):
+		from datetime import timedelta
+		from django.utils import timezone
+		from push_notifications.models import Delivery, DeliveryOutcome
+
+		old, recent = Delivery.objects.create(service="GCM"), Delivery.objects.create(service="GCM")
+		Delivery.objects.filter(pk=old.pk).update(date_created=timezone.now() - timedelta(days=8))
+		for delivery in (old, recent):
+			delivery.outcomes.create(device_pk=1, status=0)
+		call_command('prune_delivery_log', days=7)
+		self.assertEqual(list(Delivery.objects.all()), [recent])
+		self.assertEqual(list(DeliveryOutcome.objects.values_list('delivery', flat=True)), [recent.pk])
+
+	def test_broadcast(self):
+		from push_notifications.models import GCMDevice
+		from tests.mock_responses import GCM_JSON_RESPONSE_ERROR
+
+		for registration_id in ('abc', 'abc1', 'abc2', 'abc3'):
+			GCMDevice.objects.create(registration_id=registration_id)
+		GCMDevice.objects.filter(registration_id='abc3').update(active=False)
+
+		with mock.patch('push_notifications.gcm._gcm_send', return_value=GCM_JSON_RESPONSE_ERROR) as p:
+			call_command('broadcast', 'gcm', 'Hello world', processes=1, shards=1)
+		self.assertEqual(p.call_count, 1)
+		self.assertFalse(GCMDevice.objects.get(registration_id='abc').active)
+		self.assertTrue(GCMDevice.objects.get(registration_id='abc1').active)
+		self.assertFalse(GCMDevice.objects.get(registration_id='abc2').active)
+
+
+	def test_flush_outbox(self):
+		from push_notifications.models import GCMDevice, OutboxMessage
+		from tests.mock_responses import GCM_MULTIPLE_JSON_RESPONSE
+
+		for registration_id in ('abc', 'abc1'):
+			GCMDevice.objects.create(registration_id=registration_id)
+		GCMDevice.objects.all().queue_message('Hello world')
+		with mock.patch('push_notifications.gcm._gcm_send', return_value=GCM_MULTIPLE_JSON_RESPONSE) as p:
+			call_command('flush_outbox', batch_size=1)
+		# a batch per message
+		self.assertEqual(p.call_count, 2)
+		self.assertFalse(OutboxMessage.objects.exists())
+
+	def test_send_scheduled(self):
+		from django.utils import timezone
+		from push_notifications.models import GCMDevice, ScheduledNotification
+		from push_notifications.scheduler import schedule
+		from tests.mock_responses import GCM_MULTIPLE_JSON_RESPONSE
+
+		for registration_id in ('abc', 'abc1'):
+			GCMDevice.objects.create(registration_id=registration_id)
+		schedule(GCMDevice, 'Hello world', timezone.now())
+
+		def run(read, send, write, queue_size):
+			# the database of the tests is not shared with other threads
+			for batch in read:
+				write(send(batch))
+
+		with mock.patch('push_notifications.pipeline.pipeline', side_effect=run):
+			with mock.patch('push_notifications.gcm._gcm_send', return_value=GCM_MULTIPLE_JSON_RESPONSE) as p:
+				call_command('send_scheduled')
+		self.assertEqual(p.call_count, 1)
+		self.assertFalse(ScheduledNotification.objects.filter(date_sent__isnull=True).exists())
+
+
+class BroadcastTestCase(TestCase):
+
+	def test_pk_ranges(self):
+		from push_notifications.broadcast import pk_ranges
+		from push_notifications.models import GCMDevice
+
+		self.assertEqual(pk_ranges(GCMDevice.objects.all(), 4), [])
+		devices = [GCMDevice.objects.create(registration_id='abc%d' % i) for i in range(10)]
+		first = devices[0].pk
+		self.assertEqual(
+			pk_ranges(GCMDevice.objects.all(), 4),
+			[(first, first + 2), (first + 3, first + 5), (first + 6, first + 8), (first + 9, first + 9)]
+		)
+		self.assertEqual(pk_ranges(GCMDevice.objects.all(), 20), [(first + i, first + i) for i in range(10)])
+
+	def test_broadcast_chunks(self):
+		from push_notifications.broadcast import broadcast
+		from push_notifications.models import GCMDevice
+		from tests.mock_responses import GCM_MULTIPLE_JSON_RESPONSE
+
+		for i in range(5):
+			GCMDevice.objects.create(registration_id='abc%d' % i)
+		with mock.patch('push_notifications.gcm._gcm_send', return_value=GCM_MULTIPLE_JSON_RESPONSE) as p:
+			report = broadcast(GCMDevice.objects.all(), 'Hello world', processes=1, shards=2, chunk_size=2)
+		self.assertEqual(report['devices'], 5)
+		self.assertEqual(report['invalidated'], 0)
+		# shards of 3 and 2 devices, sent 2 at a time
+		self.assertEqual(len(report['shards']), 2)
+		self.assertEqual(p.call_count, 3)
+
+	def test_broadcast_counts_invalidated_devices(self):
+		from push_notifications.broadcast import broadcast
+		from push_notifications.invalidation import InvalidationBuffer
+		from push_notifications.models import GCMDevice
+		from push_notifications.settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+
+		for i in range(3):
+			GCMDevice.objects.create(registration_id='abc%d' % i)
+		response = '{"results":[{"message_id":"1:08"},{"error":"NotRegistered"},{"error":"InvalidRegistration"}]}'
+		# invalidations written behind the sends are counted too
+		with mock.patch.dict(SETTINGS, {'INVALIDATION_BUFFER': True}):
+			with mock.patch('push_notifications.invalidation._buffer', InvalidationBuffer(size=100, interval=60)):
+				with mock.patch('push_notifications.gcm._gcm_send', return_value=response):
+					report = broadcast(GCMDevice.objects.all(), 'Hello world', processes=1, shards=1)
+		self.assertEqual((report['devices'], report['invalidated']), (3, 2))
+		# written at the end of the shard, pool workers do not run atexit handlers
+		self.assertEqual(GCMDevice.objects.filter(active=False).count(), 2)
+
+	def test_resume_broadcast(self):
+		from push_notifications.broadcast import broadcast
+		from push_notifications.models import BroadcastCheckpoint, GCMDevice
+		from tests.mock_responses import GCM_MULTIPLE_JSON_RESPONSE
+
+		for i in range(6):
+			GCMDevice.objects.create(registration_id='abc%d' % i)
+
+		# the process dies after sending the first chunk of 2 devices
+		with mock.patch('push_notifications.gcm._gcm_send') as p:
+			p.side_effect = [GCM_MULTIPLE_JSON_RESPONSE, IOError('connection lost')]
+			with self.assertRaises(IOError):
+				broadcast(GCMDevice.objects.all(), 'Hello world', processes=1, shards=1, chunk_size=2, name='test')
+		checkpoint = BroadcastCheckpoint.objects.get(name='test')
+		self.assertEqual(checkpoint.devices, 2)
+		self.assertFalse(checkpoint.completed)
+
+		GCMDevice.objects.create(registration_id='late')
+		with mock.patch('push_notifications.gcm._gcm_send', return_value=GCM_MULTIPLE_JSON_RESPONSE) as p:
+			report = broadcast(GCMDevice.objects.all(), 'Hello world', processes=1, shards=1, chunk_size=2, name='test')
+		sent = [registration_id for call in p.call_args_list for registration_id in json.loads(call[0][0])['registration_ids']]
+		self.assertEqual(sent, ['abc2', 'abc3', 'abc4', 'abc5'])
+		self.assertEqual(report['devices'], 4)
+		checkpoint = BroadcastCheckpoint.objects.get(name='test')
+		self.assertEqual(checkpoint.devices, 6)
+		self.assertTrue(checkpoint.completed)
+
+		# a completed broadcast sends nothing
+		with mock.patch('push_notifications.gcm._gcm_send') as p:
+			broadcast(GCMDevice.objects.all(), 'Hello world', processes=1, name='test')
+		self.assertFalse(p.called)
+
+	def test_resume_broadcast_mismatch(self):
+		from push_notifications.broadcast import broadcast
+		from push_notifications.models import GCMDevice
+		from tests.mock_responses import GCM_MULTIPLE_JSON_RESPONSE
+
+		for i in range(2):
+			GCMDevice.objects.create(registration_id='abc%d' % i)
+		with mock.patch('push_notifications.gcm._gcm_send', return_value=GCM_MULTIPLE_JSON_RESPONSE):
+			broadcast(GCMDevice.objects.all(), 'Hello world', processes=1, name='test')
+		with mock.patch('push_notifications.gcm._gcm_send') as p:
+			with self.assertRaises(ValueError):
+				broadcast(GCMDevice.objects.all(), 'Goodbye world', processes=1, name='test')
+			with self.assertRaises(ValueError):
+				broadcast(GCMDevice.objects.filter(registration_id='abc0'), 'Hello world', processes=1, name='test')
+		self.assertFalse(p.called)
+
+	def test_dedupe_devices(self):
+		from push_notifications.models import GCMDevice
+
+		for registration_id in ('abc', 'abc', 'abc1', 'abc', 'abc1', 'abc2'):
+			GCMDevice.objects.create(registration_id=registration_id)
+		latest = GCMDevice.objects.filter(registration_id='abc').latest('pk')
+		call_command('dedupe_devices')
+		self.assertEqual(
+			sorted(GCMDevice.objects.values_list('registration_id', flat=True)),
+			['abc', 'abc1', 'abc2']
+		)
+		self.assertTrue(GCMDevice.objects.filter(pk=latest.pk).exists())
@@ -1,10 +1,11 @@
 import json
 
 import mock
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.test import TestCase, TransactionTestCase
 from django.utils import timezone
 from push_notifications.gcm import GCMError
-from push_notifications.models import APNSDevice, GCMDevice
+from push_notifications.models import APNSDevice, GCMDevice, Recipient
 from tests.mock_responses import (GCM_JSON_RESPONSE_ERROR,
                                   GCM_MULTIPLE_JSON_RESPONSE,
                                   GCM_PLAIN_RESPONSE, GCM_PLAIN_RESPONSE_ERROR,
@@ -224,3 +225,112 @@ class ModelTestCase(TestCase):
             GCMDevice.objects.create(
                 registration_id=device,
             )
+
+
+class DeviceUpsertTestCase(TestCase):
+    def test_gcm_upsert(self):
+        device = GCMDevice.objects.upsert("abc", name="first")
+        assert device.pk is not None
+        again = GCMDevice.objects.upsert("abc", name="second", active=True)
+        assert again.pk == device.pk
+        assert GCMDevice.objects.get().name == "second"
+
+    def test_gcm_upsert_updates_duplicates(self):
+        GCMDevice.objects.create(registration_id="abc", active=False)
+        latest = GCMDevice.objects.create(registration_id="abc", active=False)
+        device = GCMDevice.objects.upsert("abc", active=True)
+        assert device.pk == latest.pk
+        assert GCMDevice.objects.filter(active=True).count() == 2
+
+    def test_apns_upsert(self):
+        device = APNSDevice.objects.upsert("abc")
+        assert APNSDevice.objects.upsert("abc").pk == device.pk
+        assert APNSDevice.objects.upsert("abc", name="renamed").name == "renamed"
+        assert APNSDevice.objects.count() == 1
+
+
+class RecipientTestCase(TestCase):
+    def test_recipients(self):
+        user = get_user_model().objects.create(username="user")
+        device = GCMDevice.objects.create(registration_id="abc", user=user)
+        recipients = list(GCMDevice.objects.all().recipients())
+        assert len(recipients) == 1
+        assert isinstance(recipients[0], Recipient)
+        assert not hasattr(recipients[0], "__dict__")
+        assert (recipients[0].pk, recipients[0].registration_id, recipients[0].user_id) == (device.pk, "abc", user.pk)
+        assert recipients[0].__class__.objects.model is GCMDevice
+
+    def test_apns_bulk_send_invalidates_recipients(self):
+        APNSDevice.objects.create(registration_id="abc")
+        APNSDevice.objects.create(registration_id="ae" * 32)
+        with mock.patch("push_notifications.apns._apns_create_socket_to_push", mock.MagicMock()):
+            APNSDevice.objects.all().send_message("Hello world")
+        assert APNSDevice.objects.get(registration_id="abc").active is False
+        assert APNSDevice.objects.get(registration_id="ae" * 32).active is True
+
+
+class SendConcurrentlyTestCase(TransactionTestCase):
+    def test_providers_are_sent_to_in_parallel(self):
+        import threading
+        from push_notifications.models import _send_concurrently
+
+        apns_started = threading.Event()
+
+        def send_apns():
+            apns_started.set()
+            raise GCMError("failed")
+
+        def send_gcm():
+            # only returns if the APNS send runs at the same time
+            return apns_started.wait(5)
+
+        report = _send_concurrently({"apns": send_apns, "gcm": send_gcm})
+        self.assertIsNone(report["apns"])
+        self.assertTrue(report["gcm"])
+        self.assertEqual(list(report["errors"]), ["apns"])
+        self.assertIsInstance(report["errors"]["apns"], GCMError)
+
+    def test_other_exceptions_are_raised(self):
+        from push_notifications.models import _send_concurrently
+
+        def send_apns():
+            raise TypeError("unexpected keyword argument")
+
+        with self.assertRaises(TypeError):
+            _send_concurrently({"apns": send_apns, "gcm": lambda: None})
+
+    def test_single_provider_is_sent_to_inline(self):
+        from push_notifications.models import _send_concurrently
+
+        with mock.patch("threading.Thread") as thread:
+            report = _send_concurrently({"gcm": lambda: {"success": 1}})
+        self.assertFalse(thread.called)
+        self.assertEqual(report, {"gcm": {"success": 1}, "errors": {}})
+
+    def test_threads_write_to_the_database(self):
+        from django.db import connection
+        from push_notifications.models import _send_concurrently
+
+        if connection.settings_dict["NAME"] == ":memory:":
+            self.skipTest("threads do not share in-memory SQLite databases on Python 2")
+
+        APNSDevice.objects.create(registration_id="ae" * 32)
+        GCMDevice.objects.create(registration_id="abc")
+
+        def invalidate(model):
+            return lambda: model.objects.filter(active=True).update(active=False)
+
+        report = _send_concurrently({"apns": invalidate(APNSDevice), "gcm": invalidate(GCMDevice)})
+        self.assertEqual((report["apns"], report["gcm"]), (1, 1))
+        self.assertFalse(APNSDevice.objects.filter(active=True).exists())
+        self.assertFalse(GCMDevice.objects.filter(active=True).exists())
+
+    def test_sends_in_a_transaction_are_inline(self):
+        from django.db import transaction
+        from push_notifications.models import _send_concurrently
+
+        with transaction.atomic():
+            with mock.patch("threading.Thread") as thread:
+                report = _send_concurrently({"apns": lambda: 1, "gcm": lambda: 2})
+        self.assertFalse(thread.called)
+        self.assertEqual((report["apns"], report["gcm"]), (1, 2))
@@ -0,0 +1,143 @@
+import json
+from unittest import skipUnless
+
+import mock
+from django.core.management import call_command
+from django.db import DatabaseError, connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.utils.six import StringIO
+from push_notifications import outbox
+from push_notifications.models import APNSDevice, GCMDevice, OutboxMessage
+from push_notifications.settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+
+
+def gcm_respond(data, content_type, api_key=None):
+	registration_ids = json.loads(data.decode("utf-8"))["registration_ids"]
+	return json.dumps({"results": [{"message_id": "1:08"}] * len(registration_ids)})
+
+
+class OutboxTest(TestCase):
+	def test_flush_coalesces_by_payload(self):
+		gcm = [GCMDevice.objects.create(registration_id="abc%i" % (i)) for i in range(4)]
+		apns = APNSDevice.objects.create(registration_id="ab" * 32)
+		with mock.patch("push_notifications.gcm._gcm_send", side_effect=gcm_respond) as gcm_send:
+			with mock.patch("push_notifications.models.apns_send_bulk_message") as apns_send:
+				for device in gcm[:3]:
+					device.queue_message("Hello world")
+				gcm[3].queue_message("Hello world", extra={"foo": "bar"})
+				apns.queue_message("Hello world")
+				self.assertEqual(OutboxMessage.objects.count(), 5)
+				self.assertFalse(gcm_send.called)
+
+				report = outbox.flush()
+		self.assertEqual((report["messages"], report["sends"], report["errors"]), (5, 3, []))
+		self.assertEqual(
+			sorted(json.loads(call[0][0].decode("utf-8"))["registration_ids"] for call in gcm_send.call_args_list),
+			[["abc0", "abc1", "abc2"], ["abc3"]]
+		)
+		self.assertEqual([device.pk for device in apns_send.call_args[1]["devices"]], [apns.pk])
+		self.assertFalse(OutboxMessage.objects.exists())
+
+	def test_rolled_back_messages_are_not_queued(self):
+		GCMDevice.objects.create(registration_id="abc")
+		try:
+			with transaction.atomic():
+				GCMDevice.objects.all().queue_message("Hello world")
+				raise ValueError()
+		except ValueError:
+			pass
+		self.assertFalse(OutboxMessage.objects.exists())
+
+	def test_failed_sends_stay_in_the_outbox(self):
+		GCMDevice.objects.create(registration_id="abc")
+		GCMDevice.objects.all().queue_message("Hello world")
+		response = '{"failure":1,"results":[{"error":"Unavailable"}]}'
+		with mock.patch("push_notifications.gcm._gcm_send", return_value=response):
+			report = outbox.flush()
+		self.assertEqual((report["messages"], len(report["errors"])), (0, 1))
+		self.assertEqual(OutboxMessage.objects.count(), 1)
+		message = OutboxMessage.objects.get()
+		self.assertEqual((message.attempts, message.claimed_until), (1, None))
+		self.assertEqual(message.last_error, report["errors"][0])
+
+	def test_failing_messages_are_given_up(self):
+		GCMDevice.objects.create(registration_id="abc")
+		GCMDevice.objects.all().queue_message("Hello world")
+		OutboxMessage.objects.update(attempts=SETTINGS["OUTBOX_MAX_ATTEMPTS"])
+		with mock.patch("push_notifications.gcm._gcm_send") as p:
+			report = outbox.flush()
+		self.assertFalse(p.called)
+		self.assertEqual(report["messages"], 0)
+		self.assertEqual(OutboxMessage.objects.count(), 1)
+
+	def test_claimed_messages_are_skipped(self):
+		GCMDevice.objects.create(registration_id="abc")
+		GCMDevice.objects.all().queue_message("Hello world")
+		self.assertEqual(len(outbox._claim(connection.alias, OutboxMessage.objects.all(), 10)), 1)
+		with mock.patch("push_notifications.gcm._gcm_send") as p:
+			outbox.flush()
+		self.assertFalse(p.called)
+
+
+	def test_unexpected_error_keeps_what_was_sent(self):
+		GCMDevice.objects.create(registration_id="abc")
+		GCMDevice.objects.all().queue_message("A")
+		GCMDevice.objects.all().queue_message("B")
+		with mock.patch("push_notifications.outbox._send", side_effect=[{}, ValueError("Lost connection")]):
+			with self.assertRaises(ValueError):
+				outbox.flush()
+		# the first payload was sent and deleted, the second is released for the next flush
+		message = OutboxMessage.objects.get()
+		self.assertEqual(json.loads(message.payload)["message"], "B")
+		self.assertEqual((message.claimed_until, message.last_error), (None, "ValueError: Lost connection"))
+
+	def test_prune_given_up_messages(self):
+		GCMDevice.objects.create(registration_id="abc")
+		GCMDevice.objects.all().queue_message("Hello world")
+		GCMDevice.objects.all().queue_message("Hello again")
+		OutboxMessage.objects.filter(payload__contains="again").update(attempts=SETTINGS["OUTBOX_MAX_ATTEMPTS"])
+		self.assertEqual(outbox.given_up().count(), 1)
+		out = StringIO()
+		call_command("flush_outbox", prune=True, stdout=out)
+		self.assertEqual(out.getvalue().strip(), "deleted 1 messages given up on")
+		self.assertEqual(json.loads(OutboxMessage.objects.get().payload)["message"], "Hello world")
+
+
+@skipUnless(hasattr(transaction, "on_commit"), "Django 1.9+")
+class OutboxCommitTest(TransactionTestCase):
+	def test_commit_sends_the_messages_of_the_transaction(self):
+		devices = [GCMDevice.objects.create(registration_id="abc%i" % (i)) for i in range(3)]
+		with mock.patch.dict(SETTINGS, {"OUTBOX_FLUSH_ON_COMMIT": False}):
+			devices[0].queue_message("Queued earlier")
+
+		with mock.patch.dict(SETTINGS, {"OUTBOX_COMMIT_BATCH_SIZE": 1}):
+			with mock.patch("push_notifications.gcm._gcm_send", side_effect=gcm_respond) as p:
+				with transaction.atomic():
+					GCMDevice.objects.filter(pk__in=[device.pk for device in devices[1:]]).queue_message("Hello world")
+					self.assertFalse(p.called)
+		# a single batch of the messages of the transaction, the others wait for flush_outbox
+		self.assertEqual(p.call_count, 1)
+		self.assertEqual(json.loads(p.call_args[0][0].decode("utf-8"))["data"]["message"], "Hello world")
+		self.assertEqual(OutboxMessage.objects.count(), 2)
+
+	def test_messages_are_sent_outside_of_a_transaction(self):
+		GCMDevice.objects.create(registration_id="abc")
+		atomic = []
+
+		def send(*args, **kwargs):
+			atomic.append(connection.in_atomic_block)
+			return gcm_respond(*args, **kwargs)
+
+		with mock.patch("push_notifications.gcm._gcm_send", side_effect=send):
+			GCMDevice.objects.all().queue_message("Hello world")
+		self.assertEqual(atomic, [False])
+		self.assertFalse(OutboxMessage.objects.exists())
+
+	def test_commit_flush_errors_are_logged(self):
+		GCMDevice.objects.create(registration_id="abc")
+		with mock.patch("push_notifications.outbox.flush", side_effect=DatabaseError):
+			with mock.patch("push_notifications.outbox.logger") as logger:
+				with transaction.atomic():
+					GCMDevice.objects.all().queue_message("Hello world")
+		self.assertTrue(logger.exception.called)
+		self.assertEqual(OutboxMessage.objects.count(), 1)
@@ -0,0 +1,132 @@
+import json
+import threading
+
+import mock
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from push_notifications.gcm import GCMError
+from push_notifications.models import GCMDevice
+from push_notifications.pipeline import pipeline, send_pipelined
+from push_notifications.settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+
+
+def respond(data, content_type, api_key=None):
+	registration_ids = json.loads(data.decode("utf-8"))["registration_ids"]
+	return json.dumps({"results": [
+		{"error": "NotRegistered"} if registration_id == "abc3" else {"message_id": "1:08"}
+		for registration_id in registration_ids
+	]})
+
+
+class PipelineTest(TestCase):
+	def test_stages(self):
+		written = []
+		pipeline(iter([[1, 2], [3], [4, 5]]), lambda batch: sum(batch), written.append)
+		self.assertEqual(written, [3, 3, 9])
+
+	def test_backpressure(self):
+		produced = []
+		sending = threading.Event()
+		fourth = threading.Event()
+
+		def read():
+			for i in range(100):
+				produced.append(i)
+				if i == 3:
+					fourth.set()
+				yield i
+
+		def send(batch):
+			if batch == 0:
+				sending.wait(5)
+			return batch
+
+		thread = threading.Thread(target=pipeline, args=(read(), send, lambda value: None), kwargs={"queue_size": 2})
+		thread.start()
+		# the batch being sent, the queued ones and the one waiting to be queued:
+		# the reader cannot go further until the first batch is sent
+		self.assertTrue(fourth.wait(5))
+		self.assertEqual(len(produced), 4)
+		sending.set()
+		thread.join()
+		self.assertEqual(len(produced), 100)
+
+	def test_writer_exception(self):
+		def write(value):
+			raise ValueError(value)
+
+		with self.assertRaises(ValueError):
+			pipeline(iter(range(100)), lambda batch: batch, write)
+
+	def test_reader_exception(self):
+		def read():
+			yield 1
+			raise ValueError()
+
+		written = []
+		with self.assertRaises(ValueError):
+			pipeline(read(), lambda batch: batch, written.append)
+		self.assertEqual(written, [1])
+
+	def test_send_pipelined(self):
+		for i in range(5):
+			GCMDevice.objects.create(registration_id="abc%i" % (i))
+
+		writes = []
+
+		def run(read, send, write, queue_size):
+			# the database of the tests is not shared with other threads
+			for batch in read:
+				invalidated = GCMDevice.objects.filter(active=False).count()
+				pending = send(batch)
+				self.assertEqual(GCMDevice.objects.filter(active=False).count(), invalidated)
+				writes.append(pending)
+				write(pending)
+
+		with mock.patch("push_notifications.pipeline.pipeline", side_effect=run):
+			with mock.patch("push_notifications.gcm._gcm_send", side_effect=respond) as p:
+				result = send_pipelined(GCMDevice.objects.all(), "Hello world", chunk_size=2)
+		self.assertEqual(p.call_count, 3)
+		self.assertEqual(len(writes), 3)
+		self.assertEqual((result.count, result.success), (5, 4))
+		self.assertEqual(list(GCMDevice.objects.filter(active=False).values_list("registration_id", flat=True)), ["abc3"])
+
+	def test_failed_send_writes_its_invalidations(self):
+		for i in range(5):
+			GCMDevice.objects.create(registration_id="abc%i" % (i))
+
+		def run(read, send, write, queue_size):
+			for batch in read:
+				write(send(batch))
+
+		requests = []
+
+		def send(data, content_type, api_key=None):
+			# the last request of the chunk fails after the one of abc3
+			requests.append(data)
+			if len(requests) == 3:
+				raise GCMError("Internal server error")
+			return respond(data, content_type, api_key)
+
+		with mock.patch.dict(SETTINGS, {"GCM_MAX_RECIPIENTS": 2}):
+			with mock.patch("push_notifications.pipeline.pipeline", side_effect=run):
+				with mock.patch("push_notifications.gcm._gcm_send", side_effect=send):
+					with self.assertRaises(GCMError):
+						send_pipelined(GCMDevice.objects.all(), "Hello world", chunk_size=5)
+		self.assertEqual(list(GCMDevice.objects.filter(active=False).values_list("registration_id", flat=True)), ["abc3"])
+
+
+class PipelineThreadTest(TransactionTestCase):
+	def setUp(self):
+		if connection.settings_dict["NAME"] == ":memory:":
+			self.skipTest("the in-memory database of the tests is not shared with other threads")
+
+	def test_send_pipelined(self):
+		for i in range(5):
+			GCMDevice.objects.create(registration_id="abc%i" % (i))
+
+		with mock.patch("push_notifications.gcm._gcm_send", side_effect=respond) as p:
+			result = send_pipelined(GCMDevice.objects.all(), "Hello world", chunk_size=2)
+		self.assertEqual(p.call_count, 3)
+		self.assertEqual((result.count, result.success), (5, 4))
+		self.assertEqual(list(GCMDevice.objects.filter(active=False).values_list("registration_id", flat=True)), ["abc3"])
@@ -0,0 +1,64 @@
+import mock
+from django.test import TestCase
+from push_notifications import ratelimit
+from push_notifications.gcm import gcm_send_bulk_message
+from push_notifications.models import GCMDevice
+from push_notifications.ratelimit import TokenBucket, get_rate_limiter
+from tests.mock_responses import GCM_JSON_RESPONSE
+
+
+class TokenBucketTest(TestCase):
+	def test_reserve(self):
+		with mock.patch("push_notifications.ratelimit._clock", return_value=100.0):
+			bucket = TokenBucket(10, burst=20)
+			self.assertEqual(bucket.reserve(20), 0)
+			self.assertEqual(bucket.reserve(5), 0.5)
+
+		with mock.patch("push_notifications.ratelimit._clock", return_value=101.0):
+			# 10 tokens refilled, 5 of which pay off the debt
+			self.assertEqual(bucket.reserve(5), 0)
+			self.assertEqual(bucket.reserve(1), 0.1)
+
+	def test_refill_is_capped_by_burst(self):
+		with mock.patch("push_notifications.ratelimit._clock", return_value=100.0):
+			bucket = TokenBucket(10, burst=20)
+		with mock.patch("push_notifications.ratelimit._clock", return_value=1000.0):
+			self.assertEqual(bucket.reserve(20), 0)
+			self.assertEqual(bucket.reserve(10), 1.0)
+
+
+class RateLimiterSettingsTest(TestCase):
+	def setUp(self):
+		ratelimit._limiters.clear()
+
+	def tearDown(self):
+		ratelimit._limiters.clear()
+
+	def test_unlimited_by_default(self):
+		with mock.patch.dict("push_notifications.ratelimit.SETTINGS", {"RATE_LIMITS": {}}):
+			self.assertIsNone(get_rate_limiter("GCM", "key"))
+
+	def test_per_credential_limiters(self):
+		limits = {"GCM": {"rate": 10, "CREDENTIALS": {"other": {"rate": 5}}}}
+		with mock.patch.dict("push_notifications.ratelimit.SETTINGS", {"RATE_LIMITS": limits}):
+			limiter = get_rate_limiter("GCM", "key")
+			self.assertEqual(limiter.rate, 10)
+			self.assertIs(get_rate_limiter("GCM", "key"), limiter)
+			self.assertEqual(get_rate_limiter("GCM", "other").rate, 5)
+			self.assertIsNot(get_rate_limiter("GCM", "key2"), limiter)
+
+	def test_credential_overrides_inherit_the_provider_config(self):
+		limits = {"APNS": {"rate": 10, "cache": "default", "CREDENTIALS": {"other.pem": {"rate": 5}}}}
+		with mock.patch.dict("push_notifications.ratelimit.SETTINGS", {"RATE_LIMITS": limits}):
+			limiter = get_rate_limiter("APNS", "other.pem")
+		self.assertIsInstance(limiter, ratelimit.CacheRateLimiter)
+		self.assertEqual(limiter.rate, 5)
+
+	def test_gcm_bulk_send_acquires_per_chunk(self):
+		limiter = mock.MagicMock()
+		devices = [GCMDevice(registration_id="abc%i" % (i)) for i in range(5)]
+		with mock.patch("push_notifications.gcm.get_rate_limiter", return_value=limiter):
+			with mock.patch.dict("push_notifications.gcm.SETTINGS", {"GCM_MAX_RECIPIENTS": 2}):
+				with mock.patch("push_notifications.gcm._gcm_send", return_value=GCM_JSON_RESPONSE):
+					gcm_send_bulk_message(devices, {"message": "Hello world"})
+		self.assertEqual(limiter.acquire.call_args_list, [mock.call(2), mock.call(2), mock.call(1)])
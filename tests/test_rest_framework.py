@@ -34,3 +34,138 @@ class APNSDeviceSerializerTestCase(TestCase):
         self.assertEqual(serializer.errors["device_id"][0], '"ffffffffffffffffffffffffffffake" is not a valid UUID.')
         self.assertEqual(serializer.errors["registration_id"][0], "Registration ID (device token) is invalid")
 
+
+
+class DeviceBulkRegistrationTestCase(TestCase):
+    def bulk(self, viewset, data):
+        from rest_framework.test import APIRequestFactory
+
+        request = APIRequestFactory().post("/device/bulk/", data, format="json")
+        return viewset.as_view({"post": "bulk"})(request)
+
+    def test_gcm_bulk_registration(self):
+        from push_notifications.api.rest_framework import GCMDeviceViewSet
+
+        GCMDevice.objects.create(registration_id="abc", name="old")
+        GCMDevice.objects.create(registration_id="abc1", name="same")
+
+        # foreign devices, select, bulk update, bulk insert and marking the segments dirty,
+        # plus the savepoint queries of the transaction
+        with self.assertNumQueries(7):
+            response = self.bulk(GCMDeviceViewSet, [
+                {"registration_id": "abc", "name": "new"},
+                {"registration_id": "abc1", "name": "same"},
+                {"registration_id": "abc2", "device_id": "0x01"},
+                {"registration_id": "abc3"},
+                {"registration_id": "abc3"},
+                {"name": "no registration id"},
+            ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [item["status"] for item in response.data],
+            ["updated", "unchanged", "created", "created", "duplicate", "invalid"]
+        )
+        self.assertEqual(GCMDevice.objects.get(registration_id="abc").name, "new")
+        self.assertEqual(GCMDevice.objects.get(registration_id="abc2").device_id, 1)
+        self.assertEqual(GCMDevice.objects.filter(registration_id="abc3").count(), 1)
+
+    def test_bulk_registration_of_more_devices_than_query_parameters(self):
+        from push_notifications.api.rest_framework import GCMDeviceViewSet
+
+        devices = [{"registration_id": "abc%i" % (i)} for i in range(1500)]
+        self.bulk(GCMDeviceViewSet, devices)
+        response = self.bulk(GCMDeviceViewSet, devices)
+        self.assertEqual(set(item["status"] for item in response.data), set(["unchanged"]))
+        self.assertEqual(GCMDevice.objects.count(), 1500)
+
+    def test_apns_bulk_registration(self):
+        from push_notifications.api.rest_framework import APNSDeviceViewSet
+
+        APNSDevice.objects.create(registration_id="ae" * 32, name="old")
+        response = self.bulk(APNSDeviceViewSet, [
+            {"registration_id": "ae" * 32, "name": "new"},
+            {"registration_id": "af" * 32},
+            {"registration_id": "invalid"},
+        ])
+        self.assertEqual([item["status"] for item in response.data], ["updated", "created", "invalid"])
+        self.assertEqual(APNSDevice.objects.get(registration_id="ae" * 32).name, "new")
+        self.assertEqual(APNSDevice.objects.count(), 2)
+
+    def test_bulk_registration_requires_a_list(self):
+        from push_notifications.api.rest_framework import GCMDeviceViewSet
+
+        response = self.bulk(GCMDeviceViewSet, {"registration_id": "abc"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_registration_is_idempotent(self):
+        from rest_framework.test import APIRequestFactory
+        from push_notifications.api.rest_framework import APNSDeviceViewSet, GCMDeviceViewSet
+
+        for viewset, model, registration_id in (
+            (APNSDeviceViewSet, APNSDevice, "ae" * 32),
+            (GCMDeviceViewSet, GCMDevice, "abc"),
+        ):
+            for name, status_code in (("first", 201), ("second", 200)):
+                request = APIRequestFactory().post("/device/", {"registration_id": registration_id, "name": name})
+                response = viewset.as_view({"post": "create"})(request)
+                self.assertEqual(response.status_code, status_code)
+                self.assertEqual(response.data["name"], name)
+            self.assertEqual(model.objects.get().name, "second")
+
+
+    def test_registration_reactivates_device(self):
+        from rest_framework.test import APIRequestFactory
+        from push_notifications.api.rest_framework import GCMDeviceViewSet
+
+        GCMDevice.objects.create(registration_id="abc", active=False)
+        GCMDevice.objects.create(registration_id="abc1", active=False)
+        request = APIRequestFactory().post("/device/", {"registration_id": "abc"})
+        self.assertEqual(GCMDeviceViewSet.as_view({"post": "create"})(request).status_code, 200)
+        self.bulk(GCMDeviceViewSet, [{"registration_id": "abc1"}])
+        self.assertEqual(GCMDevice.objects.filter(active=True).count(), 2)
+
+    def test_authorized_registration_of_another_users_device(self):
+        from django.contrib.auth.models import User
+        from rest_framework.test import APIRequestFactory, force_authenticate
+        from push_notifications.api.rest_framework import APNSDeviceAuthorizedViewSet
+
+        owner = User.objects.create(username="owner")
+        other = User.objects.create(username="other")
+        APNSDevice.objects.create(registration_id="ae" * 32, user=owner)
+
+        request = APIRequestFactory().post("/device/", {"registration_id": "ae" * 32, "name": "mine"})
+        force_authenticate(request, user=other)
+        response = APNSDeviceAuthorizedViewSet.as_view({"post": "create"})(request)
+        self.assertEqual(response.status_code, 400)
+
+        request = APIRequestFactory().post("/device/bulk/", [{"registration_id": "ae" * 32}], format="json")
+        force_authenticate(request, user=other)
+        response = APNSDeviceAuthorizedViewSet.as_view({"post": "bulk"})(request)
+        self.assertEqual([item["status"] for item in response.data], ["invalid"])
+
+        device = APNSDevice.objects.get()
+        self.assertEqual((device.user, device.name), (owner, None))
+
+
+class DeviceTopicSubscriptionTestCase(TestCase):
+    def post(self, action, registration_id, data):
+        from rest_framework.test import APIRequestFactory
+        from push_notifications.api.rest_framework import APNSDeviceViewSet
+
+        request = APIRequestFactory().post("/device/%s/%s/" % (registration_id, action), data, format="json")
+        return APNSDeviceViewSet.as_view({"post": action})(request, registration_id=registration_id)
+
+    def test_subscribe_and_unsubscribe(self):
+        from push_notifications.models import Topic
+
+        device = APNSDevice.objects.create(registration_id="ae" * 32)
+        response = self.post("subscribe", device.registration_id, {"topic": "news"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(Topic.objects.get(name="news").apns_devices.all()), [device])
+
+        self.assertEqual(self.post("subscribe", device.registration_id, {"topic": "no spaces"}).status_code, 400)
+        self.assertEqual(self.post("unsubscribe", device.registration_id, {"topic": "unknown"}).status_code, 404)
+
+        response = self.post("unsubscribe", device.registration_id, {"topic": "news"})
+        self.assertEqual(response.data, {"topic": "news", "subscribed": False})
+        self.assertFalse(device.topics.exists())
@@ -0,0 +1,80 @@
+import warnings
+
+import mock
+from django.test import TestCase
+from push_notifications.gcm import gcm_send_bulk_message
+from push_notifications.models import GCMDevice
+from push_notifications.results import SendResult
+
+
+class SendResultTest(TestCase):
+	def test_merge(self):
+		first, second = SendResult(), SendResult()
+		first.add(1)
+		first.add(2, SendResult.ERROR, error="Unavailable")
+		second.add(3, canonical_id="new")
+		second.add(4, SendResult.INVALID, error="NotRegistered")
+		second.duplicates = 2
+		result = SendResult.merged([first, None, second])
+		self.assertEqual(list(result.pks), [1, 2, 3, 4])
+		self.assertEqual(result.canonical_ids, [None, None, "new", None])
+		self.assertEqual(list(result.statuses), [SendResult.SENT, SendResult.ERROR, SendResult.SENT, SendResult.INVALID])
+		self.assertEqual(result.errors, {1: "Unavailable", 3: "NotRegistered"})
+		self.assertEqual(result.canonical(), {3: "new"})
+		self.assertEqual(result.pks_with_status(SendResult.INVALID), [4])
+		self.assertEqual((result.count, result.success, result.failure, result.duplicates), (4, 2, 2, 2))
+		self.assertEqual(str(result), "2 sent, 1 invalid, 1 error, 2 duplicates")
+
+	def test_gcm_bulk_result(self):
+		devices = [GCMDevice.objects.create(registration_id=registration_id) for registration_id in ("abc", "abc1", "abc2")]
+		response = (
+			'{"multicast_id":108,"success":2,"failure":1,"canonical_ids":1,"results":['
+			'{"message_id":"1:08"},{"message_id":"1:09","registration_id":"abc3"},{"error":"NotRegistered"}]}'
+		)
+		with mock.patch("push_notifications.gcm._gcm_send", return_value=response):
+			result = gcm_send_bulk_message(GCMDevice.objects.all().recipients(), {"message": "Hello world"})
+		self.assertEqual(list(result.pks), [device.pk for device in devices])
+		self.assertEqual(list(result.statuses), [SendResult.SENT, SendResult.SENT, SendResult.INVALID])
+		self.assertEqual(result.canonical(), {devices[1].pk: "abc3"})
+		self.assertFalse(GCMDevice.objects.get(registration_id="abc2").active)
+
+		# the raw response is still available, by indexing the result too
+		self.assertEqual(result.legacy()["canonical_ids"], 1)
+		with warnings.catch_warnings(record=True) as caught:
+			warnings.simplefilter("always")
+			self.assertEqual(result["success"], 2)
+			self.assertIn("results", list(result))
+		self.assertEqual(caught[0].category, DeprecationWarning)
+
+	def test_empty_result(self):
+		result = SendResult()
+		self.assertFalse(result)
+		self.assertEqual(len(result), 0)
+		with warnings.catch_warnings():
+			warnings.simplefilter("ignore")
+			self.assertEqual(list(result), [])
+		result.add(1)
+		self.assertTrue(result)
+
+	def test_pks_fall_back_to_a_list(self):
+		result = SendResult()
+		result.add(1)
+		result.add(None)
+		result.add("uuid")
+		self.assertEqual(result.pks, [1, None, "uuid"])
+		self.assertEqual(list(SendResult.merged([SendResult(), result]).pks), [1, None, "uuid"])
+
+	def test_gcm_bulk_errors_are_rows(self):
+		devices = [GCMDevice.objects.create(registration_id=registration_id) for registration_id in ("abc", "abc1", "abc2")]
+		responses = [
+			'{"multicast_id":108,"success":1,"failure":1,"canonical_ids":0,"results":['
+			'{"message_id":"1:08"},{"error":"Unavailable"}]}',
+			'{"multicast_id":109,"success":1,"failure":0,"canonical_ids":0,"results":[{"message_id":"1:09"}]}',
+		]
+		with mock.patch.dict("push_notifications.settings.PUSH_NOTIFICATIONS_SETTINGS", {"GCM_MAX_RECIPIENTS": 2}):
+			with mock.patch("push_notifications.gcm._gcm_send", side_effect=responses):
+				result = gcm_send_bulk_message(GCMDevice.objects.all().recipients(), {"message": "Hello world"})
+		# the chunk after the error was sent too
+		self.assertEqual(list(result.statuses), [SendResult.SENT, SendResult.ERROR, SendResult.SENT])
+		self.assertEqual(result.pks_with_status(SendResult.ERROR), [devices[1].pk])
+		self.assertEqual(result.errors, {1: "Unavailable"})
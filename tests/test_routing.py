@@ -0,0 +1,36 @@
+import mock
+from django.db.utils import ConnectionDoesNotExist
+from django.test import TestCase
+from push_notifications.gcm import gcm_send_bulk_message
+from push_notifications.models import APNSDevice, GCMDevice, Recipient
+from push_notifications.routing import audience
+from push_notifications.settings import PUSH_NOTIFICATIONS_SETTINGS as SETTINGS
+from tests.mock_responses import GCM_JSON_RESPONSE_ERROR
+
+
+class ReadDatabaseTest(TestCase):
+	def test_audience(self):
+		queryset = GCMDevice.objects.all()
+		self.assertIs(audience(queryset), queryset)
+		with mock.patch.dict(SETTINGS, {"READ_DB": "replica"}):
+			self.assertEqual(audience(queryset).db, "replica")
+			# an explicit database wins
+			self.assertEqual(audience(queryset.using("default")).db, "default")
+
+	def test_sends_read_from_read_db(self):
+		GCMDevice.objects.create(registration_id="abc")
+		APNSDevice.objects.create(registration_id="ab" * 32)
+		# there is no "replica" database in the tests: reading from it fails
+		with mock.patch.dict(SETTINGS, {"READ_DB": "replica"}):
+			with self.assertRaises(ConnectionDoesNotExist):
+				GCMDevice.objects.all().send_message("Hello world")
+			with self.assertRaises(ConnectionDoesNotExist):
+				APNSDevice.objects.all().send_message("Hello world")
+
+	def test_invalidations_are_written_to_the_primary(self):
+		devices = [GCMDevice.objects.create(registration_id="abc%i" % (i)) for i in range(3)]
+		recipients = [Recipient.for_model(GCMDevice)(device.pk, device.registration_id) for device in devices]
+		with mock.patch.dict(SETTINGS, {"READ_DB": "replica"}):
+			with mock.patch("push_notifications.gcm._gcm_send", return_value=GCM_JSON_RESPONSE_ERROR):
+				gcm_send_bulk_message(recipients, {"message": "Hello world"})
+		self.assertEqual(GCMDevice.objects.filter(active=False).count(), 2)
@@ -0,0 +1,116 @@
+import json
+from datetime import datetime, timedelta
+
+import mock
+from django.test import TestCase
+from django.utils import timezone
+from push_notifications.gcm import GCMError
+from push_notifications.models import GCMDevice, ScheduledNotification
+from push_notifications.scheduler import local_due_at, schedule, schedule_local, send_due
+
+
+def gcm_respond(data, content_type, api_key=None):
+	registration_ids = json.loads(data.decode("utf-8"))["registration_ids"]
+	return json.dumps({"results": [{"message_id": "1:08"}] * len(registration_ids)})
+
+
+def run_sequentially(read, send, write, queue_size):
+	# the database of the tests is not shared with other threads
+	for batch in read:
+		write(send(batch))
+
+
+class SchedulerTest(TestCase):
+	def test_schedule_spread(self):
+		devices = [GCMDevice.objects.create(registration_id="abc%i" % (i)) for i in range(10)]
+		due_at = timezone.now()
+		notifications = schedule(GCMDevice, "Hello world", due_at, spread=120, buckets=4, extra={"foo": "bar"})
+		self.assertEqual(len(notifications), 4)
+		self.assertEqual(
+			[notification.due_at - due_at for notification in notifications],
+			[timedelta(seconds=30 * i) for i in range(4)]
+		)
+		self.assertIsNone(notifications[0].first_pk)
+		self.assertIsNone(notifications[-1].last_pk)
+		GCMDevice.objects.create(registration_id="abc10")
+		pks = sum([list(notification.get_queryset().values_list("pk", flat=True)) for notification in notifications], [])
+		self.assertEqual(sorted(pks), [device.pk for device in devices] + [devices[-1].pk + 1])
+		self.assertEqual(json.loads(notifications[0].payload), {"message": "Hello world", "kwargs": {"extra": {"foo": "bar"}}})
+
+	def test_local_due_at(self):
+		local_time = datetime(2026, 1, 15, 9)
+		self.assertEqual(local_due_at(local_time, "Europe/Brussels") - local_due_at(local_time, "Asia/Tokyo"), timedelta(hours=8))
+
+	def test_schedule_local(self):
+		for i, name in enumerate(["Europe/Brussels", "Europe/Brussels", "Asia/Tokyo", None]):
+			GCMDevice.objects.create(registration_id="abc%i" % (i), name=name)
+		notifications = schedule_local(GCMDevice, "Hello world", datetime(2026, 1, 15, 9), "name")
+		self.assertEqual([notification.get_filters() for notification in notifications], [
+			{"name": "Asia/Tokyo"}, {"name": "Europe/Brussels"}
+		])
+		self.assertEqual([notification.get_queryset().count() for notification in notifications], [1, 2])
+		self.assertEqual(notifications[1].due_at, local_due_at(datetime(2026, 1, 15, 9), "Europe/Brussels"))
+
+	def test_send_due(self):
+		for i in range(5):
+			GCMDevice.objects.create(registration_id="abc%i" % (i))
+		now = timezone.now()
+		due = schedule(GCMDevice, "Hello world", now - timedelta(minutes=1))[0]
+		schedule(GCMDevice, "Later", now + timedelta(hours=1))
+		already_sent = schedule(GCMDevice, "Already sent", now - timedelta(hours=1))[0]
+		ScheduledNotification.objects.filter(pk=already_sent.pk).update(date_sent=now)
+
+		with mock.patch("push_notifications.pipeline.pipeline", side_effect=run_sequentially):
+			with mock.patch("push_notifications.gcm._gcm_send", side_effect=gcm_respond) as p:
+				sent = send_due(chunk_size=2, now=now)
+				self.assertEqual(send_due(now=now), [])
+		self.assertEqual([notification.pk for notification in sent], [due.pk])
+		self.assertEqual(p.call_count, 3)
+		due = ScheduledNotification.objects.get(pk=due.pk)
+		self.assertIsNotNone(due.date_sent)
+		self.assertEqual((due.devices, due.failures, due.error), (5, 0, ""))
+		self.assertEqual(ScheduledNotification.objects.filter(date_sent__isnull=True).count(), 1)
+
+	def test_send_due_error(self):
+		GCMDevice.objects.create(registration_id="abc")
+		notification = schedule(GCMDevice, "Hello world", timezone.now())[0]
+		with mock.patch("push_notifications.pipeline.pipeline", side_effect=run_sequentially):
+			with mock.patch("push_notifications.gcm._gcm_send", side_effect=GCMError("Unavailable")):
+				send_due()
+		notification = ScheduledNotification.objects.get(pk=notification.pk)
+		self.assertIsNotNone(notification.date_sent)
+		self.assertEqual(notification.error, "Unavailable")
+
+	def test_send_due_unexpected_error(self):
+		GCMDevice.objects.create(registration_id="abc")
+		now = timezone.now()
+		notifications = [
+			schedule(GCMDevice, "Hello world", now - timedelta(minutes=3 - i))[0] for i in range(3)
+		]
+		results = [mock.Mock(count=1, failure=0), ValueError("Lost connection")]
+		with mock.patch("push_notifications.scheduler.send_pipelined", side_effect=results) as p:
+			with self.assertRaises(ValueError):
+				send_due(now=now)
+		self.assertEqual(p.call_count, 2)
+		first, second, third = [ScheduledNotification.objects.get(pk=notification.pk) for notification in notifications]
+		# the notifications sent keep their results, the one not sent is left for the next run
+		self.assertIsNotNone(first.date_sent)
+		self.assertEqual((first.devices, first.error), (1, ""))
+		self.assertIsNotNone(second.date_sent)
+		self.assertEqual(second.error, "ValueError: Lost connection")
+		self.assertIsNone(third.date_sent)
+		self.assertIsNone(third.date_claimed)
+
+		with mock.patch("push_notifications.scheduler.send_pipelined", return_value=mock.Mock(count=1, failure=0)):
+			self.assertEqual([notification.pk for notification in send_due(now=now)], [third.pk])
+
+	def test_expired_claims_are_sent(self):
+		GCMDevice.objects.create(registration_id="abc")
+		now = timezone.now()
+		stale, recent = [schedule(GCMDevice, "Hello world", now - timedelta(hours=2))[0] for i in range(2)]
+		# claimed by schedulers that died before sending
+		ScheduledNotification.objects.filter(pk=stale.pk).update(date_claimed=now - timedelta(hours=2))
+		ScheduledNotification.objects.filter(pk=recent.pk).update(date_claimed=now - timedelta(minutes=1))
+		with mock.patch("push_notifications.scheduler.send_pipelined", return_value=mock.Mock(count=1, failure=0)):
+			self.assertEqual([notification.pk for notification in send_due(now=now)], [stale.pk])
+		self.assertIsNone(ScheduledNotification.objects.get(pk=recent.pk).date_sent)
@@ -0,0 +1,85 @@
+import json
+
+import mock
+from django.core.management import call_command
+from django.test import TestCase
+from push_notifications import segments
+from push_notifications.models import GCMDevice, Segment
+from tests.mock_responses import GCM_JSON_RESPONSE_ERROR
+
+
+class RangesTest(TestCase):
+	def test_pks_to_ranges(self):
+		self.assertEqual(segments.pks_to_ranges([1, 2, 3, 5, 7, 8]), [[1, 3], [5, 5], [7, 8]])
+		self.assertEqual(segments.count([[1, 3], [5, 5], [7, 8]]), 6)
+
+	def test_contains(self):
+		ranges = [[2, 3], [5, 7]]
+		self.assertTrue(segments.contains(ranges, 6))
+		self.assertFalse(segments.contains(ranges, 4))
+		self.assertFalse(segments.contains(ranges, 1))
+
+
+class SegmentTest(TestCase):
+	def test_segment_membership(self):
+		devices = [GCMDevice.objects.create(registration_id="abc%i" % (i), name="fr") for i in range(4)]
+		GCMDevice.objects.create(registration_id="other", name="en")
+		segment = Segment.objects.create(name="french", service=Segment.GCM, filters=json.dumps({"name": "fr", "active": True}))
+		segment.refresh()
+		self.assertEqual(segment.count(), 4)
+		self.assertEqual(len(segment.get_ranges()), 1)
+
+		new = GCMDevice.objects.create(registration_id="new", name="fr")
+		devices[1].name = "en"
+		devices[1].save()
+		devices[2].delete()
+		segment.refresh_from_db()
+		self.assertTrue(segment.contains(new))
+		self.assertFalse(segment.contains(devices[1]))
+		self.assertEqual(
+			sorted(segment.devices().values_list("registration_id", flat=True)),
+			["abc0", "abc3", "new"]
+		)
+
+		GCMDevice.objects.invalidate(["abc3"])
+		segment.refresh_from_db()
+		self.assertFalse(segment.contains(devices[3]))
+		self.assertEqual(segment.count(), 2)
+
+	def test_send_to_segment(self):
+		for i in range(3):
+			GCMDevice.objects.create(registration_id="abc%i" % (i))
+		segment = Segment.objects.create(name="all", service=Segment.GCM, filters=json.dumps({"active": True}))
+		segment.refresh()
+		with mock.patch("push_notifications.gcm._gcm_send", return_value=GCM_JSON_RESPONSE_ERROR) as p:
+			segment.send_message("Hello world")
+		self.assertEqual(json.loads(p.call_args[0][0].decode("utf-8"))["registration_ids"], ["abc0", "abc1", "abc2"])
+		# invalidated devices leave the segment
+		segment.refresh_from_db()
+		self.assertEqual(list(segment.devices().values_list("registration_id", flat=True)), ["abc1"])
+
+	def test_device_changes_mark_segments_dirty(self):
+		GCMDevice.objects.create(registration_id="abc", name="fr")
+		segments = [
+			Segment.objects.create(name=name, service=Segment.GCM, filters=json.dumps({"name": name}))
+			for name in ("fr", "en")
+		]
+		for segment in segments:
+			segment.refresh()
+
+		# a single statement, whatever the number of segments
+		with self.assertNumQueries(2):
+			GCMDevice.objects.create(registration_id="abc1", name="fr")
+		self.assertEqual(Segment.objects.filter(dirty=True).count(), 2)
+		# which matches no rows while the segments are dirty
+		with self.assertNumQueries(2):
+			GCMDevice.objects.create(registration_id="abc2", name="en")
+
+		call_command("refresh_segments", stdout=mock.Mock())
+		self.assertFalse(Segment.objects.filter(dirty=True).exists())
+		GCMDevice.objects.upsert("abc", name="en")
+		segment = Segment.objects.get(name="en")
+		self.assertTrue(segment.dirty)
+		# refreshed when read
+		self.assertEqual(sorted(segment.devices().values_list("registration_id", flat=True)), ["abc", "abc2"])
+		self.assertFalse(Segment.objects.get(name="en").dirty)
@@ -0,0 +1,20 @@
+from django.test import TestCase
+from push_notifications.api.tastypie import GCMDeviceResource
+from push_notifications.models import GCMDevice
+from tastypie.bundle import Bundle
+
+
+class DeviceResourceTest(TestCase):
+	def create(self, data):
+		resource = GCMDeviceResource()
+		return resource.obj_create(Bundle(data=data), **{})
+
+	def test_registration_is_idempotent(self):
+		self.create({"registration_id": "abc", "name": "first"})
+		GCMDevice.objects.update(active=False)
+		bundle = self.create({"registration_id": "abc", "name": "second"})
+		device = GCMDevice.objects.get()
+		self.assertEqual(bundle.obj.pk, device.pk)
+		self.assertEqual(device.name, "second")
+		# registering an invalidated device again reactivates it
+		self.assertTrue(device.active)
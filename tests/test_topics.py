@@ -0,0 +1,66 @@
+import json
+
+import mock
+from django.test import TestCase
+from push_notifications.gcm import gcm_send_topic_message
+from push_notifications.models import APNSDevice, GCMDevice, Topic
+
+
+class TopicTest(TestCase):
+	def test_topic_payload(self):
+		with mock.patch("push_notifications.gcm._gcm_send", return_value='{"message_id":1}') as p:
+			gcm_send_topic_message("news", {"message": "Hello world"}, time_to_live=3600)
+			p.assert_called_once_with(
+				b'{"data":{"message":"Hello world"},"time_to_live":3600,"to":"/topics/news"}',
+				"application/json",
+				api_key=None
+			)
+
+	def test_gcm_subscription(self):
+		devices = [GCMDevice.objects.create(registration_id=registration_id) for registration_id in ("abc", "123")]
+		topic = Topic.objects.create(name="news")
+		response = '{"results":[{},{"error":"NOT_FOUND"}]}'
+		with mock.patch("push_notifications.gcm._gcm_request", return_value=response) as p:
+			topic.subscribe(GCMDevice.objects.all())
+			p.assert_called_once_with(
+				"https://iid.googleapis.com/iid/v1:batchAdd",
+				b'{"registration_tokens":["abc","123"],"to":"/topics/news"}',
+				"application/json",
+				api_key=None
+			)
+		self.assertEqual(set(topic.gcm_devices.all()), set(devices))
+		self.assertFalse(GCMDevice.objects.get(registration_id="123").active)
+
+		with mock.patch("push_notifications.gcm._gcm_request", return_value='{"results":[{}]}') as p:
+			topic.unsubscribe(devices[:1])
+			self.assertEqual(p.call_args[0][0], "https://iid.googleapis.com/iid/v1:batchRemove")
+		self.assertEqual(list(topic.gcm_devices.all()), devices[1:])
+		self.assertEqual(list(devices[1].topics.all()), [topic])
+
+	def test_topic_send_message(self):
+		topic = Topic.objects.create(name="news")
+		apns_devices = [APNSDevice.objects.create(registration_id="%02i" % (i) * 32) for i in range(3)]
+		apns_devices[2].active = False
+		apns_devices[2].save()
+		topic.subscribe(apns_devices)
+		with mock.patch("push_notifications.gcm._gcm_request", return_value='{"results":[{}]}'):
+			topic.subscribe([GCMDevice.objects.create(registration_id="abc")])
+
+		with mock.patch("push_notifications.models.apns_send_bulk_message") as apns:
+			with mock.patch("push_notifications.gcm._gcm_send", return_value='{"message_id":1}') as gcm:
+				ret = topic.send_message("Hello world", extra={"foo": "bar"})
+		self.assertEqual(ret["gcm"], {"message_id": 1})
+		recipients = apns.call_args[1]["devices"]
+		self.assertEqual([recipient.pk for recipient in recipients], [device.pk for device in apns_devices[:2]])
+		self.assertEqual(json.loads(gcm.call_args[0][0].decode("utf-8")), {
+			"data": {"foo": "bar", "message": "Hello world"},
+			"to": "/topics/news",
+		})
+
+	def test_topic_send_message_with_backend(self):
+		topic = Topic.objects.create(name="news")
+		with mock.patch("push_notifications.gcm._gcm_request", return_value='{"results":[{}]}'):
+			topic.subscribe([GCMDevice.objects.create(registration_id="abc")])
+		with mock.patch("push_notifications.gcm._gcm_send", return_value='{"message_id":1}') as gcm:
+			topic.send_message("Hello world", backend="fcm")
+		self.assertNotIn("backend", json.loads(gcm.call_args[0][0].decode("utf-8")))